@@ -1,180 +1,382 @@
 import streamlit as st
 import datetime
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import time
+t_import = time.perf_counter() # tempo di import dei moduli galbino, riportato dal riscaldamento
+from galbino import percorso_dati
+from galbino.aggiornamenti import aggiorna_colonna, righe_cambiate
+from galbino.archivio_locale import ArchivioLocale, Replicatore
+from galbino.avvio import Riscaldamento, passi_import, registra_import_app
+from galbino.coda_salvataggi import CodaSalvataggi
+from galbino.diario import AnalisiDiario, recenti, riga_seduta, serie_date
+from galbino.interfaccia import badge_non_aggiornati, salvataggi_falliti
+from galbino.report_diario import FASCE_ANZIANITA, PERIODI, STATI_PAGAMENTO, ReportDiario
+from galbino.resilienza import errore_transitorio
+from galbino.sheets import ConnessioneSheets
+from galbino.sincronizzazione import SincronizzatoreFoglio
+from galbino.tracciamento import TRACCIATORE, span
+durata_import = time.perf_counter() - t_import
 
 # --- CONFIGURAZIONE PAGINA ---
 st.set_page_config(page_title="Diario Clinico", page_icon="🧠", layout="centered")
 
+# Tempi di rerun e chiamate Google: log a rotazione + metriche Prometheus
+@st.cache_resource
+def configura_tracciamento():
+    TRACCIATORE.configura(percorso_dati("tracce_psico.log"), percorso_dati("metriche_psico.prom"))
+
+configura_tracciamento()
+
 # ==============================================================================
 # 1. COLLEGAMENTO DATABASE
 # ==============================================================================
-def get_db():
+# Client autorizzato e handle dei fogli condivisi tra rerun e sessioni
+@st.cache_resource
+def get_connessione():
+    return ConnessioneSheets(st.secrets["psico_service_account"])
+
+def get_foglio(titolo):
+    return get_connessione().foglio(st.secrets["psico"]["spreadsheet_url"], titolo)
+
+def get_foglio_diario():
+    # None se Google non risponde: si lavora sulla copia locale e le sedute restano in coda
     try:
-        scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-        creds_dict = dict(st.secrets["psico_service_account"])
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-        return client.open_by_url(st.secrets["psico"]["spreadsheet_url"])
+        return get_foglio("Diario")
     except Exception as e:
+        if errore_transitorio(e): return None
+        get_connessione().invalida()
         st.error(f"Errore di connessione: {e}")
         st.stop()
 
+# Le sedute vanno prima nel giornale locale, poi a Google in background
+@st.cache_resource
+def get_coda():
+    return CodaSalvataggi(get_connessione(), percorso_dati("coda_psico.sqlite3"))
+
+# Riscaldamento del processo alla prima pagina: import di gspread & co. e
+# autorizzazione Google in background, mentre si disegna il modulo
+@st.cache_resource
+def avvia_riscaldamento():
+    registra_import_app(durata_import)
+    passi = passi_import(("gspread", "oauth2client.service_account", "requests"))
+    try:
+        connessione, url = get_connessione(), st.secrets["psico"]["spreadsheet_url"]
+        passi += [("sheets_autorizzazione", connessione.client), ("sheets_foglio_diario", lambda: connessione.foglio(url, "Diario"))]
+    except Exception:
+        pass # secrets incompleti: si scaldano solo gli import
+    return Riscaldamento(passi, durata_import).avvia()
+
+avvia_riscaldamento()
+
 # ==============================================================================
 # 2. LOGICA INTELLIGENTE (Anagrafica + Storico)
 # ==============================================================================
-def get_dati_intelligenti(sheet_diario, sh_generale):
-    
-    pazienti_last_date = {}
-    pazienti_last_price = {}
-    nomi_anagrafica = []
+# Copia locale del Diario: ad ogni rerun si scaricano solo le righe nuove
+@st.cache_resource
+def get_sync_diario():
+    url = st.secrets["psico"]["spreadsheet_url"]
+    return SincronizzatoreFoglio(percorso_dati("snapshot_diario.json"), f"{url}#Diario", larghezza=6)
+
+# Copia locale dell'anagrafica: è piccola e si modifica a mano, quindi sempre riletta per intero;
+# serve come ultima copia buona quando Google non risponde
+@st.cache_resource
+def get_sync_pazienti():
+    url = st.secrets["psico"]["spreadsheet_url"]
+    return SincronizzatoreFoglio(percorso_dati("snapshot_pazienti.json"), f"{url}#Pazienti", larghezza=2, verifica_completa=0)
+
+# Archivio SQLite locale opzionale (secrets: archivio_locale = true): letture
+# in millisecondi, fogli allineati in background
+def usa_archivio():
+    return bool(st.secrets.get("archivio_locale", False))
+
+@st.cache_resource
+def get_replicatore():
+    url = st.secrets["psico"]["spreadsheet_url"]
+    rep = Replicatore(get_connessione(), ArchivioLocale(percorso_dati("archivio_psico.sqlite3")))
+    rep.registra("diario", url, "Diario", get_sync_diario())
+    rep.registra("pazienti", url, "Pazienti", get_sync_pazienti())
+    return rep
 
-    # --- FASE A: LEGGI ANAGRAFICA (Foglio Pazienti) ---
+# Ultima visita/prezzo e indice di ricerca dei pazienti, aggiornati solo con le righe nuove
+@st.cache_resource
+def get_analisi():
+    return AnalisiDiario()
+
+def leggi_pazienti():
+    if usa_archivio():
+        rep = get_replicatore()
+        # Solo al primo avvio si aspetta Google, poi si legge sempre dall'archivio
+        if not rep.archivio.pronto("pazienti"):
+            try: rep.aggiorna("pazienti")
+            except: pass # Se manca il foglio, prosegue senza errori
+        return rep.archivio.righe("pazienti")
+    sinc = get_sync_pazienti()
     try:
-        ws_pazienti = sh_generale.worksheet("Pazienti")
-        dati_pazienti = ws_pazienti.get_all_values()
-        
-        # Salta intestazione (riga 1)
-        for row in dati_pazienti[1:]:
-            if len(row) >= 1:
-                nome = row[0].strip()
-                if nome:
-                    nomi_anagrafica.append(nome)
-                    
-                    # Se c'è un prezzo nella colonna B, lo memorizza
-                    if len(row) >= 2:
-                        try:
-                            # Pulisce il prezzo
-                            p_clean = row[1].replace("€", "").replace(",", ".").strip()
-                            if p_clean:
-                                pazienti_last_price[nome] = float(p_clean)
-                        except:
-                            pass 
-    except:
-        pass # Se manca il foglio, prosegue senza errori
-
-    # --- FASE B: LEGGI LO STORICO (Diario) ---
-    # Lo storico vince sull'anagrafica (aggiorna il prezzo all'ultimo usato)
-    data_diario = sheet_diario.get_all_values()
-    
-    for row in data_diario[1:]:
-        if len(row) > 3:
-            data_str = row[0]
-            nome = row[1].strip()
-            prezzo_str = row[3].replace("€", "").replace(",", ".").strip()
-            
-            if nome and data_str:
-                try:
-                    dt = datetime.datetime.strptime(data_str, "%d/%m/%Y").date()
-                    
-                    # Aggiorna data ultima visita
-                    if nome not in pazienti_last_date or dt > pazienti_last_date[nome]:
-                        pazienti_last_date[nome] = dt
-                    
-                    # Aggiorna ultimo prezzo pagato
-                    if prezzo_str:
-                        valore = float(prezzo_str)
-                        if valore > 0:
-                            pazienti_last_price[nome] = valore
-                except:
-                    pass
-
-    # --- FASE C: LISTE FINALI ---
-    oggi = datetime.date.today()
-    
-    # Lista Attiva: Anagrafica + Recenti (90gg)
-    attivi_set = set(nomi_anagrafica)
-    for p, data_ult in pazienti_last_date.items():
-        delta = (oggi - data_ult).days
-        if delta <= 90:
-            attivi_set.add(p)
-            
-    attivi = list(attivi_set)
-    attivi.sort()
+        with span("sheets.lettura_pazienti"):
+            return sinc.sincronizza(get_foglio("Pazienti"))
+    except Exception as e:
+        # Se manca il foglio, prosegue senza errori; se Google non risponde, ultima copia buona
+        if errore_transitorio(e) and sinc.righe: badge_non_aggiornati("anagrafica", sinc.ultima_lettura["inizio"], e)
+        return list(sinc.righe)
+
+def sorgente_diario(sheet_diario):
+    # -> (generazione, leggi(n) = righe dopo la riga n, sedute in coda non ancora lette)
+    if usa_archivio():
+        rep = get_replicatore()
+        if not rep.archivio.pronto("diario"):
+            rep.aggiorna("diario")
+        generazione, letto_il = rep.archivio.generazione("diario"), rep.archivio.letto_il("diario")
+        if "diario" in rep.errori: badge_non_aggiornati("Diario", letto_il, rep.errori["diario"])
+        leggi = lambda n: rep.archivio.righe("diario", con_intestazione=False, dopo_riga=n)
+    else:
+        # Diario dal foglio, scaricando solo le righe nuove
+        sinc = get_sync_diario()
+        try:
+            data_diario = sinc.sincronizza(sheet_diario if sheet_diario is not None else get_foglio("Diario"))
+        except Exception as e:
+            # Google lento o irraggiungibile: si resta sull'ultima copia buona (snapshot su disco)
+            if not sinc.righe or not errore_transitorio(e): raise
+            badge_non_aggiornati("Diario", sinc.ultima_lettura["inizio"], e)
+            data_diario = list(sinc.righe)
+        generazione, letto_il = sinc.generazione, sinc.ultima_lettura["inizio"]
+        leggi = lambda n: data_diario[n:]
     
-    # Archivio: Tutto
-    storico_completo = list(set(list(pazienti_last_date.keys()) + nomi_anagrafica))
-    storico_completo.sort()
-            
-    return attivi, storico_completo, pazienti_last_price
+    # Include le sedute appena registrate e non ancora arrivate nella lettura
+    in_attesa = get_coda().in_attesa(st.secrets["psico"]["spreadsheet_url"], "Diario", inviate_dopo=letto_il)
+    return generazione, leggi, in_attesa
+
+def get_dati_intelligenti(sheet_diario):
+    
+    # --- FASE A: ANAGRAFICA (Foglio Pazienti) ---
+    dati_pazienti = leggi_pazienti()
+    
+    # --- FASE B: STORICO (Diario, solo le righe nuove) ---
+    generazione, leggi, in_attesa = sorgente_diario(sheet_diario)
+    analisi = get_analisi()
+    analisi.aggiorna(generazione, leggi)
+    
+    attivi, memoria_prezzi, ultime_visite, indice = analisi.risultato(dati_pazienti, in_attesa)
+    return attivi, indice, memoria_prezzi, ultime_visite
+
+# Tabella delle sedute e aggregati dei report, aggiornati solo con le righe nuove
+@st.cache_resource
+def get_report():
+    return ReportDiario()
+
+def pagina_report(sheet_diario):
+    generazione, leggi, in_attesa = sorgente_diario(sheet_diario)
+    report = get_report()
+    report.aggiorna(generazione, leggi)
+    
+    st.subheader("📊 Incassi")
+    c1, c2 = st.columns(2)
+    with c1: periodo = st.radio("Periodo", list(PERIODI), horizontal=True)
+    per_periodo = report.per_periodo(periodo, in_attesa)
+    if per_periodo.empty:
+        st.info("Nessuna seduta registrata.")
+        return
+    
+    euro = {c: st.column_config.NumberColumn(format="€ %.2f") for c in per_periodo.columns if c.endswith("€")}
+    st.dataframe(per_periodo, use_container_width=True, column_config=euro)
+    
+    with c2: valore_periodo = st.selectbox("Dettaglio pazienti", list(per_periodo.index))
+    per_paziente = report.per_paziente(periodo, valore_periodo, in_attesa)
+    euro = {c: st.column_config.NumberColumn(format="€ %.2f") for c in per_paziente.columns if c.endswith("€")}
+    st.dataframe(per_paziente, use_container_width=True, column_config=euro)
+    
+    st.subheader("⏳ Da incassare")
+    aperte = report.da_incassare(datetime.date.today(), in_attesa)
+    if aperte.empty:
+        st.success("Nessuna seduta da incassare.")
+        return
+    colonne = st.columns(len(FASCE_ANZIANITA))
+    for col, (_, fascia) in zip(colonne, FASCE_ANZIANITA):
+        della_fascia = aperte[aperte["Fascia"] == fascia]
+        col.metric(fascia, f"€ {della_fascia['Importo'].sum():,.2f}", f"{len(della_fascia)} sedute", delta_color="off")
+    st.dataframe(aperte[["Data", "Paziente", "Modalità", "Importo", "Giorni", "Fascia"]], use_container_width=True, hide_index=True,
+                 column_config={"Data": st.column_config.DateColumn(format="DD/MM/YYYY"), "Importo": st.column_config.NumberColumn(format="€ %.2f")})
+
+def segna_sedute(sheet_diario, righe, stato):
+    # Colonna F (stato) di molte sedute: un batch_get di controllo + un solo batch_update
+    sinc = get_sync_diario()
+    attese = {n: sinc.righe[n - 1] for n in righe if n <= len(sinc.righe)}
+    cambiate = righe_cambiate(sheet_diario, attese, 6) if len(attese) == len(righe) else list(righe)
+    if cambiate:
+        # Il foglio è stato modificato a mano: si rilegge tutto prima di riprovare
+        sinc.forza_verifica()
+        if usa_archivio(): get_replicatore().richiedi()
+        return cambiate
+    valori = {n: stato for n in righe}
+    aggiorna_colonna(sheet_diario, 6, valori)
+    if usa_archivio(): get_replicatore().correggi("diario", 6, valori)
+    else: sinc.correggi(6, valori)
+    return []
+
+def pagina_pagamenti(sheet_diario):
+    generazione, leggi, in_attesa = sorgente_diario(sheet_diario)
+    report = get_report()
+    report.aggiorna(generazione, leggi)
+    # Solo sedute già sul foglio: quelle ancora in coda non hanno un numero di riga
+    sedute = report.sedute()
+    
+    st.subheader("💶 Pagamenti")
+    c1, c2, c3 = st.columns(3)
+    with c1: stato_attuale = st.selectbox("Stato attuale", STATI_PAGAMENTO)
+    candidate = sedute[sedute["Stato"] == stato_attuale]
+    with c2: paziente = st.selectbox("Paziente", ["Tutti"] + sorted(candidate["Paziente"].unique()))
+    if paziente != "Tutti": candidate = candidate[candidate["Paziente"] == paziente]
+    mesi = candidate["Data"].dt.strftime("%Y-%m")
+    with c3: mese = st.selectbox("Mese", ["Tutti"] + sorted(mesi.unique(), reverse=True))
+    if mese != "Tutti": candidate = candidate[mesi == mese]
+    if in_attesa: st.caption(f"☁️ {len(in_attesa)} sedute appena registrate si potranno segnare dopo l'invio a Google.")
+    if sheet_diario is None: st.warning("Google non risponde: i pagamenti si potranno segnare quando torna raggiungibile.")
+    if candidate.empty:
+        st.info("Nessuna seduta con questi filtri.")
+        return
+    
+    # Tutte selezionate: si tolgono solo le eccezioni
+    tabella = candidate[["Riga", "Data", "Paziente", "Modalità", "Importo"]].assign(Segna=True)
+    modificata = st.data_editor(
+        tabella, hide_index=True, use_container_width=True, disabled=["Riga", "Data", "Paziente", "Modalità", "Importo"],
+        column_config={"Riga": None, "Data": st.column_config.DateColumn(format="DD/MM/YYYY"),
+                       "Importo": st.column_config.NumberColumn(format="€ %.2f"), "Segna": st.column_config.CheckboxColumn("✔")},
+        key=f"pagamenti_{stato_attuale}_{paziente}_{mese}_{report.versione}")
+    scelte = modificata[modificata["Segna"]]
+    
+    c1, c2 = st.columns([1, 1])
+    with c1: nuovo_stato = st.radio("Segna come", [s for s in STATI_PAGAMENTO if s != stato_attuale], horizontal=True)
+    with c2: st.metric("Selezionate", f"{len(scelte)} sedute", f"€ {scelte['Importo'].sum():,.2f}", delta_color="off")
+    
+    if st.button(f"💶 SEGNA {len(scelte)} SEDUTE COME {nuovo_stato}", type="primary", use_container_width=True, disabled=scelte.empty or sheet_diario is None):
+        cambiate = segna_sedute(sheet_diario, [int(n) for n in scelte["Riga"]], nuovo_stato)
+        if cambiate:
+            st.error(f"Il foglio Diario è stato modificato (righe {', '.join(map(str, cambiate[:10]))}): la copia locale verrà riletta, controlla e riprova.")
+            return
+        st.toast(f"✅ {len(scelte)} sedute segnate come {nuovo_stato}")
+        st.rerun()
 
 # ==============================================================================
 # 3. INTERFACCIA UTENTE
 # ==============================================================================
 st.title("🧠 Diario Clinico")
 
-try:
-    sh = get_db()
-    ws_diario = sh.worksheet("Diario")
+with span("rerun.app_psico"):
+    try:
+        ws_diario = get_foglio_diario()
     
-    # Legge i dati
-    attivi, storico, memoria_prezzi = get_dati_intelligenti(ws_diario, sh)
+        sezione = st.sidebar.radio("Sezione", ["📝 Registra Seduta", "📊 Report", "💶 Pagamenti"])
+        if sezione == "📊 Report":
+            pagina_report(ws_diario)
+            st.stop()
+        if sezione == "💶 Pagamenti":
+            pagina_pagamenti(ws_diario)
+            st.stop()
     
-    # --- FORM ---
+        # Legge i dati
+        attivi, indice_pazienti, memoria_prezzi, ultime_visite = get_dati_intelligenti(ws_diario)
     
-    # 1. DATA
-    data_seduta = st.date_input("Data Seduta", datetime.date.today(), format="DD/MM/YYYY")
-    st.write("")
+        # --- FORM ---
     
-    # 2. PAZIENTE
-    scelta = st.radio("Paziente", ["Lista Attiva", "Archivio", "➕ Nuovo"], horizontal=True, label_visibility="collapsed")
+        # 1. DATA
+        data_seduta = st.date_input("Data Seduta", datetime.date.today(), format="DD/MM/YYYY")
+        st.write("")
     
-    paziente = ""
-    if scelta == "Lista Attiva":
-        if attivi:
-            paziente = st.selectbox("Seleziona Paziente", attivi)
-        else:
-            st.info("Nessun paziente. Aggiungili nel foglio 'Pazienti' colonna A.")
-    elif scelta == "Archivio":
-        if storico:
-            paziente = st.selectbox("Cerca nell'archivio", storico)
+        # 2. PAZIENTE
+        scelta = st.radio("Paziente", ["Lista Attiva", "Archivio", "➕ Nuovo"], horizontal=True, label_visibility="collapsed")
+    
+        paziente = ""
+        if scelta == "Lista Attiva":
+            if attivi:
+                paziente = st.selectbox("Seleziona Paziente", attivi)
+            else:
+                st.info("Nessun paziente. Aggiungili nel foglio 'Pazienti' colonna A.")
+        elif scelta == "Archivio":
+            if len(indice_pazienti):
+                # Al browser arrivano solo i primi risultati, non tutto l'archivio
+                testo = st.text_input("Cerca nell'archivio", placeholder="Nome o cognome, anche parziale")
+                trovati = indice_pazienti.cerca(testo, 20, ultime_visite) if testo.strip() else recenti(ultime_visite, 20)
+                
+                def descrivi(nome):
+                    dettagli = [nome]
+                    if nome in ultime_visite: dettagli.append(f"ultima visita {ultime_visite[nome].strftime('%d/%m/%Y')}")
+                    if nome in memoria_prezzi: dettagli.append(f"€ {memoria_prezzi[nome]:.2f}")
+                    return " — ".join(dettagli)
+                
+                if trovati:
+                    paziente = st.selectbox("Risultati" if testo.strip() else "Visti di recente", trovati, format_func=descrivi)
+                else:
+                    st.info("Nessun paziente trovato.")
+            else:
+                st.warning("Archivio vuoto.")
         else:
-            st.warning("Archivio vuoto.")
-    else:
-        paziente = st.text_input("Nome Nuovo Paziente").strip()
+            paziente = st.text_input("Nome Nuovo Paziente").strip()
         
-    st.write("")
+        st.write("")
     
-    # 3. DETTAGLI
-    c1, c2 = st.columns([1, 1])
+        # 3. DETTAGLI
+        c1, c2 = st.columns([1, 1])
     
-    with c1:
-        tipo = st.radio("Modalità", ["Presenza", "Online"])
+        with c1:
+            tipo = st.radio("Modalità", ["Presenza", "Online"])
         
-    with c2:
-        prezzo_suggerito = 0.0
-        msg_help = "Inserisci l'importo"
+        with c2:
+            prezzo_suggerito = 0.0
+            msg_help = "Inserisci l'importo"
         
-        # Recupera il prezzo dalla memoria (Anagrafica o Storico)
-        if paziente in memoria_prezzi and scelta != "➕ Nuovo":
-            prezzo_suggerito = memoria_prezzi[paziente]
-            msg_help = f"Prezzo standard/ultimo: € {prezzo_suggerito:.2f}"
+            # Recupera il prezzo dalla memoria (Anagrafica o Storico)
+            if paziente in memoria_prezzi and scelta != "➕ Nuovo":
+                prezzo_suggerito = memoria_prezzi[paziente]
+                msg_help = f"Prezzo standard/ultimo: € {prezzo_suggerito:.2f}"
             
-        prezzo = st.number_input("Prezzo (€)", min_value=0.0, value=prezzo_suggerito, step=5.0, help=msg_help)
+            prezzo = st.number_input("Prezzo (€)", min_value=0.0, value=prezzo_suggerito, step=5.0, help=msg_help)
 
-    # 4. NOTE
-    note = st.text_area("Note (Opzionale)", height=80)
+        # 4. NOTE
+        note = st.text_area("Note (Opzionale)", height=80)
+    
+        # 5. SERIE (pazienti settimanali: tutte le sedute del periodo in un colpo)
+        serie = st.toggle("🔁 Serie di sedute", help="Stesso giorno della settimana fino alla data scelta")
+        date_sedute = [data_seduta]
+        if serie:
+            c1, c2 = st.columns([1, 1])
+            with c1:
+                fine_serie = st.date_input("Fino al", data_seduta + datetime.timedelta(weeks=4), min_value=data_seduta, format="DD/MM/YYYY")
+            with c2:
+                frequenza = st.radio("Frequenza", ["Settimanale", "Ogni 2 settimane"], horizontal=True)
+            ogni_settimane = 1 if frequenza == "Settimanale" else 2
+            saltate = st.multiselect("Salta le date", serie_date(data_seduta, fine_serie, ogni_settimane), format_func=lambda d: d.strftime("%d/%m/%Y"))
+            date_sedute = serie_date(data_seduta, fine_serie, ogni_settimane, saltate)
+            
+            if date_sedute:
+                anteprima = [riga_seduta(d, paziente, tipo, prezzo, note) for d in date_sedute]
+                st.dataframe([{"Data": r[0], "Paziente": r[1], "Modalità": r[2], "Prezzo": r[3]} for r in anteprima],
+                             use_container_width=True, hide_index=True)
+                st.caption(f"{len(date_sedute)} sedute · totale € {prezzo * len(date_sedute):.2f}")
+            else:
+                st.info("Nessuna data nella serie.")
     
-    st.divider()
+        st.divider()
     
-    # 5. SALVATAGGIO
-    is_ready = paziente != "" and prezzo > 0
+        # 6. SALVATAGGIO
+        is_ready = paziente != "" and prezzo > 0 and bool(date_sedute)
+        etichetta = f"💾 REGISTRA {len(date_sedute)} SEDUTE" if serie else "💾 REGISTRA SEDUTA"
     
-    if st.button("💾 REGISTRA SEDUTA", type="primary", use_container_width=True, disabled=not is_ready):
-        riga = [
-            data_seduta.strftime("%d/%m/%Y"),
-            paziente,
-            tipo,
-            f"{prezzo:.2f}".replace(".", ","),
-            note,
-            "DA FARE"
-        ]
+        if st.button(etichetta, key="registra", type="primary", use_container_width=True, disabled=not is_ready):
+            righe = [riga_seduta(d, paziente, tipo, prezzo, note) for d in date_sedute]
         
-        ws_diario.append_row(riga)
-        st.success(f"✅ Salvato: {paziente} - € {prezzo}")
-        time.sleep(1.5)
-        st.rerun()
+            # Tutta la serie in un solo accodamento -> un solo append_rows verso Google
+            get_coda().accoda(st.secrets["psico"]["spreadsheet_url"], "Diario", righe)
+            if len(righe) > 1: st.toast(f"✅ Salvate {len(righe)} sedute: {paziente} - € {prezzo} cad.")
+            else: st.toast(f"✅ Salvato: {paziente} - € {prezzo}")
+            st.rerun()
+    
+        stato = get_coda().stato()
+        if stato["fallite"]: salvataggi_falliti(get_coda(), "sedute", st)
+        if stato["ultimo_errore"]:
+            st.warning(f"☁️ {stato['in_attesa']} sedute in attesa di invio (nuovo tentativo in corso): {stato['ultimo_errore']}")
+        elif stato["in_attesa"]:
+            st.caption(f"☁️ {stato['in_attesa']} sedute in invio a Google...")
+        elif not stato["fallite"]:
+            st.caption("☁️ Tutte le sedute sono su Google")
         
-except Exception as e:
-    st.error(f"Si è verificato un errore: {e}")
+    except Exception as e:
+        get_connessione().invalida_se_serve(e)
+        st.error(f"Si è verificato un errore: {e}")
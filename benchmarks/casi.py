@@ -0,0 +1,364 @@
+# ==============================================================================
+# BENCHMARK: CASI (prezzi, stagioni, iCal, Excel, diario)
+# ==============================================================================
+# Ogni caso: funzione(contesto) da cronometrare, più prepara()/chiudi() opzionali
+# eseguiti fuori dal tempo misurato.
+
+import datetime
+import hashlib
+import os
+import random
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
+
+from galbino.archivio_locale import ArchivioLocale
+from galbino.cruscotto_catering import CruscottoCatering
+from galbino.diario import AnalisiDiario, analizza_dati
+from galbino.disponibilita import CacheCalendario, IndiceOccupazione
+from galbino.documenti import genera_excel_catering, generate_excel
+from galbino.finestre import finestre_libere
+from galbino.listino import calcola_listino
+from galbino.preventivi import intestazione_preventivi, riga_preventivo
+from galbino.preventivi_batch import prezza_tutte
+from galbino.quota import RegolatoreQuota
+from galbino.report_diario import ReportDiario
+from galbino.resilienza import Circuiti, proteggi_sessione
+from galbino.sincronizzazione import SincronizzatoreFoglio
+from galbino.tariffe import LISTA_SERVIZI, calcola_pasqua, calcola_soggiorno_airbnb, get_stagione, tabella_tariffe
+
+CASI = {}
+
+
+def caso(nome, ripetizioni=10, prepara=None, chiudi=None):
+    def registra(funzione):
+        CASI[nome] = {"funzione": funzione, "ripetizioni": ripetizioni, "prepara": prepara, "chiudi": chiudi}
+        return funzione
+    return registra
+
+
+# --- Stagioni e prezzi ---
+
+@caso("stagione.get_stagione_1990_2049", ripetizioni=5)
+def _(_):
+    giorno, fine = datetime.date(1990, 1, 1), datetime.date(2050, 1, 1)
+    while giorno < fine:
+        get_stagione(giorno)
+        giorno += datetime.timedelta(days=1)
+
+@caso("stagione.calcola_pasqua_1583_2999", ripetizioni=20)
+def _(_):
+    for anno in range(1583, 3000): calcola_pasqua(anno)
+
+@caso("tariffe.compila_tabella_anno", ripetizioni=10)
+def _(_):
+    tabella_tariffe.cache_clear()
+    tabella_tariffe(2030, 2030)
+
+def _arrivi(n=1000):
+    rnd = random.Random(42)
+    return [datetime.date(2026, 1, 1) + datetime.timedelta(days=rnd.randrange(730)) for _ in range(n)]
+
+@caso("tariffe.soggiorno_30_notti_x1000", prepara=_arrivi)
+def _(arrivi):
+    for a in arrivi: calcola_soggiorno_airbnb(a, 30, 20)
+
+@caso("tariffe.soggiorno_365_notti_x1000", prepara=_arrivi)
+def _(arrivi):
+    for a in arrivi: calcola_soggiorno_airbnb(a, 365, 20)
+
+@caso("tariffe.soggiorno_30_notti_con_log_x100", prepara=lambda: _arrivi(100))
+def _(arrivi):
+    for a in arrivi: list(calcola_soggiorno_airbnb(a, 30, 26)[2])
+
+def _richieste(n=1000):
+    return [{"cliente": f"Cliente {i}", "checkin": a.strftime("%d/%m/%Y"), "checkout": (a + datetime.timedelta(days=7)).strftime("%d/%m/%Y"),
+             "ospiti": "18", "servizi": "Dinner 18x3, Transfer 1x2, Prima Spesa @150"} for i, a in enumerate(_arrivi(n))]
+
+@caso("preventivi.batch_1000_richieste_un_processo", ripetizioni=10, prepara=_richieste)
+def _(richieste):
+    prezza_tutte(richieste, processi=1)
+
+@caso("listino.griglia_18_mesi_3_21_notti", ripetizioni=10)
+def _(_):
+    calcola_listino(datetime.date(2026, 10, 1), 18, 20)
+
+
+def _occupato_al_70():
+    # 18 mesi con soggiorni da 2-9 notti e pochi buchi
+    rnd, intervalli = random.Random(7), []
+    giorno = datetime.date(2026, 10, 1)
+    while giorno < datetime.date(2028, 5, 1):
+        fine = giorno + datetime.timedelta(days=rnd.randint(2, 9))
+        if rnd.random() < 0.7: intervalli.append((giorno, fine))
+        giorno = fine
+    return IndiceOccupazione(intervalli).intervalli
+
+@caso("finestre.libere_18_mesi_3_21_notti", ripetizioni=10, prepara=_occupato_al_70)
+def _(intervalli):
+    finestre_libere(calcola_listino(datetime.date(2026, 10, 1), 18, 18, 5.0), intervalli)
+
+# --- Calendario iCal (10.000 eventi da un server HTTP locale) ---
+
+def _ical(n_eventi):
+    righe = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//Galbino//Benchmark//IT"]
+    inizio = datetime.date(2000, 1, 1)
+    for i in range(n_eventi):
+        s = inizio + datetime.timedelta(days=i * 3)
+        e = s + datetime.timedelta(days=2)
+        righe += ["BEGIN:VEVENT", f"UID:{i}@bench", f"DTSTART;VALUE=DATE:{s:%Y%m%d}",
+                  f"DTEND;VALUE=DATE:{e:%Y%m%d}", "SUMMARY:Prenotato", "END:VEVENT"]
+    righe.append("END:VCALENDAR")
+    return "\r\n".join(righe).encode("utf-8")
+
+def _server_ical(n_eventi=10000):
+    contenuto = _ical(n_eventi)
+    etag = '"' + hashlib.md5(contenuto).hexdigest() + '"'
+
+    class Gestore(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304); self.end_headers(); return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/calendar")
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(contenuto)))
+            self.end_headers()
+            self.wfile.write(contenuto)
+        def log_message(self, *args): pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Gestore)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/calendario.ics"
+    cache = CacheCalendario(url)
+    cache.indice()
+    return {"server": server, "url": url, "cache": cache}
+
+def _ferma_server(ctx):
+    ctx["server"].shutdown()
+    ctx["server"].server_close()
+
+@caso("disponibilita.ical_10k_scarico_e_parsing", ripetizioni=3, prepara=_server_ical, chiudi=_ferma_server)
+def _(ctx):
+    CacheCalendario(ctx["url"]).indice()
+
+@caso("disponibilita.ical_10k_get_condizionale_304", ripetizioni=20, prepara=_server_ical, chiudi=_ferma_server)
+def _(ctx):
+    ctx["cache"]._scarica()
+
+@caso("disponibilita.ical_10k_1000_verifiche", ripetizioni=20, prepara=_server_ical, chiudi=_ferma_server)
+def _(ctx):
+    indice = ctx["cache"].indice()
+    rnd = random.Random(1)
+    for _ in range(1000):
+        checkin = datetime.date(2000, 1, 1) + datetime.timedelta(days=rnd.randrange(30000))
+        indice.conflitto(checkin, checkin + datetime.timedelta(days=4))
+
+
+# --- Resilienza ---
+
+def _server_lento(ritardo=2.0):
+    class Gestore(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(ritardo)
+            self.send_response(200); self.send_header("Content-Length", "0"); self.end_headers()
+        def log_message(self, *args): pass
+
+    import requests
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Gestore)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    sessione = requests.Session()
+    proteggi_sessione(sessione, Circuiti(), prefisso="http://", timeout=(0.3, 0.3), scadenza=0.5, tentativi=2)
+    return {"server": server, "url": f"http://127.0.0.1:{server.server_address[1]}/", "sessione": sessione}
+
+def _chiama_lento(ctx):
+    try: ctx["sessione"].get(ctx["url"])
+    except OSError: pass
+
+# Senza scadenza la pagina aspetterebbe i 2 s del server a ogni richiesta
+@caso("resilienza.server_lento_scadenza_0_5s", ripetizioni=3, prepara=_server_lento, chiudi=_ferma_server)
+def _(ctx):
+    ctx["sessione"].get_adapter("http://").circuiti = Circuiti() # circuito chiuso: si misura la scadenza
+    _chiama_lento(ctx)
+
+# A circuito aperto si fallisce subito, senza toccare la rete
+@caso("resilienza.circuito_aperto_x100", ripetizioni=10, prepara=_server_lento, chiudi=_ferma_server)
+def _(ctx):
+    for _ in range(100): _chiama_lento(ctx)
+
+
+# --- Quota Sheets ---
+
+def _server_quota():
+    # Server a un solo thread da 50 ms a richiesta: venti richieste separate = un secondo
+    class Gestore(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(0.05)
+            self.send_response(200); self.send_header("Content-Length", "2"); self.end_headers(); self.wfile.write(b"ok")
+        def log_message(self, *args): pass
+
+    import requests
+    server = HTTPServer(("127.0.0.1", 0), Gestore)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    sessione = requests.Session()
+    regolatore = RegolatoreQuota(letture_al_minuto=6000, raffica=100, host="127.0.0.1")
+    proteggi_sessione(sessione, Circuiti(), prefisso="http://", regolatore=regolatore)
+    return {"server": server, "url": f"http://127.0.0.1:{server.server_address[1]}/", "sessione": sessione}
+
+# 20 sessioni che rileggono lo stesso intervallo insieme: due richieste invece di venti
+@caso("quota.get_identiche_20_concorrenti", ripetizioni=10, prepara=_server_quota, chiudi=_ferma_server)
+def _(ctx):
+    thread = [threading.Thread(target=ctx["sessione"].get, args=(ctx["url"],)) for _ in range(20)]
+    for t in thread: t.start()
+    for t in thread: t.join()
+
+
+# --- Excel ---
+
+@caso("documenti.generate_excel", ripetizioni=20)
+def _(_):
+    servizi = {nome: {'p_unit': p, 'pax': 10, 'qta': 2, 'subtotale': p * 20} for nome, p in LISTA_SERVIZI[:6]}
+    generate_excel("Luca", "Airbnb", "Cliente Benchmark", datetime.date(2027, 6, 10), datetime.date(2027, 6, 17), 7, 20,
+                   15000.0, 600.0, servizi, 250.0, 21000.0, 2142.86, "note")
+
+@caso("documenti.genera_excel_catering", ripetizioni=20)
+def _(_):
+    staff = [f"Persona {i} (Cameriere): 6.0h x 10.0€ = 60.0€" for i in range(30)]
+    genera_excel_catering("Cliente Benchmark", datetime.date(2027, 6, 10), "PREVENTIVO", 120, 80.0, 500.0, 10100.0, 2500.0,
+                          120.0, 200.0, 0.6, 1800.0, 4420.0, 5680.0, 0.5624, staff, "Menu " * 200, "note")
+
+
+# --- Cruscotto catering (5.000 eventi) ---
+
+def _eventi_catering(n=5200):
+    rnd = random.Random(11)
+    righe = [["Status", "Data", "Cliente"]]
+    for i in range(n):
+        pax, food, staff = rnd.randint(20, 150), rnd.uniform(800, 3000), rnd.uniform(300, 900)
+        incasso, costi = pax * 80.0, food + staff + 50
+        d = datetime.date(2020, 1, 1) + datetime.timedelta(days=rnd.randrange(2000))
+        righe.append([rnd.choice(["PREVENTIVO", "CONSUNTIVO"]), d.strftime("%d/%m/%Y"), f"Cliente {i // 2}",
+                      rnd.choice(["Buffet", "Servito", "Cocktail"]), pax, 80.0, 0.0, incasso, food, 50.0, staff, costi,
+                      incasso - costi, "", "", "", ""])
+    return {"righe": righe, "cruscotto": CruscottoCatering()}
+
+@caso("catering.cruscotto_incrementale_10_eventi_nuovi", ripetizioni=20, prepara=_eventi_catering)
+def _(ctx):
+    # Primo giro sui primi 5.000 eventi, poi 10 nuovi per ripetizione
+    cruscotto, righe = ctx["cruscotto"], ctx["righe"]
+    cruscotto.aggiorna("bench", lambda n: righe[n:n + 10] if n > 1 else righe[1:5001])
+    cruscotto.per_gruppo(["Mese", "Status"])
+    cruscotto.confronto()
+
+
+# --- Storico preventivi (30.000 righe nell'archivio SQLite) ---
+
+def _archivio_preventivi(n=30000):
+    rnd = random.Random(5)
+    cognomi = ["Rossi", "Bianchi", "Müller", "Smith", "Nicolò", "García", "Dubois", "Jensen"]
+    righe = [intestazione_preventivi()]
+    for i in range(n):
+        checkin = datetime.date(2020, 1, 1) + datetime.timedelta(days=rnd.randrange(2500))
+        canale = rnd.choice(["Airbnb", "Diretto (-5.0%)", "Netto Interno"])
+        righe.append(riga_preventivo(rnd.choice(["Luca", "Stefano"]), canale, f"{rnd.choice(cognomi)} {i}", checkin,
+                                     checkin + datetime.timedelta(days=7), 7, 12, 10000.0, 1428.57, 600.0, {}, 0, 10600.0, ""))
+    fd, percorso = tempfile.mkstemp(suffix=".sqlite3")
+    os.close(fd)
+    archivio = ArchivioLocale(percorso)
+    archivio.rispecchia("preventivi", righe, "bench", 0.0)
+    return {"archivio": archivio, "percorso": percorso}
+
+def _rimuovi_archivio(ctx):
+    ctx["archivio"]._db.close()
+    for suffisso in ("", "-wal", "-shm"):
+        if os.path.exists(ctx["percorso"] + suffisso): os.remove(ctx["percorso"] + suffisso)
+
+@caso("archivio.cerca_preventivi_30k_x100", ripetizioni=10, prepara=_archivio_preventivi, chiudi=_rimuovi_archivio)
+def _(ctx):
+    archivio = ctx["archivio"]
+    for i in range(25):
+        archivio.cerca("preventivi", nome="mul", limite=50)
+        archivio.cerca("preventivi", da=datetime.date(2023, 6, 1), a=datetime.date(2023, 6, 30), limite=50)
+        archivio.cerca("preventivi", limite=50, autore="Luca", inizia={"canale": "Diretto"})
+        archivio.cerca("preventivi", nome="ros", limite=50, autore="Stefano", inizia={"canale": "Airbnb"})
+
+
+# --- Diario (100.000 sedute) ---
+
+def _diario(n=100000):
+    rnd = random.Random(7)
+    pazienti = [f"Paziente {i:04d}" for i in range(2000)]
+    righe = [["Data", "Paziente", "Tipo", "Prezzo", "Note", "Stato"]]
+    giorno = datetime.date(2010, 1, 1)
+    for i in range(n):
+        d = giorno + datetime.timedelta(days=i // 25)
+        righe.append([d.strftime("%d/%m/%Y"), rnd.choice(pazienti), rnd.choice(["Presenza", "Online"]),
+                      f"{rnd.choice([50, 60, 70, 80])},00", "", "DA FARE"])
+    anagrafica = [["Nome", "Prezzo"]] + [[p, "60"] for p in pazienti[:300]]
+    return {"righe": righe, "anagrafica": anagrafica}
+
+@caso("diario.analizza_100k_righe", ripetizioni=5, prepara=_diario)
+def _(ctx):
+    analizza_dati(ctx["anagrafica"], ctx["righe"], oggi=datetime.date(2021, 1, 1))
+
+def _analisi_100k():
+    ctx = _diario(102200) # 100.000 + 100 nuove per ogni ripetizione
+    ctx["analisi"] = AnalisiDiario()
+    return ctx
+
+@caso("diario.analisi_incrementale_100_righe_nuove", ripetizioni=20, prepara=_analisi_100k)
+def _(ctx):
+    # Primo giro (riscaldamento) sulle prime 100.000 righe, poi solo le 100 in coda
+    analisi, righe = ctx["analisi"], ctx["righe"]
+    analisi.aggiorna("bench", lambda n: righe[n:n + 100] if n > 1 else righe[1:100001])
+    analisi.risultato(ctx["anagrafica"], oggi=datetime.date(2021, 1, 1))
+
+@caso("diario.cerca_paziente_x100", ripetizioni=20, prepara=_analisi_100k)
+def _(ctx):
+    analisi = ctx["analisi"]
+    if not len(analisi.indice): analisi.aggiorna("bench", lambda n: ctx["righe"][n:])
+    for i in range(100): analisi.indice.cerca(f"paz {i % 20}", 20, analisi.ultima_data)
+
+def _report_100k():
+    ctx = _diario(102200) # come sopra: 100.000 + 100 nuove per ogni ripetizione
+    ctx["report"] = ReportDiario()
+    return ctx
+
+@caso("report.aggregati_incrementali_100_righe_nuove", ripetizioni=20, prepara=_report_100k)
+def _(ctx):
+    report, righe = ctx["report"], ctx["righe"]
+    report.aggiorna("bench", lambda n: righe[n:n + 100] if n > 1 else righe[1:100001])
+    report.per_periodo("Mese")
+    report.per_paziente("Anno", "2015")
+    report.da_incassare(datetime.date(2021, 1, 1))
+
+class FoglioMemoria:
+    # Foglio finto in memoria con le stesse letture usate dal sincronizzatore
+    def __init__(self, righe): self.righe = righe
+    def get_all_values(self): return [list(r) for r in self.righe]
+    def get(self, intervallo):
+        inizio = int(intervallo.split(":")[0][1:])
+        return [list(r) for r in self.righe[inizio - 1:]]
+
+def _sync_100k():
+    ctx = _diario()
+    fd, percorso = tempfile.mkstemp(suffix=".json")
+    os.close(fd); os.remove(percorso)
+    ctx["foglio"] = FoglioMemoria(ctx["righe"])
+    ctx["percorso"] = percorso
+    ctx["sinc"] = SincronizzatoreFoglio(percorso, "bench", 6)
+    ctx["sinc"].sincronizza(ctx["foglio"])
+    return ctx
+
+def _rimuovi_snapshot(ctx):
+    for p in (ctx["percorso"], ctx["percorso"] + ".tmp"):
+        if os.path.exists(p): os.remove(p)
+
+@caso("diario.sync_completa_100k_righe", ripetizioni=3, prepara=_sync_100k, chiudi=_rimuovi_snapshot)
+def _(ctx):
+    ctx["sinc"]._completa(ctx["foglio"], time.time())
+
+@caso("diario.sync_delta_100k_righe", ripetizioni=20, prepara=_sync_100k, chiudi=_rimuovi_snapshot)
+def _(ctx):
+    ctx["sinc"].sincronizza(ctx["foglio"])
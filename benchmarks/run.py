@@ -0,0 +1,103 @@
+# ==============================================================================
+# BENCHMARK: ESECUZIONE, RISULTATI JSON E CONFRONTO CON UNA BASELINE
+# ==============================================================================
+# Uso (dalla cartella del repo):
+#   python -m benchmarks.run                          # tutti i casi
+#   python -m benchmarks.run -k stagione -k excel     # solo i casi che contengono...
+#   python -m benchmarks.run -o base.json             # salva i risultati
+#   python -m benchmarks.run --confronta base.json    # esce con 1 se qualcosa rallenta
+#
+# Ogni caso gira `ripetizioni` volte dopo un giro di riscaldamento; si registrano
+# min/mediana/media/dev. standard in secondi. Si confrontano le mediane.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.casi import CASI
+
+SOGLIA_REGRESSIONE = 0.20 # +20% sulla mediana = regressione
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def esegui_caso(caso):
+    contesto = caso["prepara"]() if caso.get("prepara") else None
+    try:
+        caso["funzione"](contesto) # riscaldamento (cache, import, JIT di numpy...)
+        tempi = []
+        for _ in range(caso["ripetizioni"]):
+            t0 = time.perf_counter()
+            caso["funzione"](contesto)
+            tempi.append(time.perf_counter() - t0)
+    finally:
+        if caso.get("chiudi"): caso["chiudi"](contesto)
+    return {
+        "ripetizioni": len(tempi),
+        "min": min(tempi),
+        "mediana": statistics.median(tempi),
+        "media": statistics.fmean(tempi),
+        "dev_std": statistics.stdev(tempi) if len(tempi) > 1 else 0.0,
+    }
+
+
+def confronta(risultati, baseline, soglia=SOGLIA_REGRESSIONE):
+    regressioni = []
+    for nome, r in risultati.items():
+        base = baseline.get(nome)
+        if not base: continue
+        rapporto = r["mediana"] / base["mediana"] if base["mediana"] else 1.0
+        r["rispetto_baseline"] = rapporto
+        if rapporto > 1 + soglia: regressioni.append((nome, rapporto))
+    return regressioni
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del gestionale Galbino")
+    parser.add_argument("-k", dest="filtri", action="append", default=[], help="esegue solo i casi il cui nome contiene il testo")
+    parser.add_argument("-o", "--output", help="file JSON dei risultati")
+    parser.add_argument("--confronta", help="JSON di una esecuzione precedente da usare come baseline")
+    parser.add_argument("--soglia", type=float, default=SOGLIA_REGRESSIONE, help="rallentamento massimo tollerato (0.2 = +20%%)")
+    args = parser.parse_args(argv)
+
+    risultati = {}
+    for nome, caso in CASI.items():
+        if args.filtri and not any(f in nome for f in args.filtri): continue
+        r = esegui_caso(caso)
+        risultati[nome] = r
+        print(f"{nome:<45} mediana {r['mediana'] * 1000:10.3f} ms   min {r['min'] * 1000:10.3f} ms   (n={r['ripetizioni']})")
+
+    regressioni = []
+    if args.confronta:
+        with open(args.confronta, encoding="utf-8") as f:
+            regressioni = confronta(risultati, json.load(f)["risultati"], args.soglia)
+        for nome, rapporto in regressioni:
+            print(f"REGRESSIONE {nome}: x{rapporto:.2f} rispetto alla baseline")
+
+    documento = {
+        "data": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "piattaforma": platform.platform(),
+        "risultati": risultati,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(documento, f, indent=2)
+    return 1 if regressioni else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
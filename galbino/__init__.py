@@ -0,0 +1,14 @@
+# ==============================================================================
+# GALBINO: logica condivisa dalle app Streamlit (senza dipendenze da Streamlit,
+# tranne i componenti comuni in galbino/interfaccia.py)
+# ==============================================================================
+
+import os
+
+# File locali (coda salvataggi, snapshot, indici): fuori dal repo via GALBINO_DATI
+CARTELLA_DATI = os.environ.get("GALBINO_DATI", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".galbino"))
+
+
+def percorso_dati(nome_file):
+    os.makedirs(CARTELLA_DATI, exist_ok=True)
+    return os.path.join(CARTELLA_DATI, nome_file)
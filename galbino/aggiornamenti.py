@@ -0,0 +1,49 @@
+# ==============================================================================
+# AGGIORNAMENTI IN BLOCCO: MOLTE CELLE DI UNA COLONNA CON UNA SOLA SCRITTURA
+# ==============================================================================
+# Le righe da modificare si raggruppano in intervalli contigui (F3:F9, F14:F15...)
+# e partono tutte con un solo batch_update: una richiesta (e un'unità di quota)
+# invece di una per cella. Prima di scrivere, un solo batch_get controlla che le
+# righe sul foglio siano ancora quelle viste in locale (nessuno le ha spostate).
+
+from galbino.formati import lettera_colonna
+from galbino.tracciamento import span
+
+
+def intervalli_contigui(numeri):
+    # [3, 4, 5, 9, 14, 15] -> [(3, 5), (9, 9), (14, 15)]
+    intervalli = []
+    for n in sorted(set(numeri)):
+        if intervalli and n == intervalli[-1][1] + 1: intervalli[-1][1] = n
+        else: intervalli.append([n, n])
+    return [tuple(i) for i in intervalli]
+
+
+def richieste_colonna(colonna, valori):
+    # valori: {numero riga: nuovo valore}, colonna da 1 -> corpo di batch_update
+    lettera = lettera_colonna(colonna)
+    return [{"range": f"{lettera}{a}:{lettera}{b}", "values": [[valori[n]] for n in range(a, b + 1)]}
+            for a, b in intervalli_contigui(valori)]
+
+
+def righe_cambiate(ws, attese, larghezza):
+    # attese: {numero riga: riga come nella copia locale} -> righe diverse sul foglio
+    ultima = lettera_colonna(larghezza)
+    intervalli = intervalli_contigui(attese)
+    with span("sheets.verifica_righe", intervalli=len(intervalli)):
+        letti = ws.batch_get([f"A{a}:{ultima}{b}" for a, b in intervalli])
+    cambiate = []
+    for (a, b), blocco in zip(intervalli, letti):
+        blocco = list(blocco)
+        for n in range(a, b + 1):
+            riga = [str(v) for v in blocco[n - a][:larghezza]] if n - a < len(blocco) else []
+            if riga + [""] * (larghezza - len(riga)) != list(attese[n]): cambiate.append(n)
+    return cambiate
+
+
+def aggiorna_colonna(ws, colonna, valori):
+    # Tutte le celle in una sola chiamata; -> numero di intervalli scritti
+    richieste = richieste_colonna(colonna, valori)
+    with span("sheets.batch_update", intervalli=len(richieste), celle=len(valori)):
+        ws.batch_update(richieste)
+    return len(richieste)
@@ -0,0 +1,256 @@
+# ==============================================================================
+# ARCHIVIO LOCALE: COPIA SQLITE DEI FOGLI GOOGLE CON INDICI
+# ==============================================================================
+# I fogli restano la copia "umana" dei dati. Qui se ne tiene uno specchio
+# SQLite indicizzato per nome e date, così le letture costano millisecondi.
+# Replica nei due sensi:
+#   Sheets -> locale: un thread (Replicatore) sincronizza i fogli in modo
+#                     incrementale (SincronizzatoreFoglio) e applica le righe nuove;
+#   locale -> Sheets: le scritture passano da CodaSalvataggi (giornale + invio a lotti).
+
+import json
+import sqlite3
+import threading
+
+from galbino.formati import a_data, a_numero, normalizza_nome
+from galbino.quota import in_sfondo
+
+INTERVALLO_REPLICA = 60 # secondi tra due sincronizzazioni in background
+
+# Colonne tipizzate estratte dalle righe del foglio: (nome, indice colonna, tipo).
+# Il tipo "nome" crea anche la colonna <nome>_norm (minuscolo, senza accenti).
+SCHEMI = {
+    "preventivi": {
+        "larghezza": 62,
+        "colonne": [("autore", 0, "testo"), ("canale", 1, "testo"), ("data_prev", 2, "data"),
+                    ("cliente", 3, "nome"), ("checkin", 4, "data"), ("checkout", 5, "data"),
+                    ("notti", 6, "numero"), ("ospiti", 7, "numero"), ("totale", 60, "numero")],
+        "indici": ["cliente_norm", "checkin", "autore", "canale"],
+    },
+    "catering": {
+        "larghezza": 17,
+        "colonne": [("status", 0, "testo"), ("data", 1, "data"), ("cliente", 2, "nome"),
+                    ("tipo", 3, "testo"), ("pax", 4, "numero"), ("incasso", 7, "numero"),
+                    ("totale_costi", 11, "numero"), ("margine", 12, "numero")],
+        "indici": ["cliente_norm", "data"],
+    },
+    "diario": {
+        "larghezza": 6,
+        "colonne": [("data", 0, "data"), ("paziente", 1, "nome"), ("tipo", 2, "testo"),
+                    ("prezzo", 3, "numero"), ("stato", 5, "testo")],
+        "indici": ["paziente_norm", "data"],
+    },
+    "pazienti": {
+        "larghezza": 2,
+        "colonne": [("nome", 0, "nome"), ("prezzo", 1, "numero")],
+        "indici": ["nome_norm"],
+    },
+}
+
+_TIPI_SQL = {"testo": "TEXT", "data": "TEXT", "numero": "REAL", "nome": "TEXT"}
+
+
+def _colonne_sql(schema):
+    colonne = []
+    for nome, _, tipo in schema["colonne"]:
+        colonne.append((nome, _TIPI_SQL[tipo]))
+        if tipo == "nome": colonne.append((f"{nome}_norm", "TEXT"))
+    return colonne
+
+
+def _data_col(schema):
+    return next((i for _, i, tipo in schema["colonne"] if tipo == "data"), None)
+
+
+def _converti(schema, riga):
+    valori = []
+    for _, i, tipo in schema["colonne"]:
+        v = riga[i] if i < len(riga) else ""
+        if tipo == "data":
+            d = a_data(v)
+            valori.append(d.isoformat() if d else None)
+        elif tipo == "numero":
+            valori.append(a_numero(v))
+        elif tipo == "nome":
+            valori.extend([v.strip(), normalizza_nome(v)])
+        else:
+            valori.append(v)
+    return valori
+
+
+class ArchivioLocale:
+
+    def __init__(self, percorso):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(percorso, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS stato (
+            tabella TEXT PRIMARY KEY,
+            generazione TEXT,
+            n_righe INTEGER,
+            intestazione TEXT,
+            letto_il REAL
+        )""")
+        for tabella, schema in SCHEMI.items():
+            colonne = ", ".join(f"{n} {t}" for n, t in _colonne_sql(schema))
+            self._db.execute(f"CREATE TABLE IF NOT EXISTS {tabella} (riga INTEGER PRIMARY KEY, {colonne}, valori TEXT NOT NULL)")
+            for col in schema["indici"]:
+                self._db.execute(f"CREATE INDEX IF NOT EXISTS idx_{tabella}_{col} ON {tabella} ({col})")
+
+    # --- Sheets -> locale ---
+
+    def rispecchia(self, tabella, righe, generazione, letto_il):
+        # righe = foglio completo (riga 1 inclusa). Se la generazione è la stessa
+        # dell'ultima volta si inseriscono solo le righe nuove, altrimenti si ricarica.
+        schema = SCHEMI[tabella]
+        with self._lock, self._db:
+            stato = self._db.execute("SELECT generazione, n_righe, intestazione FROM stato WHERE tabella = ?", (tabella,)).fetchone()
+            if stato and stato["generazione"] == generazione and stato["n_righe"] <= len(righe):
+                inizio, intestazione = stato["n_righe"], stato["intestazione"]
+            else:
+                self._db.execute(f"DELETE FROM {tabella}")
+                inizio, intestazione = 0, None
+            nuove = []
+            for n, riga in enumerate(righe[inizio:], start=inizio + 1):
+                # Riga 1 = intestazione, se la sua colonna data non contiene una data
+                i_data = _data_col(schema)
+                if n == 1 and (i_data is None or a_data(riga[i_data] if i_data < len(riga) else "") is None):
+                    intestazione = json.dumps(riga, ensure_ascii=False)
+                    continue
+                nuove.append([n] + _converti(schema, riga) + [json.dumps(riga, ensure_ascii=False)])
+            if nuove:
+                segnaposto = ", ".join("?" * len(nuove[0]))
+                self._db.executemany(f"INSERT OR REPLACE INTO {tabella} VALUES ({segnaposto})", nuove)
+            self._db.execute("INSERT OR REPLACE INTO stato VALUES (?, ?, ?, ?, ?)",
+                             (tabella, generazione, len(righe), intestazione, letto_il))
+
+    def correggi(self, tabella, righe, generazione):
+        # righe: {numero riga: riga completa} già modificate sul foglio e nel sincronizzatore;
+        # si riscrivono solo quelle e si adotta la nuova generazione senza ricaricare tutto
+        schema = SCHEMI[tabella]
+        with self._lock, self._db:
+            nuove = [[n] + _converti(schema, riga) + [json.dumps(riga, ensure_ascii=False)] for n, riga in righe.items()]
+            if nuove:
+                segnaposto = ", ".join("?" * len(nuove[0]))
+                self._db.executemany(f"INSERT OR REPLACE INTO {tabella} VALUES ({segnaposto})", nuove)
+            self._db.execute("UPDATE stato SET generazione = ? WHERE tabella = ?", (generazione, tabella))
+
+    # --- Letture ---
+
+    def pronto(self, tabella):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM stato WHERE tabella = ?", (tabella,)).fetchone() is not None
+
+    def letto_il(self, tabella):
+        with self._lock:
+            stato = self._db.execute("SELECT letto_il FROM stato WHERE tabella = ?", (tabella,)).fetchone()
+        return stato["letto_il"] if stato else 0.0
+
+    def generazione(self, tabella):
+        with self._lock:
+            stato = self._db.execute("SELECT generazione FROM stato WHERE tabella = ?", (tabella,)).fetchone()
+        return stato["generazione"] if stato else None
+
+    def righe(self, tabella, con_intestazione=True, dopo_riga=0):
+        # Stesso formato di get_all_values(), per il codice che già lavora sulle liste;
+        # dopo_riga: solo le righe successive a quella riga del foglio
+        with self._lock:
+            stato = self._db.execute("SELECT intestazione FROM stato WHERE tabella = ?", (tabella,)).fetchone()
+            valori = self._db.execute(f"SELECT valori FROM {tabella} WHERE riga > ? ORDER BY riga", (dopo_riga,)).fetchall()
+        righe = [json.loads(v["valori"]) for v in valori]
+        if con_intestazione:
+            intestazione = json.loads(stato["intestazione"]) if stato and stato["intestazione"] else [""] * SCHEMI[tabella]["larghezza"]
+            righe.insert(0, intestazione)
+        return righe
+
+    def cerca(self, tabella, nome=None, da=None, a=None, limite=200, ordine="riga DESC", inizia=None, esclusi=None, **uguali):
+        # nome: prefisso (senza accenti/maiuscole) sulla colonna nome della tabella;
+        # da/a: date sulla prima colonna data; inizia: {colonna: prefisso} esatti
+        # (es. canale "Diretto"); esclusi: {colonna: valori} da scartare prima del
+        # limite; uguali: filtri esatti su altre colonne
+        schema = SCHEMI[tabella]
+        where, parametri = [], []
+        if nome:
+            col_nome = next(n for n, _, t in schema["colonne"] if t == "nome")
+            prefisso = normalizza_nome(nome)
+            # Intervallo [prefisso, prefisso + "\uffff") = LIKE 'prefisso%' ma usa l'indice
+            where.append(f"{col_nome}_norm >= ? AND {col_nome}_norm < ?")
+            parametri += [prefisso, prefisso + "\uffff"]
+        col_data = next((n for n, _, t in schema["colonne"] if t == "data" and n != "data_prev"), None)
+        if da:
+            where.append(f"{col_data} >= ?"); parametri.append(da.isoformat())
+        if a:
+            where.append(f"{col_data} <= ?"); parametri.append(a.isoformat())
+        for col, prefisso in (inizia or {}).items():
+            where.append(f"{col} >= ? AND {col} < ?"); parametri += [prefisso, prefisso + "\uffff"]
+        for col, valori in (esclusi or {}).items():
+            segnaposto = ", ".join("?" * len(valori))
+            where.append(f"({col} IS NULL OR {col} NOT IN ({segnaposto}))"); parametri += list(valori)
+        for col, valore in uguali.items():
+            where.append(f"{col} = ?"); parametri.append(valore)
+        sql = f"SELECT * FROM {tabella}"
+        if where: sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {ordine} LIMIT ?"
+        with self._lock:
+            risultati = self._db.execute(sql, parametri + [limite]).fetchall()
+        return [dict(r, valori=json.loads(r["valori"])) for r in risultati]
+
+
+class Replicatore:
+    # Tiene allineato l'archivio ai fogli registrati, in background.
+
+    def __init__(self, connessione, archivio, intervallo=INTERVALLO_REPLICA):
+        self._connessione = connessione
+        self.archivio = archivio
+        self.intervallo = intervallo
+        self.errori = {}
+        self._fogli = {}
+        self._lock = threading.Lock()
+        self._lock_aggiorna = threading.Lock() # una sincronizzazione alla volta, in ordine
+        self._evento = threading.Event()
+        threading.Thread(target=self._ciclo, name="replica-archivio", daemon=True).start()
+
+    def registra(self, tabella, url, titolo, sincronizzatore):
+        with self._lock:
+            self._fogli[tabella] = (url, titolo, sincronizzatore)
+        self._evento.set()
+
+    def aggiorna(self, tabella):
+        url, titolo, sinc = self._fogli[tabella]
+        with self._lock_aggiorna:
+            self._aggiorna(tabella, url, titolo, sinc)
+
+    def _aggiorna(self, tabella, url, titolo, sinc):
+        try:
+            righe = sinc.sincronizza(self._connessione.foglio(url, titolo))
+            self.archivio.rispecchia(tabella, righe, sinc.generazione, sinc.ultima_lettura["inizio"])
+            self.errori.pop(tabella, None)
+        except Exception as e:
+            # Quota, rete o circuito aperto: si riprova al prossimo giro con la stessa connessione,
+            # condivisa con la coda salvataggi e con le pagine
+            self.errori[tabella] = f"{e}"
+            self._connessione.invalida_se_serve(e)
+            raise
+
+    def correggi(self, tabella, colonna, valori):
+        # Dopo una scrittura diretta sul foglio: copia locale e archivio allineati senza rileggere
+        url, titolo, sinc = self._fogli[tabella]
+        with self._lock_aggiorna:
+            generazione = sinc.correggi(colonna, valori)
+            self.archivio.correggi(tabella, {n: list(sinc.righe[n - 1]) for n in valori}, generazione)
+
+    def richiedi(self):
+        self._evento.set()
+
+    def _ciclo(self):
+        while True:
+            self._evento.wait(timeout=self.intervallo)
+            self._evento.clear()
+            with self._lock:
+                tabelle = list(self._fogli)
+            # Letture in background: dopo quelle delle pagine nella quota Sheets
+            with in_sfondo():
+                for tabella in tabelle:
+                    try: self.aggiorna(tabella)
+                    except Exception: pass # errore registrato, si riprova al prossimo giro
@@ -0,0 +1,58 @@
+# ==============================================================================
+# AVVIO: RISCALDAMENTO IN BACKGROUND E TEMPI DI PARTENZA
+# ==============================================================================
+# Le librerie pesanti (gspread, oauth2client, requests, icalendar, xlsxwriter)
+# si importano solo nei punti che le usano. Alla prima pagina servita dal
+# processo (di solito il login) un thread le carica e prepara client Google,
+# calendari e tabelle tariffe, così chi entra trova tutto pronto. Ogni passo
+# finisce nelle tracce come "avvio.<passo>".
+
+import importlib
+import threading
+import time
+
+from galbino.quota import in_sfondo
+from galbino.tracciamento import TRACCIATORE, span
+
+MODULI_PESANTI = ("gspread", "oauth2client.service_account", "requests", "icalendar", "xlsxwriter")
+
+
+def passi_import(moduli=MODULI_PESANTI):
+    # Un passo per modulo, così i tempi restano separati nelle tracce
+    return [(f"import.{m}", lambda m=m: importlib.import_module(m)) for m in moduli]
+
+
+def registra_import_app(secondi):
+    # Tempo di import dei moduli dell'app al primo rerun del processo
+    TRACCIATORE.registra("avvio.import_app", secondi)
+
+
+class Riscaldamento:
+    # Passi (nome, funzione) eseguiti in ordine in un thread daemon; un errore
+    # ferma solo il suo passo (es. Google irraggiungibile), non gli altri.
+
+    def __init__(self, passi, durata_import=None):
+        self.passi = list(passi)
+        self.durata_import = durata_import # import dei moduli dell'app al primo rerun, per il pannello admin
+        self.esiti = {} # nome -> (secondi, errore o None)
+        self.secondi = None
+        self._thread = threading.Thread(target=self._esegui, name="riscaldamento", daemon=True)
+
+    def avvia(self):
+        self._thread.start()
+        return self
+
+    @property
+    def completato(self):
+        return self.secondi is not None
+
+    def _esegui(self):
+        t_inizio = time.perf_counter()
+        for nome, funzione in self.passi:
+            t0 = time.perf_counter()
+            try:
+                with in_sfondo(), span(f"avvio.{nome}"): funzione()
+                self.esiti[nome] = (time.perf_counter() - t0, None)
+            except Exception as e:
+                self.esiti[nome] = (time.perf_counter() - t0, f"{e}")
+        self.secondi = time.perf_counter() - t_inizio
@@ -0,0 +1,64 @@
+# ==============================================================================
+# CATERING: PERSONALE E MARGINI
+# ==============================================================================
+# Il personale è una tabella (una riga per persona) e i costi si calcolano per
+# colonne: niente widget né cicli per riga, anche con eventi da 30+ persone.
+
+import pandas as pd
+
+COLONNE_STAFF = ["Nome", "Ruolo", "Ore", "€/h"]
+RUOLI_STAFF = ["Cameriere", "Cuoco", "Aiuto Cuoco", "Lavapiatti", "Extra"]
+ORE_DEFAULT = 6.0
+PAGA_DEFAULT = 10.0
+
+
+def staff_iniziale(n=3):
+    # Il primo è il cuoco, gli altri camerieri
+    return pd.DataFrame({
+        "Nome": [""] * n,
+        "Ruolo": ["Cuoco" if i == 0 else "Cameriere" for i in range(n)],
+        "Ore": [ORE_DEFAULT] * n,
+        "€/h": [PAGA_DEFAULT] * n,
+    }, columns=COLONNE_STAFF)
+
+
+def applica_modifiche(staff, modifiche):
+    # modifiche: lo stato di st.data_editor (edited_rows, added_rows, deleted_rows)
+    staff = staff[COLONNE_STAFF].reset_index(drop=True).copy()
+    for riga, valori in modifiche.get("edited_rows", {}).items():
+        for colonna, valore in valori.items():
+            if colonna in COLONNE_STAFF: staff.at[int(riga), colonna] = valore
+    staff = staff.drop(index=[int(r) for r in modifiche.get("deleted_rows", [])], errors="ignore")
+    nuove = [{c: r.get(c) for c in COLONNE_STAFF} for r in modifiche.get("added_rows", [])]
+    if nuove: staff = pd.concat([staff, pd.DataFrame(nuove, columns=COLONNE_STAFF)], ignore_index=True)
+    return pulisci_staff(staff)
+
+
+def pulisci_staff(staff):
+    # Celle vuote -> valori di default, così i totali non diventano NaN
+    staff = staff.reset_index(drop=True)
+    return staff.assign(
+        Nome=staff["Nome"].fillna("").astype(str).str.strip(),
+        Ruolo=staff["Ruolo"].where(staff["Ruolo"].isin(RUOLI_STAFF), "Cameriere"),
+        Ore=pd.to_numeric(staff["Ore"], errors="coerce").fillna(ORE_DEFAULT).clip(lower=0),
+        **{"€/h": pd.to_numeric(staff["€/h"], errors="coerce").fillna(PAGA_DEFAULT).clip(lower=0)},
+    )
+
+
+def calcola_staff(staff):
+    # -> (staff con la colonna "Tot", costo totale)
+    staff = staff.assign(Tot=staff["Ore"] * staff["€/h"])
+    return staff, float(staff["Tot"].sum())
+
+
+def righe_staff(staff):
+    # Testo per DB e report: solo le persone con un nome
+    con_nome = staff[staff["Nome"] != ""]
+    colonne = (con_nome[c] for c in ["Nome", "Ruolo", "Ore", "€/h", "Tot"])
+    return [f"{nome} ({ruolo}): {ore}h x {paga}€ = {tot}€" for nome, ruolo, ore, paga, tot in zip(*colonne)]
+
+
+def calcola_margine(totale_incasso, totale_costi):
+    # -> (margine €, margine %)
+    margine = totale_incasso - totale_costi
+    return margine, (margine / totale_incasso * 100) if totale_incasso > 0 else 0
@@ -0,0 +1,230 @@
+# ==============================================================================
+# CODA SALVATAGGI: SCRITTURA DIFFERITA SU GOOGLE SHEETS CON GIORNALE LOCALE
+# ==============================================================================
+# Il salvataggio dalla UI scrive solo sul giornale SQLite locale (durevole,
+# sopravvive ai riavvii) e ritorna subito. Un thread in background invia le
+# righe a lotti con append_rows e, in caso di errori transitori (quota, rete,
+# errori del server), riprova con attese crescenti. Un lotto che Google
+# rifiuta (permessi, foglio inesistente, dati non validi) passa in errore e
+# si salta: resta nel giornale finché qualcuno non lo riprova o lo scarta.
+# append_rows non è idempotente: dopo un invio dall'esito incerto (timeout
+# sulla risposta) prima di ripeterlo si controlla se le righe sono già in
+# fondo al foglio.
+
+import json
+import random
+import sqlite3
+import threading
+import time
+
+from galbino.formati import a_numero, lettera_colonna
+from galbino.quota import QuotaEsaurita
+from galbino.resilienza import CircuitoAperto, codice_http, errore_transitorio
+from galbino.tracciamento import span
+
+LOTTO_MAX = 200           # righe per singola chiamata append_rows
+ATTESA_MIN = 2            # secondi, primo tentativo dopo un errore
+ATTESA_MAX = 120          # secondi, tetto del backoff
+CONSERVA_INVIATE = 7 * 86400 # le righe già inviate restano nel giornale per una settimana
+RIGHE_VERIFICA = 50       # righe in fondo al foglio in cui cercare un lotto dall'esito incerto
+
+
+def _da_riprovare(e):
+    # Transitori (rete, quota, 5xx) più l'autorizzazione scaduta: una nuova connessione la rifà
+    return errore_transitorio(e) or codice_http(e) == 401
+
+
+def _non_inviato(e):
+    # Errori per cui la richiesta sicuramente non è arrivata a Google
+    if isinstance(e, (CircuitoAperto, QuotaEsaurita)): return True
+    return codice_http(e) in (401, 429)
+
+
+def _stessa_cella(cella, valore):
+    # Il foglio restituisce i valori formattati: "65" per 65.0, "1.234,5" per 1234.5...
+    if valore is None: return cella in ("", None)
+    if str(cella) == str(valore): return True
+    numero = a_numero(valore)
+    return numero is not None and a_numero(cella) == numero
+
+
+def _contiene_lotto(righe, lotto):
+    # Il lotto compare, di seguito, tra le righe lette dal foglio?
+    for inizio in range(len(righe) - len(lotto) + 1):
+        if all(all(_stessa_cella(riga[j] if j < len(riga) else "", v) for j, v in enumerate(atteso))
+               for riga, atteso in zip(righe[inizio:inizio + len(lotto)], lotto)):
+            return True
+    return False
+
+
+class CodaSalvataggi:
+
+    def __init__(self, connessione, percorso):
+        self._connessione = connessione
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(percorso, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS righe (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL,
+            foglio TEXT,
+            valori TEXT NOT NULL,
+            creata REAL NOT NULL,
+            inviata REAL,
+            incerta INTEGER NOT NULL DEFAULT 0,
+            errore TEXT
+        )""")
+        # Giornali creati prima delle colonne incerta/errore
+        colonne = {r[1] for r in self._db.execute("PRAGMA table_info(righe)")}
+        if "incerta" not in colonne: self._db.execute("ALTER TABLE righe ADD COLUMN incerta INTEGER NOT NULL DEFAULT 0")
+        if "errore" not in colonne: self._db.execute("ALTER TABLE righe ADD COLUMN errore TEXT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_righe_attesa ON righe (inviata, id)")
+        self.tentativi = 0
+        self.ultimo_errore = None
+        self.ultimo_invio = None
+        self._evento = threading.Event()
+        self._evento.set() # all'avvio si inviano eventuali righe rimaste in sospeso
+        threading.Thread(target=self._ciclo, name="coda-salvataggi", daemon=True).start()
+
+    # --- UI ---
+
+    def accoda(self, url, foglio, righe):
+        # foglio None = primo foglio (sheet1). Tutte le righe in una transazione.
+        adesso = time.time()
+        with self._lock:
+            with self._db:
+                self._db.executemany(
+                    "INSERT INTO righe (url, foglio, valori, creata) VALUES (?, ?, ?, ?)",
+                    [(url, foglio, json.dumps(list(r), default=str), adesso) for r in righe])
+        self._evento.set()
+
+    def in_attesa(self, url=None, foglio=None, inviate_dopo=None):
+        # Righe non ancora su Google, per mostrarle subito nelle viste locali.
+        # Con inviate_dopo si includono anche quelle inviate dopo l'ultima lettura del foglio.
+        # Le righe in errore non arriveranno da sole: si vedono solo in fallite().
+        limite = time.time() + 1 if inviate_dopo is None else inviate_dopo
+        with self._lock:
+            if url is None:
+                cur = self._db.execute("SELECT valori FROM righe WHERE (inviata IS NULL OR inviata > ?) AND errore IS NULL ORDER BY id", (limite,))
+            else:
+                cur = self._db.execute("SELECT valori FROM righe WHERE (inviata IS NULL OR inviata > ?) AND errore IS NULL AND url = ? AND foglio IS ? ORDER BY id", (limite, url, foglio))
+            return [json.loads(v) for (v,) in cur.fetchall()]
+
+    def stato(self):
+        with self._lock:
+            (n_attesa,) = self._db.execute("SELECT COUNT(*) FROM righe WHERE inviata IS NULL AND errore IS NULL").fetchone()
+            (n_fallite,) = self._db.execute("SELECT COUNT(*) FROM righe WHERE inviata IS NULL AND errore IS NOT NULL").fetchone()
+            (n_inviate,) = self._db.execute("SELECT COUNT(*) FROM righe WHERE inviata IS NOT NULL").fetchone()
+        return {"in_attesa": n_attesa, "fallite": n_fallite, "inviate": n_inviate, "tentativi": self.tentativi,
+                "ultimo_errore": self.ultimo_errore, "ultimo_invio": self.ultimo_invio}
+
+    def fallite(self):
+        # Righe rifiutate da Google, da correggere (es. permessi del foglio) e riprovare o scartare
+        with self._lock:
+            righe = self._db.execute(
+                "SELECT id, url, foglio, valori, creata, errore FROM righe WHERE inviata IS NULL AND errore IS NOT NULL ORDER BY id").fetchall()
+        return [{"id": i, "url": url, "foglio": foglio, "valori": json.loads(v), "creata": creata, "errore": errore}
+                for i, url, foglio, v, creata, errore in righe]
+
+    def riprova(self, ids):
+        with self._lock:
+            with self._db:
+                self._db.executemany("UPDATE righe SET errore = NULL WHERE id = ? AND inviata IS NULL", [(i,) for i in ids])
+        self._evento.set()
+
+    def scarta(self, ids):
+        with self._lock:
+            with self._db:
+                self._db.executemany("DELETE FROM righe WHERE id = ? AND inviata IS NULL AND errore IS NOT NULL", [(i,) for i in ids])
+
+    # --- Thread di invio ---
+
+    def _ciclo(self):
+        attesa = None
+        while True:
+            self._evento.wait(timeout=attesa)
+            self._evento.clear()
+            try:
+                while self._invia_lotto(): pass
+            except Exception as e:
+                self.tentativi += 1
+                self.ultimo_errore = f"{e}"
+                self._connessione.invalida_se_serve(e)
+                # Backoff esponenziale con jitter; nuovi salvataggi non lo accorciano
+                attesa = min(ATTESA_MAX, ATTESA_MIN * 2 ** (self.tentativi - 1)) * random.uniform(0.5, 1.5)
+                time.sleep(attesa)
+                self._evento.set()
+                continue
+            self.tentativi = 0
+            self.ultimo_errore = None
+            attesa = None
+            self._pulisci()
+
+    def _invia_lotto(self):
+        with self._lock:
+            righe = self._db.execute(
+                "SELECT id, url, foglio, valori, incerta FROM righe WHERE inviata IS NULL AND errore IS NULL ORDER BY id LIMIT ?",
+                (LOTTO_MAX,)).fetchall()
+        if not righe: return False
+        # Un solo append_rows per foglio, rispettando l'ordine di salvataggio
+        url, foglio = righe[0][1], righe[0][2]
+        lotto = [r for r in righe if r[1] == url and r[2] == foglio]
+        valori = [json.loads(r[3]) for r in lotto]
+        try:
+            ws = self._connessione.foglio(url, foglio)
+            if any(r[4] for r in lotto) and self._gia_sul_foglio(ws, valori):
+                self._segna_inviate(lotto)
+                return True
+        except Exception as e:
+            if _da_riprovare(e): raise
+            self._segna_fallite(lotto, e)
+            return True
+        try:
+            with span("sheets.append", righe=len(lotto)):
+                ws.append_rows(valori)
+        except Exception as e:
+            if not _da_riprovare(e):
+                self._segna_fallite(lotto, e)
+                return True
+            # Timeout sulla risposta, connessione caduta, 5xx: le righe potrebbero
+            # essere già sul foglio, al prossimo giro si controlla prima di ripetere
+            if not _non_inviato(e): self._segna_incerte(lotto)
+            raise
+        self._segna_inviate(lotto)
+        return True
+
+    def _gia_sul_foglio(self, ws, valori):
+        # Dopo un invio incerto: il lotto è già tra le ultime righe del foglio?
+        with span("sheets.verifica_append", righe=len(valori)):
+            # La colonna A dà l'ultima riga; il margine oltre copre righe finali con A vuota
+            ultima = len(ws.get("A:A"))
+            inizio = max(1, ultima - len(valori) - RIGHE_VERIFICA + 1)
+            larghezza = max(len(r) for r in valori)
+            letti = ws.get(f"A{inizio}:{lettera_colonna(larghezza)}{ultima + len(valori) + RIGHE_VERIFICA}")
+        return _contiene_lotto([list(r) for r in letti], valori)
+
+    def _segna_inviate(self, lotto):
+        adesso = time.time()
+        with self._lock:
+            with self._db:
+                self._db.executemany("UPDATE righe SET inviata = ?, incerta = 0 WHERE id = ?", [(adesso, r[0]) for r in lotto])
+        self.ultimo_invio = adesso
+
+    def _segna_incerte(self, lotto):
+        with self._lock:
+            with self._db:
+                self._db.executemany("UPDATE righe SET incerta = 1 WHERE id = ?", [(r[0],) for r in lotto])
+
+    def _segna_fallite(self, lotto, e):
+        # Errore definitivo (403, 404, 400...): il lotto esce dalla coda e le righe dopo proseguono
+        errore = f"{type(e).__name__}: {e}"
+        # Un 403/404 può venire da un handle vecchio (foglio spostato): "Riprova" riparte da handle nuovi
+        self._connessione.invalida_se_serve(e)
+        with self._lock:
+            with self._db:
+                self._db.executemany("UPDATE righe SET errore = ? WHERE id = ?", [(errore, r[0]) for r in lotto])
+
+    def _pulisci(self):
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM righe WHERE inviata IS NOT NULL AND inviata < ?", (time.time() - CONSERVA_INVIATE,))
@@ -0,0 +1,156 @@
+# ==============================================================================
+# CRUSCOTTO CATERING: MARGINI PER MESE/TIPO/STATUS E PREVENTIVO VS CONSUNTIVO
+# ==============================================================================
+# Le righe salvate dal Catering Manager (una per evento e salvataggio) diventano
+# una tabella tipizzata convertendo solo quelle nuove. Gli aggregati tengono
+# solo somme (eventi, pax, incassi, costi), così le righe nuove si sommano a
+# quelli già calcolati; percentuali e valori a pax si ricavano alla lettura.
+
+import threading
+
+import pandas as pd
+
+from galbino.formati import a_data, a_numero, normalizza_nome
+
+STATUS_CATERING = ["PREVENTIVO", "CONSUNTIVO"]
+
+# (colonna, indice nella riga salvata da sezione_personale)
+COLONNE_EVENTI = [("Status", 0), ("Data", 1), ("Cliente", 2), ("Tipo", 3), ("Pax", 4), ("Incasso", 7),
+                  ("Food cost", 8), ("Utenze", 9), ("Staff", 10), ("Costi", 11), ("Margine", 12)]
+SOMME = ["Eventi", "Pax", "Incasso", "Food cost", "Utenze", "Staff", "Costi", "Margine"]
+LIVELLI = ["Mese", "Tipo", "Status"]
+
+
+def tabella_eventi(righe, prima_riga=None):
+    # Righe del DB catering -> DataFrame; le righe di altro tipo (es. preventivi
+    # affitto nello stesso foglio) e l'intestazione si scartano dallo status
+    tenute = [i for i, r in enumerate(righe) if len(r) > 0 and str(r[0]).strip().upper() in STATUS_CATERING]
+    numeri = [None if prima_riga is None else prima_riga + i for i in tenute]
+    righe = [righe[i] for i in tenute]
+    valori = {nome: [r[i] if i < len(r) else "" for r in righe] for nome, i in COLONNE_EVENTI}
+    eventi = pd.DataFrame({
+        "Riga": pd.array(numeri, dtype="Int64"),
+        "Status": [str(v).strip().upper() for v in valori["Status"]],
+        "Data": pd.to_datetime(pd.Series([a_data(v) for v in valori["Data"]], dtype=object), errors="coerce"),
+        "Cliente": [str(v).strip() for v in valori["Cliente"]],
+        "Tipo": [str(v).strip() or "-" for v in valori["Tipo"]],
+        **{nome: pd.to_numeric(pd.Series([a_numero(v) for v in valori[nome]], dtype=object), errors="coerce").fillna(0.0)
+           for nome, _ in COLONNE_EVENTI[4:]},
+    })
+    return eventi[eventi["Data"].notna()].reset_index(drop=True)
+
+
+def _aggrega(eventi):
+    # (mese, tipo, status) -> somme
+    return eventi.assign(Mese=eventi["Data"].dt.to_period("M").astype(str), Eventi=1).groupby(
+        ["Mese", "Tipo", "Status"], sort=True)[SOMME].sum()
+
+
+def indicatori(somme):
+    # Somme -> indicatori leggibili: margine %, food cost e staff per pax
+    pax = somme["Pax"].where(somme["Pax"] > 0)
+    incasso = somme["Incasso"].where(somme["Incasso"] > 0)
+    return pd.DataFrame({
+        "Eventi": somme["Eventi"].astype(int),
+        "Pax": somme["Pax"],
+        "Incasso €": somme["Incasso"],
+        "Costi €": somme["Costi"],
+        "Margine €": somme["Margine"],
+        "Margine %": (somme["Margine"] / incasso * 100).fillna(0.0),
+        "Food cost/pax €": (somme["Food cost"] / pax).fillna(0.0),
+        "Staff/pax €": (somme["Staff"] / pax).fillna(0.0),
+    }, index=somme.index)
+
+
+class CruscottoCatering:
+    # Una istanza per processo, stesso schema di ReportDiario: si riparte da zero
+    # solo quando cambia la generazione del foglio catering.
+
+    def __init__(self):
+        self.generazione = None
+        self.righe_lette = 1 # riga 1 = intestazione
+        self.versione = 0
+        self._eventi = tabella_eventi([])
+        self._aggregati = None
+        self._viste = {}
+        self._lock = threading.Lock()
+
+    def aggiorna(self, generazione, leggi):
+        # leggi(n): righe del foglio successive alla riga n
+        with self._lock:
+            if generazione != self.generazione:
+                self.generazione, self.righe_lette = generazione, 1
+                self._eventi, self._aggregati, self._viste = tabella_eventi([]), None, {}
+                self.versione += 1
+            nuove = leggi(self.righe_lette)
+            if not nuove: return
+            blocco = tabella_eventi(nuove, self.righe_lette + 1)
+            self.righe_lette += len(nuove)
+            if blocco.empty: return
+            self._eventi = pd.concat([self._eventi, blocco], ignore_index=True) if len(self._eventi) else blocco
+            if self._aggregati is not None: self._aggregati = self._aggregati.add(_aggrega(blocco), fill_value=0)
+            self._viste = {}
+            self.versione += 1
+
+    def eventi(self, in_attesa=()):
+        # Tutti gli eventi, compresi quelli salvati e non ancora sul foglio
+        with self._lock:
+            eventi = self._eventi
+        if not in_attesa: return eventi
+        return pd.concat([eventi, tabella_eventi(in_attesa)], ignore_index=True)
+
+    def aggregati(self, in_attesa=()):
+        with self._lock:
+            if self._aggregati is None: self._aggregati = _aggrega(self._eventi)
+            agg = self._aggregati
+        if in_attesa:
+            pendenti = tabella_eventi(in_attesa)
+            if not pendenti.empty: agg = agg.add(_aggrega(pendenti), fill_value=0)
+        return agg
+
+    def _vista(self, chiave, in_attesa, calcola):
+        chiave = (chiave, self.versione, tuple(tuple(map(str, r)) for r in in_attesa))
+        with self._lock:
+            if chiave in self._viste: return self._viste[chiave]
+        valore = calcola()
+        with self._lock:
+            self._viste[chiave] = valore
+        return valore
+
+    def per_gruppo(self, livelli, in_attesa=()):
+        # livelli: sottoinsieme ordinato di LIVELLI
+        def calcola():
+            agg = self.aggregati(in_attesa)
+            if agg.empty: return indicatori(pd.DataFrame(columns=SOMME, dtype=float))
+            somme = agg.groupby(level=list(livelli)).sum()
+            if "Mese" in livelli: somme = somme.sort_index(level="Mese", ascending=False, sort_remaining=False)
+            return indicatori(somme)
+        return self._vista(("gruppo", tuple(livelli)), in_attesa, calcola)
+
+    def confronto(self, in_attesa=()):
+        # Un evento = stesso cliente e data; vale l'ultimo salvataggio di ogni status
+        def calcola():
+            eventi = self.eventi(in_attesa)
+            eventi = eventi.assign(Chiave=eventi["Cliente"].map(normalizza_nome)).drop_duplicates(["Chiave", "Data", "Status"], keep="last")
+            ultimi = eventi.set_index(["Chiave", "Data", "Status"])
+            prev = indicatori(ultimi.xs("PREVENTIVO", level="Status").assign(Eventi=1)) if "PREVENTIVO" in set(eventi["Status"]) else None
+            cons = indicatori(ultimi.xs("CONSUNTIVO", level="Status").assign(Eventi=1)) if "CONSUNTIVO" in set(eventi["Status"]) else None
+            colonne = ["Data", "Cliente", "Tipo", "Incasso prev. €", "Incasso cons. €", "Margine prev. %", "Margine cons. %",
+                       "Δ Margine €", "Δ Food cost/pax €", "Δ Staff/pax €"]
+            if prev is None or cons is None: return pd.DataFrame(columns=colonne)
+            coppie = prev.join(cons, how="inner", lsuffix=" prev", rsuffix=" cons")
+            if coppie.empty: return pd.DataFrame(columns=colonne)
+            nomi = ultimi.xs("CONSUNTIVO", level="Status").loc[coppie.index]
+            return pd.DataFrame({
+                "Data": coppie.index.get_level_values("Data"),
+                "Cliente": nomi["Cliente"].to_numpy(),
+                "Tipo": nomi["Tipo"].to_numpy(),
+                "Incasso prev. €": coppie["Incasso € prev"].to_numpy(),
+                "Incasso cons. €": coppie["Incasso € cons"].to_numpy(),
+                "Margine prev. %": coppie["Margine % prev"].to_numpy(),
+                "Margine cons. %": coppie["Margine % cons"].to_numpy(),
+                "Δ Margine €": (coppie["Margine € cons"] - coppie["Margine € prev"]).to_numpy(),
+                "Δ Food cost/pax €": (coppie["Food cost/pax € cons"] - coppie["Food cost/pax € prev"]).to_numpy(),
+                "Δ Staff/pax €": (coppie["Staff/pax € cons"] - coppie["Staff/pax € prev"]).to_numpy(),
+            }, columns=colonne).sort_values("Data", ascending=False).reset_index(drop=True)
+        return self._vista(("confronto",), in_attesa, calcola)
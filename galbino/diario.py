@@ -0,0 +1,235 @@
+# ==============================================================================
+# DIARIO CLINICO: ANAGRAFICA + STORICO SEDUTE
+# ==============================================================================
+# AnalisiDiario tiene in memoria ultima visita e ultimo prezzo di ogni paziente
+# e a ogni rerun elabora solo le righe nuove del Diario; IndicePazienti cerca
+# i nomi per prefisso/sottostringa senza accenti né maiuscole.
+
+import bisect
+import datetime
+import functools
+import heapq
+import threading
+
+from galbino.formati import normalizza_nome
+
+
+def a_prezzo(testo):
+    # "€ 60,00" -> 60.0 ; vuoto o non numerico -> None
+    p_clean = str(testo).replace("€", "").replace(",", ".").strip()
+    if not p_clean: return None
+    try: return float(p_clean)
+    except ValueError: return None
+
+
+@functools.lru_cache(maxsize=8192)
+def _data_seduta(testo):
+    # Le date si ripetono (25 sedute al giorno = 1 conversione)
+    try: return datetime.datetime.strptime(testo, "%d/%m/%Y").date()
+    except ValueError: return None
+
+
+def _elabora_storico(righe, pazienti_last_date, pazienti_last_price):
+    # Aggiorna i due dizionari con le righe del Diario; -> nomi mai visti prima
+    nuovi = []
+    for row in righe:
+        if len(row) > 3:
+            data_str = row[0]
+            nome = row[1].strip()
+            
+            if nome and data_str:
+                dt = _data_seduta(data_str)
+                if dt is None: continue
+                
+                # Aggiorna data ultima visita
+                if nome not in pazienti_last_date:
+                    nuovi.append(nome)
+                    pazienti_last_date[nome] = dt
+                elif dt > pazienti_last_date[nome]:
+                    pazienti_last_date[nome] = dt
+                
+                # Aggiorna ultimo prezzo pagato
+                valore = a_prezzo(row[3])
+                if valore is not None and valore > 0:
+                    pazienti_last_price[nome] = valore
+    return nuovi
+
+
+def _leggi_anagrafica(dati_pazienti):
+    # Salta intestazione (riga 1); il prezzo in colonna B è facoltativo
+    nomi_anagrafica, prezzi = [], {}
+    for row in dati_pazienti[1:]:
+        if len(row) >= 1:
+            nome = row[0].strip()
+            if nome:
+                nomi_anagrafica.append(nome)
+                if len(row) >= 2:
+                    prezzo = a_prezzo(row[1])
+                    if prezzo is not None:
+                        prezzi[nome] = prezzo
+    return nomi_anagrafica, prezzi
+
+
+class IndicePazienti:
+    # Coppie (nome normalizzato, nome) ordinate: i prefissi si trovano con una
+    # bisezione, le sottostringhe con una scansione dei soli nomi (non delle sedute).
+
+    def __init__(self, nomi=()):
+        self._nomi = set(nomi)
+        self._chiavi = sorted((normalizza_nome(n), n) for n in self._nomi)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._nomi)
+
+    def __contains__(self, nome):
+        return nome in self._nomi
+
+    def nomi(self):
+        return sorted(self._nomi)
+
+    def aggiungi(self, nome):
+        with self._lock:
+            if nome in self._nomi: return
+            self._nomi.add(nome)
+            bisect.insort(self._chiavi, (normalizza_nome(nome), nome))
+
+    def gruppi(self, q):
+        # q già normalizzato -> (inizia con q, una parola inizia con q, contiene q), in ordine alfabetico
+        with self._lock:
+            i = bisect.bisect_left(self._chiavi, (q,))
+            prefisso = []
+            while i < len(self._chiavi) and self._chiavi[i][0].startswith(q):
+                prefisso.append(self._chiavi[i][1])
+                i += 1
+            parola, interno = [], []
+            for norm, nome in self._chiavi:
+                pos = norm.find(q)
+                if pos <= 0: continue
+                (parola if norm[pos - 1] == " " else interno).append(nome)
+        return prefisso, parola, interno
+
+    def cerca(self, testo, limite=20, priorita=None):
+        # Prima chi inizia col testo, poi chi ha una parola che inizia col testo
+        # (es. il cognome), poi il resto; a parità, visite più recenti in alto
+        q = normalizza_nome(testo)
+        if not q: return []
+        return _ordina_gruppi(self.gruppi(q), limite, priorita)
+
+
+class IndiceConAggiunte:
+    # Indice delle sedute già nel foglio più i nomi che valgono solo per questo
+    # rerun (anagrafica, sedute ancora in coda): la base non cambia, così una
+    # seduta scartata dalla coda non lascia un paziente fantasma nella ricerca.
+
+    def __init__(self, base, aggiunte):
+        self.base = base
+        self.aggiunte = IndicePazienti(n for n in aggiunte if n not in base)
+
+    def __len__(self):
+        return len(self.base) + len(self.aggiunte)
+
+    def __contains__(self, nome):
+        return nome in self.base or nome in self.aggiunte
+
+    def nomi(self):
+        return sorted(self.base.nomi() + self.aggiunte.nomi())
+
+    def cerca(self, testo, limite=20, priorita=None):
+        q = normalizza_nome(testo)
+        if not q: return []
+        if not len(self.aggiunte): return _ordina_gruppi(self.base.gruppi(q), limite, priorita)
+        # Gruppi uniti mantenendo l'ordine alfabetico dell'indice
+        gruppi = [sorted(a + b, key=lambda n: (normalizza_nome(n), n)) for a, b in zip(self.base.gruppi(q), self.aggiunte.gruppi(q))]
+        return _ordina_gruppi(gruppi, limite, priorita)
+
+
+def _ordina_gruppi(gruppi, limite, priorita):
+    prefisso, parola, interno = gruppi
+    if priorita is not None:
+        for gruppo in (prefisso, parola, interno):
+            gruppo.sort(key=lambda n: priorita.get(n, datetime.date.min), reverse=True)
+    return (prefisso + parola + interno)[:limite]
+
+
+def riga_seduta(data, paziente, tipo, prezzo, note=""):
+    # Riga del Diario come la scrive il form: importo con la virgola, da incassare
+    return [data.strftime("%d/%m/%Y"), paziente, tipo, f"{prezzo:.2f}".replace(".", ","), note, "DA FARE"]
+
+
+def serie_date(inizio, fine, ogni_settimane=1, escluse=()):
+    # Stesso giorno della settimana da inizio a fine (inclusi), saltando le date escluse
+    passo = datetime.timedelta(weeks=ogni_settimane)
+    escluse, date, giorno = set(escluse), [], inizio
+    while giorno <= fine:
+        if giorno not in escluse: date.append(giorno)
+        giorno += passo
+    return date
+
+
+def recenti(ultime_visite, limite=20):
+    # I pazienti visti più di recente, senza ordinare tutto l'archivio
+    return heapq.nlargest(limite, ultime_visite, key=ultime_visite.get)
+
+
+class AnalisiDiario:
+    # Stato di analizza_dati tenuto tra i rerun (una istanza per processo).
+    # Si riparte da zero solo quando cambia la generazione del Diario, cioè
+    # quando nel foglio sono state modificate o cancellate righe già lette.
+
+    def __init__(self):
+        self.generazione = None
+        self.righe_lette = 1 # riga 1 = intestazione
+        self.ultima_data = {}
+        self.ultimo_prezzo = {}
+        self.indice = IndicePazienti()
+        self._lock = threading.Lock()
+
+    def aggiorna(self, generazione, leggi):
+        # leggi(n): righe del Diario successive alla riga n del foglio
+        with self._lock:
+            da_capo = generazione != self.generazione
+            if da_capo:
+                self.generazione, self.righe_lette = generazione, 1
+                self.ultima_data, self.ultimo_prezzo = {}, {}
+            nuove = leggi(self.righe_lette)
+            nomi_nuovi = _elabora_storico(nuove, self.ultima_data, self.ultimo_prezzo)
+            self.righe_lette += len(nuove)
+            if da_capo: self.indice = IndicePazienti(self.ultima_data)
+            else:
+                for nome in nomi_nuovi: self.indice.aggiungi(nome)
+
+    def risultato(self, dati_pazienti, in_attesa=(), oggi=None):
+        # -> (attivi, ultimo prezzo per paziente, ultima visita per paziente, indice per la ricerca)
+        # in_attesa: sedute registrate ma non ancora nel foglio (non memorizzate:
+        # i loro nomi e quelli dell'anagrafica stanno solo nell'indice restituito)
+        with self._lock:
+            pazienti_last_date, prezzi_storico = self.ultima_data, self.ultimo_prezzo
+            nomi_in_attesa = []
+            if in_attesa:
+                pazienti_last_date, prezzi_storico = dict(pazienti_last_date), dict(prezzi_storico)
+                nomi_in_attesa = _elabora_storico(in_attesa, pazienti_last_date, prezzi_storico)
+            nomi_anagrafica, prezzi_anagrafica = _leggi_anagrafica(dati_pazienti)
+            indice = IndiceConAggiunte(self.indice, list(nomi_in_attesa) + list(nomi_anagrafica))
+            
+            # Lo storico vince sull'anagrafica (aggiorna il prezzo all'ultimo usato)
+            pazienti_last_price = {**prezzi_anagrafica, **prezzi_storico}
+            
+            # Lista Attiva: Anagrafica + Recenti (90gg)
+            oggi = oggi or datetime.date.today()
+            attivi_set = set(nomi_anagrafica)
+            for p, data_ult in pazienti_last_date.items():
+                if (oggi - data_ult).days <= 90:
+                    attivi_set.add(p)
+        return sorted(attivi_set), pazienti_last_price, pazienti_last_date, indice
+
+
+def analizza_dati(dati_pazienti, data_diario, oggi=None):
+    # Analisi completa in un colpo solo (stesso risultato di AnalisiDiario da zero)
+    analisi = AnalisiDiario()
+    analisi.aggiorna(None, lambda n: data_diario[n:])
+    attivi, pazienti_last_price, _, indice = analisi.risultato(dati_pazienti, oggi=oggi)
+    
+    # Archivio: Tutto
+    storico_completo = indice.nomi()
+    return attivi, storico_completo, pazienti_last_price
@@ -0,0 +1,252 @@
+# ==============================================================================
+# DISPONIBILITÀ: CACHE DEL CALENDARIO ICAL CON INDICE DEGLI OCCUPATI
+# ==============================================================================
+# Il feed viene scaricato e analizzato una sola volta per processo, poi
+# ricontrollato in background ogni TTL con GET condizionale (ETag /
+# If-Modified-Since). Le domande "è libero?" non toccano mai la rete.
+# Più canali (Lodgify, Airbnb, Booking, blocchi eventi) si scaricano in
+# parallelo e si fondono in un solo indice che ricorda da quale canale
+# arriva ogni blocco. requests e icalendar si importano al primo calendario.
+
+import bisect
+import concurrent.futures
+import datetime
+import os
+import re
+import threading
+import time
+
+from galbino.resilienza import proteggi_sessione
+from galbino.tracciamento import span
+
+TTL_CALENDARIO = 300    # secondi tra due controlli del feed
+TIMEOUT_CALENDARIO = 10 # secondi massimi di attesa della risposta
+SCADENZA_CANALI = 4     # secondi massimi di attesa della pagina per i canali mai scaricati
+
+
+def _a_data(valore):
+    if isinstance(valore, datetime.datetime): return valore.date()
+    return valore
+
+
+class IndiceOccupazione:
+    # Intervalli [inizio, fine) ordinati e fusi tra loro: non si sovrappongono,
+    # quindi anche le date di fine sono ordinate e basta una bisezione (O(log n)).
+    # Gli intervalli possono avere un terzo elemento, il canale: fonti[i] sono i
+    # canali che occupano il blocco fuso intervalli[i].
+
+    def __init__(self, intervalli=()):
+        fusi, fonti = [], []
+        for inizio, fine, *fonte in sorted(intervalli, key=lambda x: (x[0], x[1])):
+            if fine <= inizio: continue
+            if fusi and inizio <= fusi[-1][1]:
+                if fine > fusi[-1][1]: fusi[-1] = (fusi[-1][0], fine)
+                fonti[-1].update(fonte)
+            else:
+                fusi.append((inizio, fine))
+                fonti.append(set(fonte))
+        self.intervalli = fusi
+        self.fonti = [tuple(sorted(f)) for f in fonti]
+        self._fini = [fine for _, fine in fusi]
+
+    def __len__(self):
+        return len(self.intervalli)
+
+    def _primo_conflitto(self, checkin, checkout):
+        # Primo blocco che termina dopo il check-in: è l'unico candidato
+        i = bisect.bisect_right(self._fini, checkin)
+        if i < len(self.intervalli) and self.intervalli[i][0] < checkout:
+            return i
+        return None
+
+    def conflitto(self, checkin, checkout):
+        i = self._primo_conflitto(checkin, checkout)
+        return None if i is None else self.intervalli[i]
+
+    def dettaglio_conflitto(self, checkin, checkout):
+        # -> (inizio, fine, canali) oppure None
+        i = self._primo_conflitto(checkin, checkout)
+        return None if i is None else (*self.intervalli[i], self.fonti[i])
+
+    @classmethod
+    def unisci(cls, indici):
+        # {canale: IndiceOccupazione} -> un solo indice con i canali di ogni blocco
+        return cls((inizio, fine, nome) for nome, indice in indici.items() for inizio, fine in indice.intervalli)
+
+    @classmethod
+    def da_ical(cls, contenuto):
+        from icalendar import Calendar
+        cal = Calendar.from_ical(contenuto)
+        intervalli = []
+        for component in cal.walk("VEVENT"):
+            dtstart = component.get('dtstart')
+            if dtstart is None: continue
+            inizio = _a_data(dtstart.dt)
+            dtend = component.get('dtend')
+            fine = _a_data(dtend.dt) if dtend is not None else inizio + datetime.timedelta(days=1)
+            intervalli.append((inizio, fine))
+        return cls(intervalli)
+
+
+class CacheCalendario:
+    # Una istanza per URL, condivisa da tutte le sessioni del processo.
+    # Con percorso_snapshot l'ultimo feed valido resta anche su disco: dopo un
+    # riavvio si riparte da quello e lo si aggiorna in background.
+
+    def __init__(self, url, ttl=TTL_CALENDARIO, timeout=TIMEOUT_CALENDARIO, nome="lodgify", percorso_snapshot=None):
+        self.url = url
+        self.nome = nome
+        self.percorso_snapshot = percorso_snapshot
+        self.ttl = ttl
+        self.timeout = timeout
+        self.errore = None
+        self.aggiornato_il = None
+        self.versione = 0 # +1 a ogni nuovo indice
+        self._indice = None
+        self._etag = None
+        self._last_modified = None
+        self._controllato = 0.0
+        self._lock_scarico = threading.Lock()
+        import requests
+        self._session = requests.Session()
+        self._session.headers["User-Agent"] = "Mozilla/5.0"
+        # Interruttore per host: un canale che non risponde non occupa i thread ad ogni TTL
+        proteggi_sessione(self._session, timeout=(3.05, timeout), scadenza=timeout * 2)
+
+    def indice(self):
+        # Primo accesso sincrono; dopo si serve sempre l'ultimo indice valido
+        if self._indice is None:
+            with self._lock_scarico:
+                if self._indice is None and not self._carica_snapshot(): self._scarica()
+        if time.monotonic() - self._controllato > self.ttl:
+            self._aggiorna_in_background()
+        if self._indice is None:
+            raise RuntimeError(self.errore or "Calendario non disponibile")
+        return self._indice
+
+    def ultimo_indice(self):
+        # Senza rete e senza attese: None se il canale non è mai stato scaricato
+        return self._indice
+
+    def _carica_snapshot(self):
+        if not self.percorso_snapshot or not os.path.exists(self.percorso_snapshot): return False
+        try:
+            with open(self.percorso_snapshot, "rb") as f: contenuto = f.read()
+            self._indice = IndiceOccupazione.da_ical(contenuto)
+        except Exception:
+            return False
+        self.versione += 1
+        self.aggiornato_il = datetime.datetime.fromtimestamp(os.path.getmtime(self.percorso_snapshot))
+        self._controllato = time.monotonic() - self.ttl - 1 # da ricontrollare subito
+        return True
+
+    def _salva_snapshot(self, contenuto):
+        if not self.percorso_snapshot: return
+        temporaneo = f"{self.percorso_snapshot}.tmp"
+        try:
+            with open(temporaneo, "wb") as f: f.write(contenuto)
+            os.replace(temporaneo, self.percorso_snapshot)
+        except OSError:
+            pass # lo snapshot è solo un paracadute
+
+    def _aggiorna_in_background(self):
+        if not self._lock_scarico.acquire(blocking=False): return
+        def lavoro():
+            try: self._scarica()
+            finally: self._lock_scarico.release()
+        threading.Thread(target=lavoro, name="calendario-ical", daemon=True).start()
+
+    def _scarica(self):
+        headers = {}
+        if self._indice is not None:
+            if self._etag: headers["If-None-Match"] = self._etag
+            if self._last_modified: headers["If-Modified-Since"] = self._last_modified
+        try:
+            with span(f"{self.nome}.scarico"):
+                r = self._session.get(self.url, headers=headers, timeout=self.timeout)
+            if r.status_code == 304:
+                self._controllato = time.monotonic()
+                self.errore = None
+                return
+            r.raise_for_status()
+            with span(f"{self.nome}.parsing", eventi_byte=len(r.content)):
+                indice = IndiceOccupazione.da_ical(r.content)
+        except Exception as e:
+            # Si tiene l'ultimo indice buono e si riprova al prossimo TTL
+            self._controllato = time.monotonic()
+            self.errore = f"{e}"
+            return
+        self._etag = r.headers.get("ETag")
+        self._last_modified = r.headers.get("Last-Modified")
+        self._indice = indice
+        self.versione += 1
+        self._salva_snapshot(r.content)
+        self._controllato = time.monotonic()
+        self.aggiornato_il = datetime.datetime.now()
+        self.errore = None
+
+
+def _slug(nome):
+    return re.sub(r"[^a-z0-9]+", "_", nome.casefold()).strip("_") or "canale"
+
+
+class CalendarioMultiCanale:
+    # Un CacheCalendario per canale, fusi in un solo IndiceOccupazione.
+    # I canali mai scaricati partono tutti insieme su un pool di thread e la
+    # pagina li aspetta al massimo `scadenza` secondi: chi è lento o in errore
+    # resta fuori (o con il suo ultimo snapshot) e viene riprovato dopo il TTL,
+    # senza bloccare i rerun successivi.
+
+    def __init__(self, fonti, scadenza=SCADENZA_CANALI, ttl=TTL_CALENDARIO, timeout=TIMEOUT_CALENDARIO, snapshot=None):
+        # fonti: [(nome, url)]; snapshot: funzione nome_file -> percorso (es. percorso_dati)
+        self.scadenza = scadenza
+        self.ttl = ttl
+        self.calendari = {
+            nome: CacheCalendario(url, ttl, timeout, nome=f"ical.{_slug(nome)}",
+                                  percorso_snapshot=snapshot(f"calendario_{_slug(nome)}.ics") if snapshot else None)
+            for nome, url in fonti
+        }
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(self.calendari)), thread_name_prefix="calendari")
+        self._lock = threading.Lock()
+        self._in_corso = {}
+        self._tentato_il = {}
+        self._firma = None
+        self._unito = IndiceOccupazione()
+
+    def indice(self):
+        nuovi = []
+        with self._lock:
+            for nome, cal in self.calendari.items():
+                if cal.ultimo_indice() is not None:
+                    cal.indice() # al più avvia l'aggiornamento in background
+                    continue
+                in_corso = self._in_corso.get(nome)
+                if in_corso is not None and not in_corso.done(): continue
+                if time.monotonic() - self._tentato_il.get(nome, -self.ttl - 1) <= self.ttl: continue
+                self._tentato_il[nome] = time.monotonic()
+                self._in_corso[nome] = self._pool.submit(self._primo_scarico, cal)
+                nuovi.append(self._in_corso[nome])
+        if nuovi: concurrent.futures.wait(nuovi, timeout=self.scadenza)
+        return self._indice_unito()
+
+    @staticmethod
+    def _primo_scarico(cal):
+        try: cal.indice()
+        except RuntimeError: pass # errore già in cal.errore
+
+    def _indice_unito(self):
+        # Si rifonde solo quando un canale ha un indice nuovo
+        firma = tuple((nome, cal.versione) for nome, cal in self.calendari.items())
+        with self._lock:
+            if firma != self._firma:
+                indici = {nome: cal.ultimo_indice() for nome, cal in self.calendari.items() if cal.ultimo_indice() is not None}
+                self._unito = IndiceOccupazione.unisci(indici)
+                self._firma = firma
+            return self._unito
+
+    def mancanti(self):
+        return [nome for nome, cal in self.calendari.items() if cal.ultimo_indice() is None]
+
+    def stato(self):
+        return [{"nome": nome, "blocchi": len(cal.ultimo_indice() or ()), "aggiornato_il": cal.aggiornato_il, "errore": cal.errore}
+                for nome, cal in self.calendari.items()]
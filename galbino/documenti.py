@@ -0,0 +1,128 @@
+# ==============================================================================
+# DOCUMENTI: EXCEL DI PREVENTIVO E REPORT CATERING, CON CACHE LRU CONDIVISA
+# ==============================================================================
+# I file si generano solo quando qualcuno li scarica e restano in una cache
+# LRU limitata in byte, condivisa da tutte le sessioni e indicizzata
+# dall'hash degli input: stesso preventivo, stesso file, nessun ricalcolo.
+# xlsxwriter si importa al primo documento generato.
+
+import datetime
+import hashlib
+import io
+import json
+import threading
+from collections import OrderedDict
+
+from galbino.tariffe import LISTA_SERVIZI
+from galbino.tracciamento import traccia
+
+MAX_BYTE_CACHE = 32 * 1024 * 1024
+
+
+class CacheDocumenti:
+
+    def __init__(self, max_byte=MAX_BYTE_CACHE):
+        self.max_byte = max_byte
+        self._dati = OrderedDict()
+        self._byte = 0
+        self._lock = threading.Lock()
+        self.statistiche = {"generati": 0, "riusati": 0, "scartati": 0}
+
+    @staticmethod
+    def chiave(*parti):
+        testo = json.dumps(parti, default=str, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(testo.encode("utf-8")).hexdigest()
+
+    def ottieni(self, chiave, genera):
+        with self._lock:
+            if chiave in self._dati:
+                self._dati.move_to_end(chiave)
+                self.statistiche["riusati"] += 1
+                return self._dati[chiave]
+        # Generazione fuori dal lock: le altre sessioni non aspettano
+        dati = genera()
+        with self._lock:
+            if chiave not in self._dati:
+                self._dati[chiave] = dati
+                self._byte += len(dati)
+                self.statistiche["generati"] += 1
+            while self._byte > self.max_byte and len(self._dati) > 1:
+                _, vecchio = self._dati.popitem(last=False)
+                self._byte -= len(vecchio)
+                self.statistiche["scartati"] += 1
+        return dati
+
+    def occupazione(self):
+        with self._lock:
+            return len(self._dati), self._byte
+
+
+@traccia("excel.preventivo")
+def generate_excel(autore, canale, cliente, checkin, checkout, notti, ospiti, affitto_finale, pulizie_finali, dettagli_servizi, sconto, totale_gen, costo_medio, note):
+    output = io.BytesIO()
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    worksheet = workbook.add_worksheet("Preventivo")
+    bold = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'bg_color': '#D3D3D3'})
+    merge_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'vcenter', 'bg_color': '#FFD700'}) 
+    currency = workbook.add_format({'num_format': '#,##0.00 €', 'border': 1, 'align': 'center'})
+    normal = workbook.add_format({'border': 1, 'align': 'center'})
+
+    worksheet.set_column('A:B', 15); worksheet.set_column('C:C', 12); worksheet.set_column('D:D', 30)
+    worksheet.set_column('E:F', 13); worksheet.set_column('G:H', 8); worksheet.set_column('I:K', 16)
+
+    general_headers = ["Autore", "Canale", "Data Prev", "Cliente", "CheckIn", "CheckOut", "Notti", "Ospiti", "Affitto", "Media/Notte", "Pulizie"]
+    worksheet.write_row('A1', general_headers, bold)
+    worksheet.write_row('A2', [autore, canale, datetime.date.today().strftime("%d/%m/%Y"), cliente, checkin.strftime("%d/%m/%Y"), checkout.strftime("%d/%m/%Y"), notti, ospiti], normal)
+    worksheet.write('I2', affitto_finale, currency); worksheet.write('J2', costo_medio, currency); worksheet.write('K2', pulizie_finali, currency)
+
+    col_idx = 11 
+    for nome, _ in LISTA_SERVIZI:
+        worksheet.merge_range(0, col_idx, 0, col_idx+3, nome.upper(), merge_format)
+        worksheet.write_row(1, col_idx, ["€ Unit", "Pax", "Qta", "Totale"], bold)
+        if nome in dettagli_servizi:
+            d = dettagli_servizi[nome]
+            worksheet.write(2, col_idx, d['p_unit'], currency); worksheet.write(2, col_idx+1, d['pax'], normal)
+            worksheet.write(2, col_idx+2, d['qta'], normal); worksheet.write(2, col_idx+3, d['subtotale'], currency)
+        else:
+            worksheet.write_row(2, col_idx, [0, 0, 0, 0], currency)
+        col_idx += 4 
+
+    col_idx += 1
+    worksheet.write(0, col_idx, "SCONTO", bold); worksheet.write(2, col_idx, sconto, currency)
+    worksheet.write(0, col_idx+1, "TOTALE", bold); worksheet.write(2, col_idx+1, totale_gen, currency)
+    worksheet.write(0, col_idx+2, "NOTE", bold); worksheet.write(2, col_idx+2, note, normal)
+    workbook.close()
+    return output.getvalue()
+
+
+@traccia("excel.catering")
+def genera_excel_catering(cliente, data_evento, status, pax, prezzo, incasso_loc, tot_inc, fc, cost_utenze, kwh_val, p_kwh, staff_tot, tot_costi, marg_eur, marg_perc, staff_list, menu, note):
+    output = io.BytesIO()
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    ws = workbook.add_worksheet("Catering")
+    fmt_head = workbook.add_format({'bold': True, 'bg_color': '#FFD700', 'border': 1})
+    fmt_curr = workbook.add_format({'num_format': '#,##0.00 €', 'border': 1})
+
+    ws.write('A1', f"CATERING: {cliente}", fmt_head)
+    ws.write('B1', status, fmt_head)
+
+    ws.write('A3', "Incasso Totale"); ws.write('B3', tot_inc, fmt_curr)
+    ws.write('A4', "Food Cost"); ws.write('B4', fc, fmt_curr)
+    ws.write('A5', f"Utenze ({kwh_val} kWh * €{p_kwh})"); ws.write('B5', cost_utenze, fmt_curr)
+    ws.write('A6', "Staff Totale"); ws.write('B6', staff_tot, fmt_curr)
+    ws.write('A7', "COSTI TOTALI"); ws.write('B7', tot_costi, fmt_curr)
+
+    ws.write('A9', "Margine €"); ws.write('B9', marg_eur, fmt_curr)
+    ws.write('A10', "Margine %"); ws.write('B10', marg_perc, workbook.add_format({'num_format': '0.00%'}))
+
+    ws.write('A12', "DETTAGLIO STAFF", fmt_head)
+    for i, s in enumerate(staff_list): ws.write(12+i+1, 0, s)
+
+    r_menu = 12+len(staff_list)+3
+    ws.write(r_menu, 0, "MENU", fmt_head)
+    ws.write(r_menu+1, 0, menu)
+
+    workbook.close()
+    return output.getvalue()
@@ -0,0 +1,160 @@
+# ==============================================================================
+# ESPORTAZIONE DB: LETTURA A BLOCCHI E SCRITTURA IN STREAMING, CON TIPI
+# ==============================================================================
+# Il foglio si legge a blocchi di righe (A{i}:{col}{j}) e ogni blocco viene
+# scritto subito su file: in memoria c'è al massimo un blocco. Date ed importi
+# diventano valori nativi (date, numeri) invece di testo.
+
+import csv
+import datetime
+import importlib.util
+import os
+import tempfile
+
+from galbino.formati import a_data, a_numero, lettera_colonna
+from galbino.tracciamento import span, traccia
+
+# xlsxwriter e pyarrow si importano solo nello scrittore che li usa
+
+BLOCCO_RIGHE = 2000
+
+FORMATI_EXPORT = {"Excel": "xlsx", "CSV": "csv"}
+# Parquet disponibile solo con pyarrow installato
+if importlib.util.find_spec("pyarrow") is not None: FORMATI_EXPORT["Parquet"] = "parquet"
+
+MIME_EXPORT = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def tipi_colonne_preventivi(lista_servizi):
+    # Stesso ordine della riga scritta da salva_su_google_sheets
+    tipi = ["testo", "testo", "data", "testo", "data", "data", "intero", "intero", "euro", "euro", "euro"]
+    for _ in lista_servizi: tipi += ["euro", "intero", "intero", "euro"]
+    return tipi + ["euro", "euro", "testo"]
+
+
+def converti(valore, tipo):
+    # Se il valore non è del tipo atteso resta testo (in Parquet diventa nullo)
+    if valore in ("", None): return None
+    if tipo == "data":
+        return a_data(valore) or valore
+    if tipo in ("euro", "numero", "intero"):
+        n = a_numero(valore)
+        if n is None: return valore
+        return int(n) if tipo == "intero" and n.is_integer() else n
+    return valore
+
+
+def leggi_a_blocchi(ws, larghezza, blocco=BLOCCO_RIGHE):
+    # Google toglie le righe vuote in fondo a ogni intervallo: un blocco corto o
+    # vuoto non vuol dire fine del foglio. Si legge fino alla dimensione della
+    # griglia (row_count) e le righe vuote si restituiscono solo se dopo c'è
+    # ancora qualcosa, come fa get_all_values. Oltre row_count (handle con la
+    # dimensione di prima di un append) si prosegue finché arrivano righe.
+    col = lettera_colonna(larghezza)
+    totale = ws.row_count
+    inizio, vuote = 1, 0
+    while True:
+        with span("sheets.lettura_blocco"):
+            righe = ws.get(f"A{inizio}:{col}{inizio + blocco - 1}")
+        if righe:
+            yield [[""] * larghezza] * vuote + [list(r) + [""] * (larghezza - len(r)) for r in righe]
+            vuote = blocco - len(righe)
+        else:
+            vuote += blocco
+        inizio += blocco
+        if inizio > totale and not righe: return
+
+
+def _nomi_colonne(intestazione, larghezza):
+    nomi, visti = [], {}
+    for i in range(larghezza):
+        nome = str(intestazione[i]).strip() if intestazione and i < len(intestazione) else ""
+        nome = nome or f"Colonna {lettera_colonna(i + 1)}"
+        visti[nome] = visti.get(nome, 0) + 1
+        nomi.append(nome if visti[nome] == 1 else f"{nome} ({visti[nome]})")
+    return nomi
+
+
+def _righe_tipizzate(blocchi, tipi):
+    # Prima riga = intestazione (come in download del DB); poi righe convertite a blocchi
+    intestazione = None
+    for blocco in blocchi:
+        if intestazione is None:
+            intestazione, blocco = blocco[0], blocco[1:]
+            yield intestazione
+        yield [[converti(v, t) for v, t in zip(r, tipi)] for r in blocco]
+
+
+# --- Scrittori ---
+
+def _scrivi_xlsx(percorso, intestazione, blocchi, tipi):
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(percorso, {'constant_memory': True})
+    worksheet = workbook.add_worksheet("DB Completo")
+    bold = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'bg_color': '#D3D3D3'})
+    formati = {"data": workbook.add_format({'num_format': 'dd/mm/yyyy'}),
+               "euro": workbook.add_format({'num_format': '#,##0.00 €'})}
+    for c, tipo in enumerate(tipi):
+        worksheet.set_column(c, c, 12 if tipo in ("data", "euro") else 10 if tipo == "intero" else 18)
+    worksheet.write_row(0, 0, intestazione, bold)
+    r = 1
+    for blocco in blocchi:
+        for riga in blocco:
+            for c, (v, tipo) in enumerate(zip(riga, tipi)):
+                if v is None: continue
+                if isinstance(v, datetime.date): worksheet.write_datetime(r, c, datetime.datetime.combine(v, datetime.time()), formati["data"])
+                elif isinstance(v, (int, float)): worksheet.write_number(r, c, v, formati.get(tipo))
+                else: worksheet.write_string(r, c, str(v))
+            r += 1
+    workbook.close()
+
+def _scrivi_csv(percorso, intestazione, blocchi, tipi):
+    with open(percorso, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(intestazione)
+        for blocco in blocchi:
+            for riga in blocco:
+                writer.writerow([
+                    v.strftime("%d/%m/%Y") if isinstance(v, datetime.date)
+                    else str(v).replace(".", ",") if isinstance(v, float)
+                    else "" if v is None else v
+                    for v in riga])
+
+def _scrivi_parquet(percorso, intestazione, blocchi, tipi):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    tipi_pa = {"data": pa.date32(), "euro": pa.float64(), "numero": pa.float64(), "intero": pa.int64()}
+    schema = pa.schema([(n, tipi_pa.get(t, pa.string())) for n, t in zip(intestazione, tipi)])
+    with pq.ParquetWriter(percorso, schema) as writer:
+        for blocco in blocchi:
+            colonne = []
+            for c, campo in enumerate(schema):
+                valori = [r[c] for r in blocco]
+                if pa.types.is_date32(campo.type): valori = [v if isinstance(v, datetime.date) else None for v in valori]
+                elif pa.types.is_floating(campo.type): valori = [float(v) if isinstance(v, (int, float)) else None for v in valori]
+                elif pa.types.is_integer(campo.type): valori = [v if isinstance(v, int) else None for v in valori]
+                else: valori = [None if v is None else str(v) for v in valori]
+                colonne.append(pa.array(valori, type=campo.type))
+            writer.write_table(pa.Table.from_arrays(colonne, schema=schema))
+
+SCRITTORI = {"xlsx": _scrivi_xlsx, "csv": _scrivi_csv, "parquet": _scrivi_parquet}
+
+
+@traccia("export.db")
+def esporta_foglio(ws, tipi, formato, blocco=BLOCCO_RIGHE):
+    # Ritorna il percorso di un file temporaneo (da cancellare dopo l'uso) o None se il foglio è vuoto
+    righe = _righe_tipizzate(leggi_a_blocchi(ws, len(tipi), blocco), tipi)
+    intestazione = next(righe, None)
+    if intestazione is None: return None
+    fd, percorso = tempfile.mkstemp(suffix=f".{formato}")
+    os.close(fd)
+    try:
+        SCRITTORI[formato](percorso, _nomi_colonne(intestazione, len(tipi)), righe, tipi)
+    except Exception:
+        os.remove(percorso)
+        raise
+    return percorso
@@ -0,0 +1,43 @@
+# ==============================================================================
+# FINESTRE LIBERE: TUTTI I SOGGIORNI DISPONIBILI NEI PROSSIMI MESI, CON PREZZO
+# ==============================================================================
+# Le notti occupate si ricavano dai blocchi del calendario in un solo passaggio
+# (+1 all'inizio, -1 alla fine, somma cumulativa). Un soggiorno [i, i + notti)
+# è libero se la somma cumulativa delle notti occupate non cambia tra i due
+# estremi: il filtro vale per tutta la griglia del listino in un colpo solo.
+
+import numpy as np
+import pandas as pd
+
+from galbino.tracciamento import traccia
+
+ORDINAMENTI = {
+    "Prezzo totale": ["Prezzo Airbnb", "CheckIn"],
+    "Prezzo a notte": ["Media a Notte", "CheckIn"],
+    "Data di arrivo": ["CheckIn", "Notti"],
+}
+
+
+def notti_occupate(intervalli, data_da, giorni):
+    # Array di `giorni` booleani: True se la notte data_da + k è occupata
+    delta = np.zeros(giorni + 1, dtype=np.int32)
+    for inizio, fine in intervalli:
+        i, j = max((inizio - data_da).days, 0), min((fine - data_da).days, giorni)
+        if i < j:
+            delta[i] += 1
+            delta[j] -= 1
+    return np.cumsum(delta[:-1]) > 0
+
+
+@traccia("finestre.ricerca")
+def finestre_libere(listino, intervalli, ordine="Prezzo totale", limite=None):
+    # listino: DataFrame di calcola_listino (una riga per check-in x notti)
+    if listino.empty: return listino.assign(**{"Media a Notte": pd.Series(dtype=float)})
+    data_da = listino["CheckIn"].min().date()
+    inizio = (listino["CheckIn"] - pd.Timestamp(data_da)).dt.days.to_numpy()
+    notti = listino["Notti"].to_numpy()
+    occupate = np.concatenate(([0], np.cumsum(notti_occupate(intervalli, data_da, int((inizio + notti).max())))))
+    libere = listino[occupate[inizio + notti] == occupate[inizio]]
+    libere = libere.assign(**{"Media a Notte": libere["Prezzo Airbnb"] / libere["Notti"]})
+    libere = libere.sort_values(ORDINAMENTI[ordine], kind="stable")
+    return libere if limite is None else libere.head(limite)
@@ -0,0 +1,50 @@
+# ==============================================================================
+# FORMATI: CONVERSIONE DEI VALORI LETTI DAI FOGLI GOOGLE
+# ==============================================================================
+
+import datetime
+import re
+import unicodedata
+
+_MIGLIAIA_IT = re.compile(r"^-?\d{1,3}(\.\d{3})+(,\d+)?$")
+
+
+def lettera_colonna(n):
+    # 1 -> "A", 27 -> "AA"
+    lettere = ""
+    while n:
+        n, r = divmod(n - 1, 26)
+        lettere = chr(65 + r) + lettere
+    return lettere
+
+
+def normalizza_nome(testo):
+    # "Nicolò  D'Amico" -> "nicolo d'amico": senza accenti, minuscolo, spazi singoli
+    testo = unicodedata.normalize("NFKD", str(testo))
+    testo = "".join(c for c in testo if not unicodedata.combining(c))
+    return " ".join(testo.casefold().split())
+
+
+def a_data(testo):
+    # "18/10/2026" -> date; già date/datetime restano tali; altrimenti None
+    if isinstance(testo, datetime.datetime): return testo.date()
+    if isinstance(testo, datetime.date): return testo
+    try: return datetime.datetime.strptime(str(testo).strip(), "%d/%m/%Y").date()
+    except ValueError: return None
+
+
+def a_numero(testo):
+    # Accetta numeri, "€ 1.234,56", "1234.5", "15,50%"; vuoto o testo -> None
+    if isinstance(testo, bool): return None
+    if isinstance(testo, (int, float)): return float(testo)
+    s = str(testo).replace("€", "").replace("%", "").replace("\xa0", "").replace(" ", "").strip()
+    if not s: return None
+    if "," in s and "." in s:
+        # Il separatore che compare per ultimo è quello dei decimali
+        s = s.replace(".", "").replace(",", ".") if s.rfind(",") > s.rfind(".") else s.replace(",", "")
+    elif "," in s:
+        s = s.replace(",", ".")
+    elif _MIGLIAIA_IT.match(s) and s.count(".") > 1:
+        s = s.replace(".", "")
+    try: return float(s)
+    except ValueError: return None
@@ -0,0 +1,34 @@
+# ==============================================================================
+# INTERFACCIA: COMPONENTI STREAMLIT COMUNI ALLE DUE APP
+# ==============================================================================
+# Unico modulo del pacchetto che importa Streamlit: lo usano solo webapp.py e
+# app_psico.py, la logica resta negli altri moduli.
+
+import datetime
+
+import streamlit as st
+
+
+def badge_non_aggiornati(fonte, letto_il, errore):
+    # Google o un calendario non rispondono: la pagina usa l'ultima copia buona e lo dice
+    quando = f" (copia del {datetime.datetime.fromtimestamp(letto_il).strftime('%d/%m %H:%M')})" if letto_il else ""
+    st.badge(f"Dati non aggiornati: {fonte}{quando}", icon="⚠️", color="orange")
+    st.caption(f"Nuovo tentativo al prossimo aggiornamento della pagina ({errore})")
+
+
+def salvataggi_falliti(coda, cosa="salvataggi", area=st):
+    # Righe della coda rifiutate da Google (permessi, foglio spostato...): non si
+    # riprovano da sole, qui si riprovano o si scartano. area: st o st.sidebar
+    fallite = coda.fallite()
+    if not fallite: return
+    area.error(f"☁️ Google ha rifiutato {len(fallite)} {cosa}")
+    with area.expander(f"Da riprovare o scartare ({cosa})"):
+        for riga in fallite:
+            st.caption(f"{datetime.datetime.fromtimestamp(riga['creata']).strftime('%d/%m %H:%M')} · {riga['errore']}")
+            valori = " | ".join(str(v) for v in riga["valori"][:6])
+            st.code(valori + (" | ..." if len(riga["valori"]) > 6 else ""), language=None)
+        c_riprova, c_scarta = st.columns(2)
+        if c_riprova.button("🔁 Riprova", key="riprova_fallite"):
+            coda.riprova([r["id"] for r in fallite]); st.rerun()
+        if c_scarta.button("🗑️ Scarta", key="scarta_fallite"):
+            coda.scarta([r["id"] for r in fallite]); st.rerun()
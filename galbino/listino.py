@@ -0,0 +1,104 @@
+# ==============================================================================
+# LISTINO COMPLETO: OGNI CHECK-IN x OGNI DURATA IN UN SOLO PASSAGGIO
+# ==============================================================================
+# Usa le somme cumulative di galbino.tariffe su una griglia (check-in, notti):
+# nessun ciclo per notte, tutto il periodo viene calcolato con operazioni NumPy.
+
+import datetime
+import io
+
+import numpy as np
+import pandas as pd
+
+from galbino.tariffe import (AIRBNB_COMMISSION, COSTO_EXTRA_PAX_AIRBNB, MIN_STAY, NOTTI_LUNGA_DURATA,
+                             PULIZIE_AIRBNB, RATES_AIRBNB, SCONTO_LUNGA_DURATA, STAGIONI, tabella_tariffe)
+from galbino.tracciamento import traccia
+
+NOTTI_MAX_LISTINO = 21
+
+COLONNE_LISTINO = ["CheckIn", "CheckOut", "Notti", "Ospiti", "Affitto", "Extra", "Pulizie",
+                   "Prezzo Airbnb", "Netto Galbino", "Prezzo Diretto", "Oltre Max"]
+
+
+def aggiungi_mesi(data, mesi):
+    mese = data.month - 1 + mesi
+    anno, mese = data.year + mese // 12, mese % 12 + 1
+    for giorno in range(data.day, 27, -1):
+        try: return datetime.date(anno, mese, giorno)
+        except ValueError: pass
+    return datetime.date(anno, mese, min(data.day, 28))
+
+
+@traccia("listino.griglia")
+def calcola_listino(data_da, mesi=18, ospiti=10, perc_sconto_diretto=5.0, notti_min=MIN_STAY, notti_max=NOTTI_MAX_LISTINO):
+    data_a = aggiungi_mesi(data_da, mesi)
+    n_checkin = (data_a - data_da).days
+    ultimo_giorno = data_a + datetime.timedelta(days=notti_max)
+    t = tabella_tariffe(data_da.year, ultimo_giorno.year)
+
+    # Griglia: righe = check-in, colonne = notti
+    inizio = t.indice(data_da) + np.arange(n_checkin)[:, None]
+    notti = np.arange(notti_min, notti_max + 1)[None, :]
+    fine = inizio + notti
+
+    affitto = (t.cum_tariffa[fine] - t.cum_tariffa[inizio]).astype(float)
+    extra = np.zeros_like(affitto)
+    oltre_max = np.zeros(affitto.shape, dtype=bool)
+    for s in STAGIONI:
+        notti_stagione = t.cum_notti[s][fine] - t.cum_notti[s][inizio]
+        extra += notti_stagione * max(0, ospiti - RATES_AIRBNB[s]["CapienzaBase"]) * COSTO_EXTRA_PAX_AIRBNB
+        if ospiti > RATES_AIRBNB[s]["Max"]: oltre_max |= notti_stagione > 0
+
+    # Sconto lunga durata solo sull'affitto (come nel preventivo singolo)
+    affitto = np.where(notti >= NOTTI_LUNGA_DURATA, affitto * (1 - SCONTO_LUNGA_DURATA), affitto)
+    prezzo_airbnb = affitto + extra + PULIZIE_AIRBNB
+    netto = prezzo_airbnb * (1 - AIRBNB_COMMISSION)
+    diretto = prezzo_airbnb * (1 - (perc_sconto_diretto / 100))
+
+    checkin = np.datetime64(data_da) + np.arange(n_checkin).astype("timedelta64[D]")
+    forma = affitto.shape
+    return pd.DataFrame({
+        "CheckIn": np.repeat(checkin, forma[1]),
+        "CheckOut": (checkin[:, None] + notti.astype("timedelta64[D]")).ravel(),
+        "Notti": np.broadcast_to(notti, forma).ravel(),
+        "Ospiti": ospiti,
+        "Affitto": affitto.ravel(),
+        "Extra": extra.ravel(),
+        "Pulizie": float(PULIZIE_AIRBNB),
+        "Prezzo Airbnb": prezzo_airbnb.ravel(),
+        "Netto Galbino": netto.ravel(),
+        "Prezzo Diretto": diretto.ravel(),
+        "Oltre Max": oltre_max.ravel(),
+    }, columns=COLONNE_LISTINO)
+
+
+@traccia("listino.csv")
+def listino_csv(df):
+    # Separatore e decimali all'italiana: si apre direttamente in Excel
+    return df.to_csv(index=False, sep=";", decimal=",", date_format="%d/%m/%Y").encode("utf-8-sig")
+
+@traccia("excel.listino")
+def listino_excel(df):
+    output = io.BytesIO()
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    worksheet = workbook.add_worksheet("Listino")
+    bold = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'bg_color': '#D3D3D3'})
+    data_fmt = workbook.add_format({'num_format': 'dd/mm/yyyy', 'align': 'center'})
+    currency = workbook.add_format({'num_format': '#,##0.00 €'})
+    worksheet.set_column('A:B', 12); worksheet.set_column('C:D', 8)
+    worksheet.set_column('E:J', 15); worksheet.set_column('K:K', 10)
+    worksheet.write_row(0, 0, list(df.columns), bold)
+    # Una colonna alla volta: molto più veloce di df.to_excel
+    for c, nome in enumerate(df.columns):
+        serie = df[nome]
+        if nome in ("CheckIn", "CheckOut"):
+            worksheet.write_column(1, c, serie.dt.date.tolist(), data_fmt)
+        elif nome in ("Notti", "Ospiti", "Oltre Max"):
+            worksheet.write_column(1, c, serie.tolist())
+        else:
+            worksheet.write_column(1, c, serie.round(2).tolist(), currency)
+    worksheet.freeze_panes(1, 0)
+    worksheet.autofilter(0, 0, len(df), len(df.columns) - 1)
+    workbook.close()
+    return output.getvalue()
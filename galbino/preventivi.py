@@ -0,0 +1,115 @@
+# ==============================================================================
+# PREVENTIVI: PREZZO AIRBNB, DIRETTO, NETTO E RIGA DEL DATABASE AFFITTI
+# ==============================================================================
+# Le stesse regole della pagina "Preventivi Affitto", senza Streamlit: le usano
+# la webapp e il calcolo in blocco da riga di comando (galbino.preventivi_batch).
+
+import datetime
+import re
+
+from galbino.formati import a_data, a_numero
+from galbino.tariffe import (AIRBNB_COMMISSION, LISTA_SERVIZI, MIN_STAY, NOTTI_LUNGA_DURATA, PULIZIE_AIRBNB,
+                             SCONTO_LUNGA_DURATA, calcola_soggiorno_airbnb)
+
+# Le tre proposte salvabili (stesse etichette della scelta nella pagina)
+PROPOSTE = ("Prezzo Airbnb", "Prezzo Diretto", "Solo Netto")
+
+
+def calcola_prezzi(checkin, notti, ospiti, perc_sconto_diretto=5.0, sconto=0, affitto_manuale=None):
+    # affitto_manuale: il "Costo Notti" letto su Airbnb, già comprensivo degli extra
+    costo_affitto_listino, costo_extra, log_affitto = calcola_soggiorno_airbnb(checkin, notti, ospiti)
+
+    affitto_airbnb = 0
+    if notti >= MIN_STAY:
+        # Sconto Lunga Durata (Su Listino Airbnb)
+        if notti >= NOTTI_LUNGA_DURATA:
+            costo_affitto_listino -= (costo_affitto_listino * SCONTO_LUNGA_DURATA)
+        affitto_airbnb = costo_affitto_listino
+
+    if affitto_manuale is not None:
+        affitto_airbnb, costo_extra = affitto_manuale, 0
+
+    # Totale Lordo Airbnb (Affitto + Extra + Pulizie); Airbnb trattiene la commissione su TUTTO
+    prezzo_airbnb = affitto_airbnb + costo_extra + PULIZIE_AIRBNB
+    return {
+        "affitto": affitto_airbnb,
+        "extra": costo_extra,
+        "log": log_affitto,
+        "prezzo_airbnb": prezzo_airbnb,
+        "netto": prezzo_airbnb * (1 - AIRBNB_COMMISSION),
+        "diretto": (prezzo_airbnb * (1 - (perc_sconto_diretto / 100))) - sconto,
+    }
+
+
+def importi_proposta(prezzi, proposta, perc_sconto_diretto=5.0):
+    # -> (affitto, pulizie, canale) da scrivere su documento e database
+    affitto = prezzi["affitto"] + prezzi["extra"]
+    if proposta == "Prezzo Airbnb":
+        return affitto, PULIZIE_AIRBNB, "Airbnb"
+    if proposta == "Prezzo Diretto":
+        fattore_sconto = (1 - (perc_sconto_diretto / 100))
+        return affitto * fattore_sconto, PULIZIE_AIRBNB * fattore_sconto, f"Diretto (-{perc_sconto_diretto}%)"
+    # Netto Reale (Airbnb meno commissione)
+    return affitto * (1 - AIRBNB_COMMISSION), PULIZIE_AIRBNB * (1 - AIRBNB_COMMISSION), "Netto Interno"
+
+
+def voce_servizio(nome, p_unit, pax, qta):
+    # La voce entra nel preventivo solo se completa (la Prima Spesa basta che abbia un importo)
+    if ("Prima Spesa" in nome and p_unit > 0) or (p_unit > 0 and pax > 0 and qta > 0):
+        return {'p_unit': p_unit, 'pax': pax, 'qta': qta, 'subtotale': p_unit * pax * qta}
+    return None
+
+
+def totali_documento(affitto, pulizie, dettagli_servizi, sconto, notti):
+    # -> (totale finale, costo medio a notte)
+    totale_servizi = sum(v['subtotale'] for v in dettagli_servizi.values())
+    totale = affitto + pulizie + totale_servizi - sconto
+    return totale, (affitto / notti if notti > 0 else 0)
+
+
+def riga_preventivo(autore, canale, cliente, checkin, checkout, notti, ospiti, affitto, costo_medio, pulizie,
+                    dettagli_servizi, sconto, totale, note, oggi=None):
+    # Layout del foglio preventivi: 11 colonne fisse, 4 per servizio, sconto/totale/note
+    oggi = oggi or datetime.date.today()
+    riga = [autore, canale, oggi.strftime("%d/%m/%Y"), cliente, checkin.strftime("%d/%m/%Y"), checkout.strftime("%d/%m/%Y"),
+            notti, ospiti, affitto, costo_medio, pulizie]
+    for n, _ in LISTA_SERVIZI:
+        v = dettagli_servizi.get(n)
+        if v: riga.extend([v['p_unit'], v['pax'], v['qta'], v['subtotale']])
+        else: riga.extend([0, 0, 0, 0])
+    riga.extend([sconto, totale, note])
+    return riga
+
+
+def intestazione_preventivi():
+    # Nomi delle colonne di riga_preventivo (per CSV ed export fuori dal foglio)
+    colonne = ["Autore", "Canale", "Data", "Cliente", "Check-In", "Check-Out", "Notti", "Ospiti", "Affitto", "Costo Medio", "Pulizie"]
+    for n, _ in LISTA_SERVIZI: colonne += [f"{n} €", f"{n} Pax", f"{n} Qta", f"{n} Totale"]
+    return colonne + ["Sconto", "Totale", "Note"]
+
+
+def campi_preventivo(riga):
+    # Riga del DB affitti -> valori per ricaricare il modulo (inverso di riga_preventivo);
+    # servizi: solo quelli presenti nel preventivo, {nome: (p_unit, pax, qta)}
+    n_fisse = 11
+    riga = list(riga) + [""] * (n_fisse + 4 * len(LISTA_SERVIZI) + 3 - len(riga))
+    servizi = {}
+    for i, (nome, _) in enumerate(LISTA_SERVIZI):
+        p_unit, pax, qta, subtotale = (a_numero(v) or 0 for v in riga[n_fisse + 4 * i:n_fisse + 4 * i + 4])
+        if subtotale > 0 or ("Prima Spesa" in nome and p_unit > 0):
+            servizi[nome] = (p_unit, int(pax), int(qta))
+    coda = n_fisse + 4 * len(LISTA_SERVIZI)
+    canale = str(riga[1]).strip()
+    # "Diretto (-7.5%)" -> 7.5; gli altri canali non salvano la percentuale
+    perc = re.search(r"-\s*([\d.,]+)\s*%", canale)
+    if canale.startswith("Airbnb"): proposta = "Prezzo Airbnb"
+    elif canale.startswith("Diretto"): proposta = "Prezzo Diretto"
+    else: proposta = "Solo Netto"
+    return {
+        "autore": str(riga[0]).strip(), "canale": canale, "proposta": proposta,
+        "perc_sconto_diretto": a_numero(perc.group(1)) if perc else None,
+        "data": a_data(riga[2]), "cliente": str(riga[3]).strip(),
+        "checkin": a_data(riga[4]), "checkout": a_data(riga[5]), "ospiti": int(a_numero(riga[7]) or 1),
+        "servizi": servizi, "sconto": a_numero(riga[coda]) or 0.0, "totale": a_numero(riga[coda + 1]) or 0.0,
+        "note": str(riga[coda + 2]),
+    }
@@ -0,0 +1,146 @@
+# ==============================================================================
+# PREVENTIVI IN BLOCCO DA RIGA DI COMANDO (MAILING DI FINE STAGIONE)
+# ==============================================================================
+# Uso (dalla cartella del repo):
+#   python -m galbino.preventivi_batch richieste.csv -o preventivi.csv
+#   python -m galbino.preventivi_batch richieste.csv --sconto-diretto 7 --processi 4
+#
+# Il CSV di ingresso ha le colonne cliente, checkin, checkout, ospiti, servizi
+# (facoltative: sconto, note). Separatore ";" o ",", date gg/mm/aaaa o aaaa-mm-gg.
+# I servizi sono separati da virgola, ognuno "nome pax x quantità" con prezzo
+# unitario facoltativo dopo "@" (altrimenti quello di listino):
+#   Dinner 10x2, Transfer 1x2, Wine Tasting 10x1@45, Prima Spesa @180
+# Per ogni richiesta escono tre righe (Airbnb, Diretto, Netto Interno) con lo
+# stesso layout che la pagina Preventivi scrive sul foglio. Le richieste vengono
+# distribuite su più processi; le righe non valide finiscono su stderr.
+
+import argparse
+import concurrent.futures
+import csv
+import datetime
+import functools
+import os
+import re
+import sys
+import time
+
+from galbino.formati import a_data, a_numero, normalizza_nome
+from galbino.preventivi import (PROPOSTE, calcola_prezzi, importi_proposta, intestazione_preventivi, riga_preventivo,
+                                totali_documento, voce_servizio)
+from galbino.tariffe import LISTA_SERVIZI, MIN_STAY
+
+RICHIESTE_MIN_PROCESSI = 200 # Sotto questa soglia avviare i processi costa più del calcolo
+
+_SERVIZIO = re.compile(r"^(?P<nome>.*?[^\d\s@])\s*(?:(?P<pax>\d+)\s*(?:[x×]\s*(?P<qta>\d+))?)?\s*(?:@\s*(?P<prezzo>[\d.,]+))?$", re.IGNORECASE)
+_PREZZI_LISTINO = {normalizza_nome(n): (n, p) for n, p in LISTA_SERVIZI}
+
+
+def _data(testo):
+    data = a_data(testo)
+    if data is None:
+        try: data = datetime.date.fromisoformat(str(testo).strip())
+        except ValueError: raise ValueError(f"data non valida: {testo!r}")
+    return data
+
+
+def leggi_servizi(testo):
+    dettagli = {}
+    for voce in filter(None, (v.strip() for v in str(testo or "").split(","))):
+        m = _SERVIZIO.match(voce)
+        if not m or normalizza_nome(m["nome"]) not in _PREZZI_LISTINO:
+            raise ValueError(f"servizio non riconosciuto: {voce!r}")
+        nome, prezzo_listino = _PREZZI_LISTINO[normalizza_nome(m["nome"])]
+        p_unit = a_numero(m["prezzo"]) if m["prezzo"] else prezzo_listino
+        v = voce_servizio(nome, p_unit, int(m["pax"] or 1), int(m["qta"] or 1))
+        if v: dettagli[nome] = v
+    return dettagli
+
+
+def prezza_richiesta(richiesta, perc_sconto_diretto=5.0, autore="Batch", oggi=None):
+    # -> (righe, errore); gira nei processi figli, quindi solo argomenti serializzabili
+    try:
+        cliente = (richiesta.get("cliente") or "").strip()
+        checkin, checkout = _data(richiesta.get("checkin")), _data(richiesta.get("checkout"))
+        notti = (checkout - checkin).days
+        if notti < MIN_STAY: raise ValueError(f"{notti} notti (minimo {MIN_STAY})")
+        ospiti = int(a_numero(richiesta.get("ospiti")) or 0)
+        if ospiti < 1: raise ValueError(f"ospiti non validi: {richiesta.get('ospiti')!r}")
+        servizi = leggi_servizi(richiesta.get("servizi"))
+        sconto = a_numero(richiesta.get("sconto")) or 0
+        note = (richiesta.get("note") or "").strip()
+    except (TypeError, ValueError) as e:
+        return [], str(e)
+
+    prezzi = calcola_prezzi(checkin, notti, ospiti, perc_sconto_diretto, sconto)
+    righe = []
+    for proposta in PROPOSTE:
+        affitto, pulizie, canale = importi_proposta(prezzi, proposta, perc_sconto_diretto)
+        totale, costo_medio = totali_documento(affitto, pulizie, servizi, sconto, notti)
+        righe.append(riga_preventivo(autore, canale, cliente, checkin, checkout, notti, ospiti, affitto, costo_medio,
+                                     pulizie, servizi, sconto, totale, note, oggi))
+    return righe, None
+
+
+def leggi_richieste(percorso):
+    with open(percorso, newline="", encoding="utf-8-sig") as f:
+        testo = f.read()
+    separatore = ";" if testo.split("\n", 1)[0].count(";") >= testo.split("\n", 1)[0].count(",") else ","
+    lettore = csv.DictReader(testo.splitlines(), delimiter=separatore)
+    # Intestazioni tolleranti: "Check-In", "CHECKIN", "check in" -> "checkin"
+    lettore.fieldnames = [normalizza_nome(c).replace("-", "").replace(" ", "") for c in lettore.fieldnames or []]
+    return list(lettore)
+
+
+def prezza_tutte(richieste, perc_sconto_diretto=5.0, autore="Batch", processi=None):
+    # Risultati nello stesso ordine delle richieste
+    calcolo = functools.partial(prezza_richiesta, perc_sconto_diretto=perc_sconto_diretto, autore=autore,
+                                oggi=datetime.date.today())
+    processi = processi or os.cpu_count() or 1
+    if processi == 1 or len(richieste) < RICHIESTE_MIN_PROCESSI:
+        return [calcolo(r) for r in richieste]
+    # Blocchi grandi: ogni processo compila le tabelle tariffe una volta sola
+    blocco = max(1, len(richieste) // (processi * 4))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processi) as pool:
+        return list(pool.map(calcolo, richieste, chunksize=blocco))
+
+
+def _cella(valore):
+    # Decimali all'italiana come listino_csv
+    if isinstance(valore, float): return f"{valore:.2f}".replace(".", ",")
+    return valore
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Preventivi Airbnb/Diretto/Netto in blocco da un CSV di richieste")
+    parser.add_argument("richieste", help="CSV con cliente, checkin, checkout, ospiti, servizi")
+    parser.add_argument("-o", "--output", help="CSV dei preventivi (default: stdout)")
+    parser.add_argument("--sconto-diretto", type=float, default=5.0, help="%% sconto diretto rispetto ad Airbnb")
+    parser.add_argument("--autore", default="Batch")
+    parser.add_argument("--processi", type=int, default=None, help="default: numero di CPU")
+    parser.add_argument("--senza-intestazione", action="store_true", help="solo righe, da incollare nel foglio")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    richieste = leggi_richieste(args.richieste)
+    risultati = prezza_tutte(richieste, args.sconto_diretto, args.autore, args.processi)
+
+    uscita = open(args.output, "w", newline="", encoding="utf-8-sig") if args.output else sys.stdout
+    try:
+        scrittore = csv.writer(uscita, delimiter=";")
+        if not args.senza_intestazione: scrittore.writerow(intestazione_preventivi())
+        scartate = 0
+        for n, (righe, errore) in enumerate(risultati, start=2): # riga 1 = intestazione
+            if errore:
+                scartate += 1
+                print(f"Riga {n}: {errore}", file=sys.stderr)
+            scrittore.writerows([_cella(v) for v in riga] for riga in righe)
+    finally:
+        if uscita is not sys.stdout: uscita.close()
+
+    print(f"{len(richieste)} richieste, {len(richieste) - scartate} prezzate, {scartate} scartate "
+          f"in {time.perf_counter() - t0:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+# ==============================================================================
+# QUOTA SHEETS: SECCHI DI GETTONI, PRIORITÀ E LETTURE CONDIVISE PER PROCESSO
+# ==============================================================================
+# Google conta letture e scritture al minuto per service account: tutte le
+# sessioni del processo passano da un solo RegolatoreQuota per account, che
+# dà un gettone per richiesta invece di lasciare arrivare i 429.
+# - Scritture e letture hanno secchi separati (come le quote di Google): un
+#   salvataggio non aspetta mai dietro alle letture.
+# - Tra le letture passano prima quelle delle pagine; quelle in background
+#   (replica dell'archivio, riscaldamento) lasciano sempre RISERVA_PAGINE
+#   gettoni liberi.
+# - Letture identiche in contemporanea diventano una sola richiesta: chi arriva
+#   mentre una è in corso aspetta la successiva e la condivide, così riceve
+#   comunque dati letti dopo la sua chiamata.
+# - Un 429 svuota il secchio: tutti rallentano insieme invece di riprovare.
+
+import collections
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+from galbino.tracciamento import TRACCIATORE
+
+HOST_SHEETS = "sheets.googleapis.com"
+LETTURE_AL_MINUTO = 60   # quota Google per utente (service account) e progetto
+SCRITTURE_AL_MINUTO = 60
+RAFFICA = 20             # gettoni massimi accumulati: richieste subito disponibili dopo una pausa
+RISERVA_PAGINE = 5       # gettoni di lettura che le letture in background non usano
+
+_contesto = threading.local()
+
+
+class QuotaEsaurita(ConnectionError):
+    pass
+
+
+@contextlib.contextmanager
+def in_sfondo():
+    # Le letture fatte dentro il blocco (in questo thread) hanno priorità bassa
+    precedente = getattr(_contesto, "sfondo", False)
+    _contesto.sfondo = True
+    try:
+        yield
+    finally:
+        _contesto.sfondo = precedente
+
+
+def e_sfondo():
+    return getattr(_contesto, "sfondo", False)
+
+
+class Secchio:
+
+    def __init__(self, al_minuto, capacita=RAFFICA):
+        self.ritmo = al_minuto / 60.0 # gettoni al secondo
+        self.capacita = capacita
+        self.gettoni = float(capacita)
+        self._ricaricato = time.monotonic()
+
+    def ricarica(self):
+        adesso = time.monotonic()
+        self.gettoni = min(self.capacita, self.gettoni + (adesso - self._ricaricato) * self.ritmo)
+        self._ricaricato = adesso
+
+    def attesa(self, minimo):
+        # Secondi prima di avere `minimo` gettoni
+        return max(0.0, (minimo - self.gettoni) / self.ritmo)
+
+
+class _Volo:
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.esito = None
+        self.errore = None
+
+
+class RegolatoreQuota:
+
+    def __init__(self, letture_al_minuto=LETTURE_AL_MINUTO, scritture_al_minuto=SCRITTURE_AL_MINUTO,
+                 raffica=RAFFICA, riserva_pagine=RISERVA_PAGINE, host=HOST_SHEETS):
+        self.host = host
+        self.riserva_pagine = riserva_pagine
+        self._secchi = {"lettura": Secchio(letture_al_minuto, raffica), "scrittura": Secchio(scritture_al_minuto, raffica)}
+        self._code = {"lettura": [], "scrittura": []} # heap di (priorità, numero)
+        self._numeri = itertools.count()
+        self._cond = threading.Condition()
+        self._lock_voli = threading.Lock()
+        self._in_volo = {}
+        self._prossimi = {}
+        self._stat = collections.Counter()
+
+    # --- Gettoni ---
+
+    def attendi(self, tipo, sfondo=False, fine=None):
+        # Blocca finché la richiesta può partire; QuotaEsaurita se si arriva a `fine` (monotonic)
+        secchio, coda = self._secchi[tipo], self._code[tipo]
+        priorita = 1 if sfondo and tipo == "lettura" else 0
+        minimo = 1 + (self.riserva_pagine if priorita else 0)
+        biglietto = (priorita, next(self._numeri))
+        t0 = time.monotonic()
+        with self._cond:
+            heapq.heappush(coda, biglietto)
+            try:
+                while True:
+                    secchio.ricarica()
+                    if coda[0] == biglietto and secchio.gettoni >= minimo:
+                        secchio.gettoni -= 1
+                        break
+                    # In testa alla coda si aspetta il gettone, altrimenti il proprio turno
+                    attesa = secchio.attesa(minimo) if coda[0] == biglietto else 1.0
+                    if fine is not None:
+                        restante = fine - time.monotonic()
+                        if restante <= 0:
+                            self._stat["scadute"] += 1
+                            raise QuotaEsaurita(f"quota Google Sheets ({tipo}): nessun gettone entro la scadenza")
+                        attesa = min(attesa, restante)
+                    self._cond.wait(attesa)
+            finally:
+                coda.remove(biglietto)
+                heapq.heapify(coda)
+                self._cond.notify_all()
+        secondi = time.monotonic() - t0
+        if secondi > 0.001:
+            with self._cond:
+                self._stat["attese"] += 1
+                self._stat[f"attese_{tipo}{'_sfondo' if priorita else ''}"] += 1
+                self._stat["secondi_attesa"] += secondi
+            TRACCIATORE.registra(f"quota.attesa.{tipo}{'_sfondo' if priorita else ''}", secondi)
+        return secondi
+
+    def rallenta(self, tipo):
+        # Google ha risposto 429: secchio vuoto, le prossime richieste ripartono al ritmo della quota
+        with self._cond:
+            self._secchi[tipo].gettoni = 0.0
+            self._stat["risposte_429"] += 1
+        TRACCIATORE.registra(f"quota.429.{tipo}", 0.0, "429")
+
+    # --- Letture condivise ---
+
+    def condividi(self, chiave, funzione):
+        # Una sola funzione() per chiave alla volta; chi arriva durante un volo si
+        # unisce al successivo (uno solo, per quanti siano ad aspettarlo)
+        with self._lock_voli:
+            precedente = self._in_volo.get(chiave)
+            volo = self._prossimi.get(chiave) if precedente is not None else None
+            if volo is not None:
+                self._stat["unite"] += 1
+                capo = False
+            else:
+                volo, capo = _Volo(), True
+                if precedente is None: self._in_volo[chiave] = volo
+                else: self._prossimi[chiave] = volo
+        if not capo:
+            volo.evento.wait()
+            if volo.errore is not None: raise volo.errore
+            return volo.esito
+        # Il volo successivo parte solo quando il precedente lo promuove a "in corso"
+        if precedente is not None: precedente.evento.wait()
+        try:
+            volo.esito = funzione()
+            return volo.esito
+        except Exception as e:
+            volo.errore = e
+            raise
+        finally:
+            with self._lock_voli:
+                prossimo = self._prossimi.pop(chiave, None)
+                if prossimo is not None: self._in_volo[chiave] = prossimo
+                else: del self._in_volo[chiave]
+            volo.evento.set()
+
+    # --- Stato per il pannello admin ---
+
+    def stato(self):
+        with self._cond:
+            for secchio in self._secchi.values(): secchio.ricarica()
+            in_coda = {
+                "scritture": len(self._code["scrittura"]),
+                "letture": sum(1 for p, _ in self._code["lettura"] if p == 0),
+                "letture_sfondo": sum(1 for p, _ in self._code["lettura"] if p == 1),
+            }
+            gettoni = {tipo: s.gettoni for tipo, s in self._secchi.items()}
+            stat = dict(self._stat)
+        return {"in_coda": in_coda, "gettoni": gettoni, "attese": stat.get("attese", 0),
+                "secondi_attesa": stat.get("secondi_attesa", 0.0), "scadute": stat.get("scadute", 0),
+                "risposte_429": stat.get("risposte_429", 0), "unite": stat.get("unite", 0),
+                "attese_per_tipo": {k[len("attese_"):]: v for k, v in stat.items() if k.startswith("attese_")}}
+
+
+# Un regolatore per service account, condiviso da tutte le connessioni del processo
+_REGOLATORI = {}
+_lock_regolatori = threading.Lock()
+
+
+def regolatore_account(account):
+    with _lock_regolatori:
+        if account not in _REGOLATORI: _REGOLATORI[account] = RegolatoreQuota()
+        return _REGOLATORI[account]
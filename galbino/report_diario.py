@@ -0,0 +1,143 @@
+# ==============================================================================
+# REPORT DIARIO: INCASSI PER PERIODO/PAZIENTE/MODALITÀ E SEDUTE DA INCASSARE
+# ==============================================================================
+# Le righe del Diario diventano colonne (date, importi, stato) una sola volta:
+# a ogni rerun si convertono solo le righe nuove e si accodano alla tabella.
+# Gli aggregati si calcolano con un solo groupby per tipo di periodo, poi si
+# aggiornano sommando quelli delle sole righe nuove.
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+STATO_DA_INCASSARE = "DA FARE"
+STATI_PAGAMENTO = [STATO_DA_INCASSARE, "PAGATO", "FATTURATO"]
+
+PERIODI = {"Mese": "M", "Trimestre": "Q", "Anno": "Y"}
+
+# Fasce di anzianità delle sedute da incassare (giorni dalla seduta)
+FASCE_ANZIANITA = [(30, "0-30 gg"), (60, "31-60 gg"), (90, "61-90 gg"), (None, "oltre 90 gg")]
+
+COLONNE_SEDUTE = ["Riga", "Data", "Paziente", "Modalità", "Importo", "Stato"]
+
+
+def tabella_sedute(righe, prima_riga=None):
+    # righe del Diario (senza intestazione) -> DataFrame tipizzato; prima_riga è il
+    # numero di riga nel foglio della prima riga (None = sedute non ancora sul foglio)
+    righe = [list(r[:6]) + [""] * (6 - len(r[:6])) for r in righe]
+    grezzo = pd.DataFrame(righe, columns=["data", "nome", "tipo", "prezzo", "note", "stato"], dtype=str)
+    if prima_riga is None: riga = pd.array([pd.NA] * len(grezzo), dtype="Int64")
+    else: riga = pd.array(np.arange(prima_riga, prima_riga + len(grezzo)), dtype="Int64")
+    importo = grezzo["prezzo"].str.replace("€", "", regex=False).str.replace(",", ".", regex=False).str.strip()
+    sedute = pd.DataFrame({
+        "Riga": riga,
+        "Data": pd.to_datetime(grezzo["data"].str.strip(), format="%d/%m/%Y", errors="coerce"),
+        "Paziente": grezzo["nome"].str.strip(),
+        "Modalità": grezzo["tipo"].str.strip(),
+        "Importo": pd.to_numeric(importo, errors="coerce").fillna(0.0),
+        "Stato": grezzo["stato"].str.strip().str.upper(),
+    }, columns=COLONNE_SEDUTE)
+    # Stesse righe valide dell'analisi pazienti: data leggibile e nome presente
+    return sedute[sedute["Data"].notna() & (sedute["Paziente"] != "")].reset_index(drop=True)
+
+
+def _aggrega(sedute, periodo):
+    # (periodo, paziente, modalità) -> sedute, importo, da incassare
+    da_incassare = sedute["Stato"] == STATO_DA_INCASSARE
+    return sedute.assign(
+        Periodo=sedute["Data"].dt.to_period(PERIODI[periodo]).astype(str),
+        Sedute=1,
+        **{"Da incassare": sedute["Importo"].where(da_incassare, 0.0)},
+    ).groupby(["Periodo", "Paziente", "Modalità"], sort=True)[["Sedute", "Importo", "Da incassare"]].sum()
+
+
+def _con_modalita(agg, livello):
+    # Righe = livello (Periodo o Paziente); colonne = sedute, € per modalità, totale, da incassare
+    if agg.empty: return pd.DataFrame(columns=["Sedute", "Totale €", "Da incassare €"])
+    per_modalita = agg["Importo"].groupby(level=[livello, "Modalità"]).sum().unstack(fill_value=0.0)
+    per_modalita.columns = [f"{m} €" for m in per_modalita.columns]
+    totali = agg.groupby(level=livello)[["Sedute", "Importo", "Da incassare"]].sum()
+    totali.columns = ["Sedute", "Totale €", "Da incassare €"]
+    totali["Sedute"] = totali["Sedute"].astype(int)
+    return totali[["Sedute"]].join(per_modalita).join(totali[["Totale €", "Da incassare €"]])
+
+
+class ReportDiario:
+    # Una istanza per processo; si riparte da zero quando cambia la generazione del Diario.
+    # Gli aggregati già calcolati si aggiornano sommando quelli delle sole righe nuove;
+    # le sedute ancora in coda si sommano al volo senza toccare la cache.
+
+    def __init__(self):
+        self.generazione = None
+        self.righe_lette = 1 # riga 1 = intestazione
+        self.versione = 0
+        self._sedute = tabella_sedute([])
+        self._aggregati = {}
+        self._viste = {}
+        self._lock = threading.Lock()
+
+    def aggiorna(self, generazione, leggi):
+        # leggi(n): righe del Diario successive alla riga n del foglio
+        with self._lock:
+            if generazione != self.generazione:
+                self.generazione, self.righe_lette = generazione, 1
+                self._sedute, self._aggregati, self._viste = tabella_sedute([]), {}, {}
+                self.versione += 1
+            nuove = leggi(self.righe_lette)
+            if not nuove: return
+            blocco = tabella_sedute(nuove, self.righe_lette + 1)
+            self._sedute = pd.concat([self._sedute, blocco], ignore_index=True) if len(self._sedute) else blocco
+            self.righe_lette += len(nuove)
+            for periodo, agg in self._aggregati.items():
+                self._aggregati[periodo] = agg.add(_aggrega(blocco, periodo), fill_value=0)
+            self._viste = {}
+            self.versione += 1
+
+    def sedute(self, in_attesa=()):
+        # Tutte le sedute, comprese quelle registrate e non ancora sul foglio
+        with self._lock:
+            sedute = self._sedute
+        if not in_attesa: return sedute
+        return pd.concat([sedute, tabella_sedute(in_attesa)], ignore_index=True)
+
+    def aggregati(self, periodo, in_attesa=()):
+        with self._lock:
+            agg = self._aggregati.get(periodo)
+            if agg is None: agg = self._aggregati[periodo] = _aggrega(self._sedute, periodo)
+        if in_attesa: agg = agg.add(_aggrega(tabella_sedute(in_attesa), periodo), fill_value=0)
+        return agg
+
+    def _vista(self, chiave, in_attesa, calcola):
+        chiave = (chiave, self.versione, tuple(tuple(r) for r in in_attesa))
+        with self._lock:
+            if chiave in self._viste: return self._viste[chiave]
+        valore = calcola()
+        with self._lock:
+            self._viste[chiave] = valore
+        return valore
+
+    def per_periodo(self, periodo, in_attesa=()):
+        # Una riga per periodo (dal più recente): sedute, incasso per modalità, totale, da incassare
+        return self._vista(("periodi", periodo), in_attesa,
+                           lambda: _con_modalita(self.aggregati(periodo, in_attesa), "Periodo").sort_index(ascending=False))
+
+    def per_paziente(self, periodo, valore_periodo, in_attesa=()):
+        # Pazienti del periodo scelto, dal più alto incasso
+        def calcola():
+            agg = self.aggregati(periodo, in_attesa)
+            if agg.empty or valore_periodo not in agg.index.get_level_values("Periodo"): return _con_modalita(agg.iloc[:0], "Paziente")
+            del_periodo = agg.xs(valore_periodo, level="Periodo", drop_level=False)
+            return _con_modalita(del_periodo, "Paziente").sort_values("Totale €", ascending=False)
+        return self._vista(("pazienti", periodo, valore_periodo), in_attesa, calcola)
+
+    def da_incassare(self, oggi, in_attesa=()):
+        # Sedute "DA FARE" dalla più vecchia, con giorni trascorsi e fascia di anzianità
+        def calcola():
+            sedute = self.sedute(in_attesa)
+            aperte = sedute[sedute["Stato"] == STATO_DA_INCASSARE]
+            giorni = (pd.Timestamp(oggi) - aperte["Data"]).dt.days
+            limiti = [-np.inf] + [g for g, _ in FASCE_ANZIANITA[:-1]] + [np.inf]
+            fascia = pd.cut(giorni, limiti, labels=[f for _, f in FASCE_ANZIANITA])
+            return aperte.assign(Giorni=giorni, Fascia=fascia).sort_values(["Data", "Riga"]).reset_index(drop=True)
+        return self._vista(("da_incassare", oggi), in_attesa, calcola)
@@ -0,0 +1,210 @@
+# ==============================================================================
+# RESILIENZA: SCADENZE, TENTATIVI CON JITTER E INTERRUTTORE PER ENDPOINT
+# ==============================================================================
+# Ogni richiesta HTTP verso Google o i calendari passa da AdapterProtetto, che
+# avvolge l'adapter della sessione requests: timeout di default anche quando
+# la libreria non lo passa, una scadenza complessiva che include i tentativi
+# (così una pagina non aspetta mai più di SCADENZA_CHIAMATA secondi per
+# richiesta) e un interruttore per host: dopo SOGLIA_GUASTI errori di fila le
+# richieste falliscono subito per PAUSA_CIRCUITO secondi, poi ne passa una di
+# prova. Chi legge ripiega sull'ultima copia buona e lo segnala nella pagina.
+# Con un regolatore (galbino/quota.py) ogni tentativo verso il suo host prende
+# prima un gettone di quota e le GET identiche in contemporanea si uniscono.
+# Nessun import di requests qui: l'adapter interno arriva già costruito.
+
+import copy
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+from galbino.quota import e_sfondo
+from galbino.tracciamento import TRACCIATORE
+
+TIMEOUT_CONNESSIONE = 3.05 # secondi per aprire la connessione
+TIMEOUT_RISPOSTA = 8       # secondi massimi di silenzio del server durante la risposta
+SCADENZA_CHIAMATA = 12     # secondi massimi per richiesta, tentativi compresi
+TENTATIVI = 3              # solo richieste idempotenti (GET/HEAD)
+ATTESA_BASE = 0.5          # secondi, primo tetto dell'attesa tra due tentativi
+SOGLIA_GUASTI = 3          # errori consecutivi che aprono il circuito
+PAUSA_CIRCUITO = 30        # secondi a circuito aperto prima della richiesta di prova
+
+
+class CircuitoAperto(ConnectionError):
+    pass
+
+
+def codice_http(e):
+    # Stato HTTP di un errore (APIError di gspread, HTTPError di requests), se c'è
+    risposta = getattr(e, "response", None)
+    return getattr(risposta, "status_code", None) or getattr(e, "code", None)
+
+
+def errore_transitorio(e):
+    # Rete, timeout (le eccezioni di requests derivano da OSError), quota o errori del server
+    if isinstance(e, CircuitoAperto): return True
+    if isinstance(e, OSError): return True
+    codice = codice_http(e)
+    return codice == 429 or (isinstance(codice, int) and codice >= 500)
+
+
+def handle_non_validi(e):
+    # Autorizzazione o handle di foglio non più validi: solo allora si rifà la connessione.
+    # Quota e rete no: riautorizzarsi aggiungerebbe traffico proprio quando la quota è scarsa.
+    if type(e).__name__ in ("SpreadsheetNotFound", "WorksheetNotFound"): return True
+    return codice_http(e) in (401, 403, 404)
+
+
+def attesa_jitter(tentativo, base=ATTESA_BASE, massimo=PAUSA_CIRCUITO):
+    # "Full jitter": tra 0 e il tetto esponenziale, così i client non riprovano all'unisono
+    return random.uniform(0, min(massimo, base * 2 ** tentativo))
+
+
+class Interruttore:
+    # chiuso -> aperto (dopo `soglia` guasti di fila) -> semiaperto (dopo `pausa`
+    # secondi passa una sola richiesta di prova) -> chiuso o di nuovo aperto
+
+    def __init__(self, nome, soglia=SOGLIA_GUASTI, pausa=PAUSA_CIRCUITO):
+        self.nome = nome
+        self.soglia = soglia
+        self.pausa = pausa
+        self.stato = "chiuso"
+        self.guasti = 0
+        self.aperture = 0
+        self.rifiutate = 0
+        self.ultimo_errore = None
+        self._aperto_il = 0.0
+        self._lock = threading.Lock()
+
+    def permesso(self):
+        with self._lock:
+            if self.stato == "chiuso": return True
+            if self.stato == "aperto" and time.monotonic() - self._aperto_il >= self.pausa:
+                self.stato = "semiaperto" # questa è la richiesta di prova
+                return True
+            self.rifiutate += 1
+            return False
+
+    def successo(self):
+        with self._lock:
+            self.stato, self.guasti = "chiuso", 0
+
+    def guasto(self, errore):
+        with self._lock:
+            self.guasti += 1
+            self.ultimo_errore = f"{errore}"
+            if self.stato == "semiaperto" or self.guasti >= self.soglia:
+                if self.stato != "aperto": self.aperture += 1
+                self.stato, self._aperto_il = "aperto", time.monotonic()
+
+    def riapre_tra(self):
+        with self._lock:
+            if self.stato != "aperto": return 0.0
+            return max(0.0, self.pausa - (time.monotonic() - self._aperto_il))
+
+
+class Circuiti:
+    # Un interruttore per endpoint (host), condiviso da tutte le sessioni del processo
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._interruttori = {}
+
+    def per(self, nome):
+        with self._lock:
+            if nome not in self._interruttori: self._interruttori[nome] = Interruttore(nome)
+            return self._interruttori[nome]
+
+    def stato(self):
+        with self._lock:
+            interruttori = list(self._interruttori.values())
+        return [{"endpoint": i.nome, "stato": i.stato, "guasti": i.guasti, "aperture": i.aperture,
+                 "rifiutate": i.rifiutate, "riapre_tra": i.riapre_tra(), "ultimo_errore": i.ultimo_errore}
+                for i in sorted(interruttori, key=lambda i: i.nome)]
+
+
+class AdapterProtetto:
+    # Stessa interfaccia degli adapter di requests (send/close): si monta con
+    # sessione.mount("https://", AdapterProtetto(sessione.get_adapter("https://"))).
+
+    def __init__(self, interno, circuiti=None, timeout=(TIMEOUT_CONNESSIONE, TIMEOUT_RISPOSTA),
+                 scadenza=SCADENZA_CHIAMATA, tentativi=TENTATIVI, regolatore=None):
+        self.interno = interno
+        self.circuiti = circuiti or CIRCUITI
+        self.timeout = timeout
+        self.scadenza = scadenza
+        self.tentativi = tentativi
+        self.regolatore = regolatore
+
+    def _timeout(self, richiesto, restante):
+        # Il timeout della libreria (se c'è) vale solo se più stretto del nostro
+        connessione, risposta = self.timeout
+        if isinstance(richiesto, (int, float)): connessione, risposta = min(connessione, richiesto), min(risposta, richiesto)
+        return (min(connessione, restante), min(risposta, restante))
+
+    def send(self, request, timeout=None, **kwargs):
+        host = urlsplit(request.url).hostname or "?"
+        lettura = request.method in ("GET", "HEAD")
+        regolatore = self.regolatore if self.regolatore is not None and host == self.regolatore.host else None
+        if regolatore is None:
+            return self._invia(request, host, lettura, None, timeout, **kwargs)
+        if not lettura or kwargs.get("stream"):
+            return self._invia(request, host, lettura, regolatore, timeout, **kwargs)
+        # GET identiche in contemporanea: una sola richiesta, una copia della risposta a testa
+        def invia():
+            risposta = self._invia(request, host, lettura, regolatore, timeout, **kwargs)
+            risposta.content # corpo letto una volta, condiviso dalle copie
+            return risposta
+        return copy.copy(regolatore.condividi((request.method, request.url), invia))
+
+    def _invia(self, request, host, lettura, regolatore, timeout, **kwargs):
+        interruttore = self.circuiti.per(host)
+        tentativi = self.tentativi if lettura else 1
+        tipo = "lettura" if lettura else "scrittura"
+        fine = time.monotonic() + self.scadenza
+        for tentativo in range(tentativi):
+            if not interruttore.permesso():
+                TRACCIATORE.registra(f"resilienza.rifiutata.{host}", 0.0, "CircuitoAperto")
+                raise CircuitoAperto(f"{host} non risponde, nuovo tentativo tra {interruttore.riapre_tra():.0f} s ({interruttore.ultimo_errore})")
+            # L'attesa del gettone rientra nella scadenza; QuotaEsaurita non è un guasto dell'endpoint
+            if regolatore is not None: regolatore.attendi(tipo, e_sfondo(), fine)
+            t0 = time.perf_counter()
+            try:
+                risposta = self.interno.send(request, timeout=self._timeout(timeout, fine - time.monotonic()), **kwargs)
+            except OSError as e:
+                interruttore.guasto(e)
+                TRACCIATORE.registra(f"resilienza.guasto.{host}", time.perf_counter() - t0, type(e).__name__)
+                errore, risposta = e, None
+            else:
+                if risposta.status_code < 500:
+                    # 429 = quota: il server risponde, l'endpoint è sano
+                    interruttore.successo()
+                    if risposta.status_code != 429: return risposta
+                    if regolatore is not None: regolatore.rallenta(tipo)
+                else:
+                    interruttore.guasto(f"HTTP {risposta.status_code}")
+                    TRACCIATORE.registra(f"resilienza.guasto.{host}", time.perf_counter() - t0, f"HTTP{risposta.status_code}")
+                errore = None
+            attesa = attesa_jitter(tentativo)
+            if tentativo == tentativi - 1 or time.monotonic() + attesa >= fine:
+                break
+            if risposta is not None: risposta.close()
+            time.sleep(attesa)
+        # Ultimo tentativo: l'errore o la risposta vanno a chi ha chiamato (gspread alza APIError)
+        if errore is not None: raise errore
+        return risposta
+
+    def close(self):
+        self.interno.close()
+
+
+def proteggi_sessione(sessione, circuiti=None, prefisso="https://", **opzioni):
+    # Avvolge l'adapter già montato sul prefisso (con i suoi pool di connessioni)
+    if sessione is None: return
+    interno = sessione.get_adapter(prefisso)
+    if isinstance(interno, AdapterProtetto): return
+    sessione.mount(prefisso, AdapterProtetto(interno, circuiti, **opzioni))
+
+
+# Istanza di processo, letta anche dal pannello admin
+CIRCUITI = Circuiti()
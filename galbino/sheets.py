@@ -0,0 +1,144 @@
+# ==============================================================================
+# SHEETS: CONNESSIONE GOOGLE CONDIVISA (CLIENT, FILE E FOGLI RIUSATI)
+# ==============================================================================
+# Un solo client autorizzato per service account e processo. La sessione HTTP
+# di gspread (AuthorizedSession) tiene vive le connessioni e rinnova il token
+# da sola; qui si cachano anche gli handle di file e fogli, così un salvataggio
+# costa una sola chiamata invece di autorizzazione + open_by_url + append.
+# gspread e oauth2client si importano alla prima autorizzazione (centinaia di ms
+# risparmiati alle pagine che non toccano Google). Tutte le richieste, compreso
+# il rinnovo del token, passano da AdapterProtetto (vedi galbino/resilienza.py);
+# quelle verso l'API Sheets prendono anche un gettone dal regolatore di quota
+# del service account, condiviso da tutte le connessioni del processo.
+
+import threading
+import time
+
+from galbino.quota import regolatore_account
+from galbino.resilienza import handle_non_validi, proteggi_sessione
+from galbino.tracciamento import span
+
+SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+
+
+def _http(client):
+    # gspread 6 espone http_client, gspread 5 ha sessione e auth sul client
+    return getattr(client, "http_client", client)
+
+
+class ConnessioneSheets:
+
+    def __init__(self, creds_dict, scope=SCOPE, connessioni=16):
+        self._creds_dict = dict(creds_dict)
+        self._scope = scope
+        self._connessioni = connessioni
+        self._lock = threading.RLock()
+        self.regolatore = regolatore_account(self._creds_dict.get("client_email"))
+        self._client = None
+        self._spreadsheet = {}
+        self._fogli = {}
+        # Ultima durata misurata di ogni passo: è il tempo risparmiato ad ogni riuso
+        self._costi = {"client": 0.0, "spreadsheet": 0.0, "foglio": 0.0}
+        self._stat = {"chiamate": 0, "aperture": 0, "riusi": 0, "secondi_risparmiati": 0.0}
+
+    # --- Passi interni (da chiamare col lock preso) ---
+
+    def _get_client(self):
+        if self._client is not None:
+            self._rinnova_token()
+            return self._client, True
+        t0 = time.perf_counter()
+        import gspread
+        from oauth2client.service_account import ServiceAccountCredentials
+        from requests.adapters import HTTPAdapter
+        with span("sheets.autorizza"):
+            creds = ServiceAccountCredentials.from_json_keyfile_dict(self._creds_dict, self._scope)
+            client = gspread.authorize(creds)
+        sessione = getattr(_http(client), "session", None)
+        if sessione is not None:
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self._connessioni)
+            sessione.mount("https://", adapter)
+            proteggi_sessione(sessione, regolatore=self.regolatore)
+            # Il rinnovo del token usa una sessione sua (google-auth)
+            proteggi_sessione(getattr(getattr(sessione, "_auth_request", None), "session", None))
+        self._client = client
+        self._costi["client"] = time.perf_counter() - t0
+        self._stat["aperture"] += 1
+        return client, False
+
+    def _rinnova_token(self):
+        # Rinnovo anticipato se il token è scaduto (es. processo rimasto inattivo)
+        http = _http(self._client)
+        auth = getattr(http, "auth", None)
+        if auth is not None and getattr(auth, "valid", True) is False:
+            http.login()
+
+    def _get_spreadsheet(self, url):
+        client, _ = self._get_client()
+        sh = self._spreadsheet.get(url)
+        if sh is not None: return sh, True
+        t0 = time.perf_counter()
+        with span("sheets.apri"):
+            sh = client.open_by_url(url)
+        self._costi["spreadsheet"] = time.perf_counter() - t0
+        self._stat["aperture"] += 1
+        self._spreadsheet[url] = sh
+        return sh, False
+
+    def _get_foglio(self, url, titolo):
+        sh, _ = self._get_spreadsheet(url)
+        ws = self._fogli.get((url, titolo))
+        if ws is not None: return ws, True
+        t0 = time.perf_counter()
+        with span("sheets.foglio"):
+            ws = sh.sheet1 if titolo is None else sh.worksheet(titolo)
+        self._costi["foglio"] = time.perf_counter() - t0
+        self._stat["aperture"] += 1
+        self._fogli[(url, titolo)] = ws
+        return ws, False
+
+    def _conta(self, riusato, *passi):
+        self._stat["chiamate"] += 1
+        if riusato:
+            self._stat["riusi"] += 1
+            self._stat["secondi_risparmiati"] += sum(self._costi[p] for p in passi)
+
+    # --- API pubblica ---
+
+    def client(self):
+        with self._lock:
+            client, riusato = self._get_client()
+            self._conta(riusato, "client")
+            return client
+
+    def spreadsheet(self, url):
+        with self._lock:
+            sh, riusato = self._get_spreadsheet(url)
+            self._conta(riusato, "client", "spreadsheet")
+            return sh
+
+    def foglio(self, url, titolo=None):
+        # titolo None = primo foglio (sheet1)
+        with self._lock:
+            ws, riusato = self._get_foglio(url, titolo)
+            self._conta(riusato, "client", "spreadsheet", "foglio")
+            return ws
+
+    def invalida(self):
+        # Dopo un errore si riparte da zero: nuova autorizzazione e nuovi handle
+        with self._lock:
+            self._client = None
+            self._spreadsheet.clear()
+            self._fogli.clear()
+
+    def invalida_se_serve(self, errore):
+        # Da chiamare dopo un errore qualsiasi: si riparte da zero solo se autorizzazione
+        # o handle non valgono più. Dopo quota, rete o errori locali client e handle
+        # restano, condivisi da pagine, coda salvataggi e replica
+        if handle_non_validi(errore): self.invalida()
+
+    def statistiche(self):
+        with self._lock:
+            stat = dict(self._stat)
+        stat["risparmio_medio"] = stat["secondi_risparmiati"] / stat["riusi"] if stat["riusi"] else 0.0
+        return stat
@@ -0,0 +1,141 @@
+# ==============================================================================
+# SINCRONIZZAZIONE INCREMENTALE DI UN FOGLIO GOOGLE
+# ==============================================================================
+# Copia locale persistente di un foglio "solo append" (Diario, DB preventivi,
+# DB catering). Ad ogni lettura si scarica solo l'intervallo A{n}:{col} a
+# partire dall'ultima riga nota: se quella riga è cambiata (o è sparita) vuol
+# dire che qualcuno ha modificato le righe precedenti e si rifà tutto.
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from galbino.formati import lettera_colonna
+from galbino.tracciamento import TRACCIATORE, span
+
+VERIFICA_COMPLETA = 3600 # secondi: ogni tanto una rilettura completa intercetta modifiche a metà foglio
+
+
+def _hash_righe(righe, h=""):
+    # Hash a catena: aggiungere righe costa solo l'hash delle righe nuove
+    for riga in righe:
+        h = hashlib.sha256((h + json.dumps(riga, ensure_ascii=False)).encode("utf-8")).hexdigest()
+    return h
+
+
+class SincronizzatoreFoglio:
+
+    def __init__(self, percorso, chiave, larghezza, verifica_completa=VERIFICA_COMPLETA):
+        self.percorso = percorso
+        self.chiave = chiave # es. url#titolo: uno snapshot di un altro foglio viene scartato
+        self.larghezza = larghezza
+        self.ultima_colonna = lettera_colonna(larghezza)
+        self.verifica_completa = verifica_completa
+        self.righe = []
+        self.hash = ""
+        # Cambia solo quando le righe già note vengono riscritte (o lo snapshot si perde):
+        # chi tiene una copia derivata sa così se può limitarsi ad aggiungere righe
+        self.generazione = uuid.uuid4().hex
+        self.verificato = 0.0
+        self.ultima_lettura = {"tipo": None, "righe": 0, "secondi": 0.0, "inizio": 0.0}
+        self._lock = threading.Lock()
+        self._carica()
+
+    def _normalizza(self, riga):
+        riga = [str(v) for v in riga[:self.larghezza]]
+        return riga + [""] * (self.larghezza - len(riga))
+
+    # --- Snapshot su disco ---
+
+    def _carica(self):
+        try:
+            with open(self.percorso, encoding="utf-8") as f:
+                dati = json.load(f)
+        except (OSError, ValueError):
+            return
+        if dati.get("chiave") != self.chiave or dati.get("larghezza") != self.larghezza: return
+        righe = dati.get("righe", [])
+        if _hash_righe(righe) != dati.get("hash"): return # snapshot corrotto: si riparte da zero
+        self.righe, self.hash = righe, dati["hash"]
+        self.generazione = dati.get("generazione") or self.generazione
+        self.verificato = dati.get("verificato", 0.0)
+        # Dopo un riavvio senza Google la copia su disco è l'ultima buona: serve sapere di quando è
+        self.ultima_lettura["inizio"] = dati.get("letto_il", 0.0)
+
+    def _salva(self):
+        dati = {"chiave": self.chiave, "larghezza": self.larghezza, "righe": self.righe,
+                "hash": self.hash, "generazione": self.generazione, "verificato": self.verificato,
+                "letto_il": self.ultima_lettura["inizio"]}
+        tmp = self.percorso + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(dati, f, ensure_ascii=False)
+        os.replace(tmp, self.percorso)
+
+    # --- Lettura da Google ---
+
+    def sincronizza(self, ws):
+        chiamata = time.time()
+        with self._lock:
+            scaduta = time.time() - self.verificato > self.verifica_completa
+            # Mentre si aspettava il lock un'altra sessione ha letto il foglio, partendo
+            # dopo questa chiamata: le sue righe valgono anche qui, senza un'altra richiesta
+            # (se serviva una rilettura completa, solo se era completa anche quella)
+            if self.righe and self.ultima_lettura["inizio"] > chiamata and (not scaduta or self.ultima_lettura["tipo"] == "completa"):
+                TRACCIATORE.registra("sheets.lettura_condivisa", 0.0)
+                return list(self.righe)
+            t0 = time.perf_counter()
+            # Tutto ciò che è stato scritto sul foglio prima di questo istante è nella lettura;
+            # se la lettura fallisce resta l'istante dell'ultima riuscita
+            inizio = time.time()
+            if not self.righe or scaduta or not self._delta(ws, inizio):
+                self._completa(ws, inizio)
+            self.ultima_lettura["secondi"] = time.perf_counter() - t0
+            return list(self.righe)
+
+    def correggi(self, colonna, valori):
+        # Riporta nella copia locale celle appena scritte sul foglio ({numero riga: valore},
+        # colonna da 1) senza rileggerlo; le copie derivate ripartiranno dalla nuova generazione
+        with self._lock:
+            for n, valore in valori.items():
+                self.righe[n - 1][colonna - 1] = str(valore)
+            self.hash = _hash_righe(self.righe)
+            self.generazione = uuid.uuid4().hex
+            self._salva()
+            return self.generazione
+
+    def forza_verifica(self):
+        # La prossima sincronizza rilegge tutto il foglio
+        self.verificato = 0.0
+
+    def _delta(self, ws, inizio):
+        n = len(self.righe)
+        with span("sheets.lettura_delta"):
+            lette = ws.get(f"A{n}:{self.ultima_colonna}")
+        nuove = [self._normalizza(r) for r in lette]
+        if not nuove or nuove[0] != self.righe[-1]: return False
+        self.ultima_lettura["inizio"] = inizio
+        if len(nuove) > 1:
+            self.righe.extend(nuove[1:])
+            self.hash = _hash_righe(nuove[1:], self.hash)
+            self._salva()
+        self.ultima_lettura.update(tipo="delta", righe=len(nuove) - 1)
+        return True
+
+    def _completa(self, ws, inizio):
+        with span("sheets.lettura_completa"):
+            lette = ws.get_all_values()
+        self.ultima_lettura["inizio"] = inizio
+        righe = [self._normalizza(r) for r in lette]
+        while righe and not any(righe[-1]): righe.pop()
+        # Se le righe note sono rimaste uguali è solo un append: la generazione non cambia
+        n = len(self.righe)
+        if n > len(righe) or _hash_righe(righe[:n]) != self.hash:
+            self.generazione = uuid.uuid4().hex
+        self.righe = righe
+        self.hash = _hash_righe(righe)
+        self.verificato = time.time()
+        self._salva()
+        self.ultima_lettura.update(tipo="completa", righe=len(righe))
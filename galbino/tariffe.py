@@ -0,0 +1,180 @@
+# ==============================================================================
+# TARIFFE: REGOLE DI STAGIONE E LISTINO AIRBNB (LORDO)
+# ==============================================================================
+# Ogni anno viene compilato una sola volta in una tabella giorno per giorno
+# (stagione, tariffa feriale/weekend) con somme cumulative: il prezzo di un
+# soggiorno qualsiasi si ottiene con poche sottrazioni, senza ricalcolare la
+# Pasqua notte per notte.
+
+import datetime
+import functools
+
+import numpy as np
+
+LISTA_SERVIZI = [
+    ("Wedding Fee", 30), ("Breakfast", 20), ("Lunch", 45), ("Dinner", 75),
+    ("BBQ", 60), ("Cooking Class", 120), ("Wine Tasting", 50),
+    ("Truffle Hunting", 150), ("Ebike Tour", 80), ("Transfer", 150),
+    ("Prima Spesa", 0), ("Extra Cleaning", 200)
+]
+
+# --- LISTINO PREZZI AIRBNB (LORDO) ---
+RATES_AIRBNB = {
+    "Alta": {"Base": 2000, "We": 3100, "CapienzaBase": 16, "Max": 24},
+    "Media": {"Base": 1500, "We": 2200, "CapienzaBase": 16, "Max": 24},
+    "Bassa": {"Base": 1200, "We": 1200, "CapienzaBase": 10, "Max": 22}
+}
+STAGIONI = tuple(RATES_AIRBNB)
+
+# COSTI ACCESSORI (Prezzi Airbnb)
+COSTO_EXTRA_PAX_AIRBNB = 100
+PULIZIE_AIRBNB = 600 
+
+# PARAMETRI CALCOLO
+AIRBNB_COMMISSION = 0.155  # 15.5% (Trattenuta da Airbnb su TUTTO)
+SCONTO_LUNGA_DURATA = 0.15 # Sconto settimanale
+NOTTI_LUNGA_DURATA = 7
+MIN_STAY = 3
+
+GIORNI_WEEKEND = (3, 4, 5, 6) # Gio-Dom a tariffa "We"
+
+
+def calcola_pasqua(anno):
+    a, b, c = anno % 19, anno // 100, anno % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    mese = (h + l - 7 * m + 114) // 31
+    giorno = ((h + l - 7 * m + 114) % 31) + 1
+    return datetime.date(anno, mese, giorno)
+
+def get_stagione(data):
+    anno = data.year
+    dt_pasqua = calcola_pasqua(anno)
+    
+    # 1. Pasqua -> Media
+    if (dt_pasqua - datetime.timedelta(days=5)) <= data <= (dt_pasqua + datetime.timedelta(days=2)): return "Media"
+    
+    # 2. Natale/Capodanno -> Media
+    if datetime.date(anno, 12, 20) <= data <= datetime.date(anno, 12, 31) or datetime.date(anno, 1, 1) <= data <= datetime.date(anno, 1, 6): return "Media"
+    
+    # 3. Alta Stagione Standard (Giugno-Luglio)
+    maggio_31 = datetime.date(anno, 5, 31)
+    inizio_alta = maggio_31 - datetime.timedelta(days=(maggio_31.weekday() - 3) % 7)
+    luglio_31 = datetime.date(anno, 7, 31)
+    ultimo_lun_luglio = luglio_31 - datetime.timedelta(days=luglio_31.weekday())
+    fine_alta = ultimo_lun_luglio - datetime.timedelta(days=1)
+    
+    if inizio_alta <= data <= fine_alta: return "Alta"
+
+    # 4. NUOVA REGOLA: Settembre Alta Stagione DAL 2027
+    if anno >= 2027 and data.month == 9:
+        return "Alta"
+
+    # 5. Media Stagione (range rimanenti)
+    inizio_media_1 = datetime.date(anno, 4, 1)
+    fine_media_2 = datetime.date(anno, 8, 31)
+    
+    # Definizione Autunno Media
+    # Se è < 2027: Settembre (1/9) è Media.
+    # Se è >= 2027: Settembre è Alta, quindi Media parte da Ottobre (1/10).
+    start_autunno_media = datetime.date(anno, 9, 1)
+    if anno >= 2027:
+        start_autunno_media = datetime.date(anno, 10, 1)
+
+    primo_ott = datetime.date(anno, 10, 1)
+    terza_dom_ott = primo_ott + datetime.timedelta(days=(6 - primo_ott.weekday()) % 7) + datetime.timedelta(days=14)
+    
+    if (inizio_media_1 <= data < inizio_alta) or (ultimo_lun_luglio <= data <= fine_media_2) or (start_autunno_media <= data <= terza_dom_ott):
+         return "Media"
+         
+    return "Bassa"
+
+
+class TabellaTariffe:
+    # Anni interi [anno_da, anno_a] indicizzati per giorno dal 1/1 di anno_da.
+    # cum_* hanno un elemento in più: la somma delle notti [i, j) è cum[j] - cum[i].
+
+    def __init__(self, anno_da, anno_a):
+        self.inizio = datetime.date(anno_da, 1, 1)
+        self.fine = datetime.date(anno_a + 1, 1, 1)
+        giorni = [self.inizio + datetime.timedelta(days=i) for i in range((self.fine - self.inizio).days)]
+        self.stagione = np.array([STAGIONI.index(get_stagione(g)) for g in giorni], dtype=np.int8)
+        self.weekend = np.array([g.weekday() in GIORNI_WEEKEND for g in giorni], dtype=bool)
+        base = np.array([RATES_AIRBNB[s]["Base"] for s in STAGIONI])
+        we = np.array([RATES_AIRBNB[s]["We"] for s in STAGIONI])
+        self.tariffa = np.where(self.weekend, we[self.stagione], base[self.stagione])
+        self.capienza = np.array([RATES_AIRBNB[s]["CapienzaBase"] for s in STAGIONI])[self.stagione]
+        self.max = np.array([RATES_AIRBNB[s]["Max"] for s in STAGIONI])[self.stagione]
+        self.cum_tariffa = np.concatenate(([0], np.cumsum(self.tariffa)))
+        # Notti cumulate per stagione: bastano per extra pax e controllo capienza
+        self.cum_notti = {
+            s: np.concatenate(([0], np.cumsum(self.stagione == k)))
+            for k, s in enumerate(STAGIONI)
+        }
+
+    def indice(self, data):
+        return (data - self.inizio).days
+
+    def contiene(self, data_arrivo, notti):
+        return self.inizio <= data_arrivo and data_arrivo + datetime.timedelta(days=notti) <= self.fine
+
+
+@functools.lru_cache(maxsize=16)
+def tabella_tariffe(anno_da, anno_a):
+    return TabellaTariffe(anno_da, anno_a)
+
+def tabella_per(data_arrivo, notti):
+    ultimo = data_arrivo + datetime.timedelta(days=max(notti - 1, 0))
+    return tabella_tariffe(data_arrivo.year, ultimo.year)
+
+
+class LogNotti:
+    # Dettaglio notte per notte, costruito solo quando qualcuno lo legge
+
+    def __init__(self, tabella, i, notti, ospiti):
+        self._tabella, self._i, self._notti, self._ospiti = tabella, i, notti, ospiti
+        self._righe = None
+
+    def _costruisci(self):
+        t, ospiti = self._tabella, self._ospiti
+        righe = []
+        for j in range(self._i, self._i + self._notti):
+            giorno = t.inizio + datetime.timedelta(days=j)
+            if ospiti > t.max[j]:
+                righe.append(f"⚠️ {giorno.strftime('%d/%m')}: {ospiti} pax > max ({t.max[j]})")
+            costo_extra = max(0, ospiti - int(t.capienza[j])) * COSTO_EXTRA_PAX_AIRBNB
+            righe.append(f"{giorno.strftime('%d/%m')}: Base €{t.tariffa[j]} + Extra €{costo_extra}")
+        return righe
+
+    def righe(self):
+        if self._righe is None: self._righe = self._costruisci()
+        return self._righe
+
+    def __iter__(self):
+        return iter(self.righe())
+
+    def __len__(self):
+        return len(self.righe())
+
+    def __getitem__(self, k):
+        return self.righe()[k]
+
+
+# Funzione che calcola il PREZZO LISTINO AIRBNB (LORDO)
+def calcola_soggiorno_airbnb(data_arrivo, notti, ospiti):
+    notti = max(int(notti), 0)
+    t = tabella_per(data_arrivo, notti)
+    i = t.indice(data_arrivo)
+    j = i + notti
+    tot_affitto = int(t.cum_tariffa[j] - t.cum_tariffa[i])
+    tot_extra = 0
+    for s in STAGIONI:
+        notti_stagione = int(t.cum_notti[s][j] - t.cum_notti[s][i])
+        pax_eccedenti = max(0, ospiti - RATES_AIRBNB[s]["CapienzaBase"])
+        tot_extra += notti_stagione * pax_eccedenti * COSTO_EXTRA_PAX_AIRBNB
+    return tot_affitto, tot_extra, LogNotti(t, i, notti, ospiti)
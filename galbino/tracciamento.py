@@ -0,0 +1,136 @@
+# ==============================================================================
+# TRACCIAMENTO: TEMPI DELLE CHIAMATE ESTERNE E DELLE OPERAZIONI PESANTI
+# ==============================================================================
+# Ogni "span" (es. lodgify.scarico, sheets.append, excel.preventivo,
+# rerun.preventivi_affitto) registra la sua durata in una finestra mobile da
+# cui si calcolano p50/p95/p99. Con configura() le misure vanno anche in un
+# log a rotazione e in un file di testo in formato Prometheus.
+
+import collections
+import contextlib
+import functools
+import logging
+import logging.handlers
+import math
+import os
+import threading
+import time
+
+FINESTRA = 1000              # ultime misure tenute per ogni span
+INTERVALLO_PROMETHEUS = 15   # secondi minimi tra due scritture del file metriche
+QUANTILI = (0.5, 0.95, 0.99)
+
+
+def _quantile(ordinati, q):
+    # Nearest-rank: semplice e stabile anche con poche misure
+    return ordinati[max(0, math.ceil(q * len(ordinati)) - 1)]
+
+
+class Tracciatore:
+
+    def __init__(self, finestra=FINESTRA):
+        self._lock = threading.Lock()
+        self._misure = collections.defaultdict(lambda: collections.deque(maxlen=finestra))
+        self._conteggi = collections.Counter()
+        self._somme = collections.Counter()
+        self._errori = collections.Counter()
+        self._logger = None
+        self._percorso_prometheus = None
+        self._ultima_scrittura = 0.0
+
+    def configura(self, percorso_log=None, percorso_prometheus=None):
+        if percorso_log and self._logger is None:
+            logger = logging.getLogger(f"galbino.tracce.{os.path.basename(percorso_log)}")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            gestore = logging.handlers.RotatingFileHandler(percorso_log, maxBytes=5 * 1024 * 1024, backupCount=5, encoding="utf-8")
+            gestore.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            logger.addHandler(gestore)
+            self._logger = logger
+        if percorso_prometheus:
+            self._percorso_prometheus = percorso_prometheus
+
+    # --- Registrazione ---
+
+    @contextlib.contextmanager
+    def span(self, nome, **attributi):
+        t0 = time.perf_counter()
+        errore = None
+        try:
+            yield
+        except Exception as e:
+            # Solo gli errori veri: st.rerun()/st.stop() derivano da BaseException
+            errore = type(e).__name__
+            raise
+        finally:
+            self.registra(nome, time.perf_counter() - t0, errore, attributi)
+
+    def traccia(self, nome):
+        def decoratore(funzione):
+            @functools.wraps(funzione)
+            def avvolta(*args, **kwargs):
+                with self.span(nome):
+                    return funzione(*args, **kwargs)
+            return avvolta
+        return decoratore
+
+    def registra(self, nome, secondi, errore=None, attributi=None):
+        with self._lock:
+            self._misure[nome].append(secondi)
+            self._conteggi[nome] += 1
+            self._somme[nome] += secondi
+            if errore: self._errori[nome] += 1
+        if self._logger is not None:
+            extra = " ".join(f"{k}={v}" for k, v in (attributi or {}).items())
+            self._logger.info(f"{nome} {secondi * 1000:.1f}ms {'ERRORE ' + errore if errore else 'ok'} {extra}".rstrip())
+        if self._percorso_prometheus and time.monotonic() - self._ultima_scrittura > INTERVALLO_PROMETHEUS:
+            self._ultima_scrittura = time.monotonic()
+            try: self.scrivi_prometheus()
+            except OSError: pass
+
+    # --- Lettura ---
+
+    def statistiche(self):
+        with self._lock:
+            istantanea = {nome: sorted(misure) for nome, misure in self._misure.items()}
+            conteggi, somme, errori = dict(self._conteggi), dict(self._somme), dict(self._errori)
+        risultato = {}
+        for nome, ordinati in sorted(istantanea.items()):
+            if not ordinati: continue
+            risultato[nome] = {
+                "n": conteggi[nome],
+                "p50": _quantile(ordinati, 0.5),
+                "p95": _quantile(ordinati, 0.95),
+                "p99": _quantile(ordinati, 0.99),
+                "max": ordinati[-1],
+                "totale": somme[nome],
+                "errori": errori.get(nome, 0),
+            }
+        return risultato
+
+    def testo_prometheus(self):
+        statistiche = self.statistiche()
+        righe = ["# HELP galbino_span_seconds Durata degli span (finestra mobile)",
+                 "# TYPE galbino_span_seconds summary"]
+        for nome, s in statistiche.items():
+            for q in QUANTILI:
+                righe.append(f'galbino_span_seconds{{span="{nome}",quantile="{q}"}} {s["p" + str(int(q * 100))]:.6f}')
+            righe.append(f'galbino_span_seconds_sum{{span="{nome}"}} {s["totale"]:.6f}')
+            righe.append(f'galbino_span_seconds_count{{span="{nome}"}} {s["n"]}')
+        righe += ["# HELP galbino_span_errori_total Span terminati con eccezione",
+                  "# TYPE galbino_span_errori_total counter"]
+        for nome, s in statistiche.items():
+            righe.append(f'galbino_span_errori_total{{span="{nome}"}} {s["errori"]}')
+        return "\n".join(righe) + "\n"
+
+    def scrivi_prometheus(self):
+        tmp = self._percorso_prometheus + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.testo_prometheus())
+        os.replace(tmp, self._percorso_prometheus)
+
+
+# Istanza di processo usata da tutti i moduli
+TRACCIATORE = Tracciatore()
+span = TRACCIATORE.span
+traccia = TRACCIATORE.traccia
@@ -0,0 +1,91 @@
+# ==============================================================================
+# CONNESSIONE SHEETS: QUOTA E RETE NON BUTTANO VIA CLIENT E HANDLE CONDIVISI
+# ==============================================================================
+# Nessuna chiamata a Google: client e handle si mettono già in cache, così la
+# connessione non prova ad autorizzarsi. Si esegue con: python -m pytest -q
+
+import pytest
+
+from galbino.archivio_locale import ArchivioLocale, Replicatore
+from galbino.quota import QuotaEsaurita
+from galbino.resilienza import CircuitoAperto
+from galbino.sheets import ConnessioneSheets
+
+URL = "https://docs.google.com/spreadsheets/d/prova"
+
+
+class _Risposta:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class APIError(Exception):
+    # Come gspread.exceptions.APIError: lo stato HTTP è su .response
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.response = _Risposta(status_code)
+
+
+class WorksheetNotFound(Exception):
+    pass
+
+
+class _SincronizzatoreRotto:
+    # Al posto di SincronizzatoreFoglio: ogni lettura fallisce con l'errore dato
+    generazione = None
+    ultima_lettura = {"inizio": None}
+
+    def __init__(self, errore):
+        self.errore = errore
+
+    def sincronizza(self, ws):
+        raise self.errore
+
+
+@pytest.fixture
+def connessione():
+    conn = ConnessioneSheets({"client_email": "prova@example.iam.gserviceaccount.com"})
+    conn._client = object()
+    conn._spreadsheet[URL] = object()
+    conn._fogli[(URL, None)] = object()
+    return conn
+
+
+ALTRI_ERRORI = [QuotaEsaurita("nessun gettone"), APIError(429), APIError(503), CircuitoAperto("giù"),
+                TimeoutError("read timeout"), KeyError("colonna")]
+DEFINITIVI = [APIError(401), APIError(403), APIError(404), WorksheetNotFound("Diario")]
+
+
+@pytest.mark.parametrize("errore", ALTRI_ERRORI, ids=repr)
+def test_quota_e_rete_lasciano_la_connessione(connessione, errore):
+    client = connessione._client
+    connessione.invalida_se_serve(errore)
+    assert connessione._client is client
+    assert (URL, None) in connessione._fogli
+
+
+@pytest.mark.parametrize("errore", DEFINITIVI, ids=repr)
+def test_handle_non_validi_rifanno_la_connessione(connessione, errore):
+    connessione.invalida_se_serve(errore)
+    assert connessione._client is None
+    assert not connessione._fogli
+
+
+@pytest.mark.parametrize("errore", [QuotaEsaurita("nessun gettone"), APIError(429)], ids=repr)
+def test_replica_con_quota_esaurita_tiene_il_client(connessione, errore, tmp_path):
+    client = connessione._client
+    replica = Replicatore(connessione, ArchivioLocale(str(tmp_path / "archivio.sqlite3")), intervallo=3600)
+    replica.registra("preventivi", URL, None, _SincronizzatoreRotto(errore))
+    with pytest.raises(type(errore)):
+        replica.aggiorna("preventivi")
+    assert connessione._client is client
+    assert "preventivi" in replica.errori
+
+
+def test_replica_con_foglio_sparito_rifa_la_connessione(connessione, tmp_path):
+    replica = Replicatore(connessione, ArchivioLocale(str(tmp_path / "archivio.sqlite3")), intervallo=3600)
+    replica.registra("preventivi", URL, None, _SincronizzatoreRotto(APIError(404)))
+    with pytest.raises(APIError):
+        replica.aggiorna("preventivi")
+    assert connessione._client is None
@@ -1,17 +1,41 @@
 import streamlit as st
 import datetime
-import io
-import xlsxwriter
-import requests
-from icalendar import Calendar
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import os
 import traceback
 import time
+t_import = time.perf_counter() # tempo di import dei moduli galbino, riportato dal riscaldamento
+from galbino import percorso_dati
+from galbino.archivio_locale import ArchivioLocale, Replicatore
+from galbino.avvio import Riscaldamento, passi_import, registra_import_app
+from galbino.catering import (ORE_DEFAULT, PAGA_DEFAULT, RUOLI_STAFF, applica_modifiche, calcola_margine, calcola_staff,
+                              righe_staff, staff_iniziale)
+from galbino.coda_salvataggi import CodaSalvataggi
+from galbino.cruscotto_catering import LIVELLI, STATUS_CATERING, CruscottoCatering
+from galbino.disponibilita import CalendarioMultiCanale
+from galbino.documenti import CacheDocumenti, genera_excel_catering, generate_excel
+from galbino.esportazione import FORMATI_EXPORT, MIME_EXPORT, esporta_foglio, tipi_colonne_preventivi
+from galbino.finestre import ORDINAMENTI, finestre_libere
+from galbino.interfaccia import badge_non_aggiornati, salvataggi_falliti
+from galbino.listino import NOTTI_MAX_LISTINO, calcola_listino, listino_csv, listino_excel
+from galbino.preventivi import (PROPOSTE, calcola_prezzi, campi_preventivo, importi_proposta, riga_preventivo,
+                                totali_documento, voce_servizio)
+from galbino.resilienza import CIRCUITI, errore_transitorio
+from galbino.sheets import ConnessioneSheets
+from galbino.sincronizzazione import SincronizzatoreFoglio
+from galbino.tracciamento import TRACCIATORE, span
+from galbino.tariffe import LISTA_SERVIZI, MIN_STAY, PULIZIE_AIRBNB, tabella_tariffe
+durata_import = time.perf_counter() - t_import
 
 # --- CONFIGURAZIONE GLOBALE ---
 st.set_page_config(page_title="Gestionale Galbino", page_icon="🏰", layout="wide")
 
+# Tempi di rerun, chiamate Google/Lodgify ed Excel: log a rotazione + metriche Prometheus
+@st.cache_resource
+def configura_tracciamento():
+    TRACCIATORE.configura(percorso_dati("tracce_gestionale.log"), percorso_dati("metriche_gestionale.prom"))
+
+configura_tracciamento()
+
 # ==============================================================================
 # SEZIONE 0: SISTEMA DI AUTENTICAZIONE
 # ==============================================================================
@@ -52,337 +76,353 @@ def logout():
 # SEZIONE 1: FUNZIONI COMUNI
 # ==============================================================================
 
+# Un solo client Google autorizzato per processo, condiviso da sessioni e rerun
+@st.cache_resource
+def get_connessione_sheets():
+    return ConnessioneSheets(st.secrets["gcp_service_account"])
+
 def get_gspread_client():
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(dict(st.secrets["gcp_service_account"]), scope)
-    return gspread.authorize(creds)
+    return get_connessione_sheets().client()
+
+# Salvataggi differiti: giornale locale + invio a lotti in background
+@st.cache_resource
+def get_coda_salvataggi():
+    return CodaSalvataggi(get_connessione_sheets(), percorso_dati("coda_gestionale.sqlite3"))
+
+def stato_salvataggi():
+    coda = get_coda_salvataggi()
+    stato = coda.stato()
+    if stato["fallite"]: salvataggi_falliti(coda, "salvataggi", st.sidebar)
+    if stato["ultimo_errore"]:
+        st.sidebar.warning(f"☁️ {stato['in_attesa']} salvataggi in attesa (nuovo tentativo in corso): {stato['ultimo_errore']}")
+    elif stato["in_attesa"]:
+        st.sidebar.info(f"☁️ {stato['in_attesa']} salvataggi in invio a Google...")
+    elif not stato["fallite"]:
+        st.sidebar.caption(f"☁️ Tutto salvato su Google ({stato['inviate']} invii recenti)")
+
+# Archivio SQLite locale opzionale (secrets: archivio_locale = true) con i DB
+# preventivi e catering, allineato ai fogli in background
+def usa_archivio():
+    return bool(st.secrets.get("archivio_locale", False))
+
+@st.cache_resource
+def get_replicatore():
+    rep = Replicatore(get_connessione_sheets(), ArchivioLocale(percorso_dati("archivio_gestionale.sqlite3")))
+    url = st.secrets["spreadsheet_url"]
+    rep.registra("preventivi", url, None, SincronizzatoreFoglio(percorso_dati("snapshot_preventivi.json"), f"{url}#sheet1", larghezza=62))
+    # Senza un file catering dedicato le righe finiscono nel DB preventivi: niente specchio separato
+    if get_url_catering() != url:
+        rep.registra("catering", get_url_catering(), None, get_sync_catering())
+    return rep
+
+def get_url_catering():
+    return st.secrets.get("spreadsheet_url_catering", st.secrets["spreadsheet_url"])
+
+# Copia locale delle prime 17 colonne del DB catering (le righe salvate dal Catering Manager)
+@st.cache_resource
+def get_sync_catering():
+    url = get_url_catering()
+    return SincronizzatoreFoglio(percorso_dati("snapshot_catering.json"), f"{url}#sheet1", larghezza=17)
+
+# File Excel generati solo al download, riusati da tutte le sessioni
+@st.cache_resource
+def get_cache_documenti():
+    return CacheDocumenti()
+
+def documento_lazy(tipo, genera, *argomenti):
+    # Callable per st.download_button: parte solo al click, con cache LRU sugli input
+    chiave = CacheDocumenti.chiave(tipo, datetime.date.today(), *argomenti)
+    cache = get_cache_documenti()
+    return lambda: cache.ottieni(chiave, lambda: genera(*argomenti))
+
+# Calendari iCal di tutti i canali, condivisi da tutte le sessioni (un download per TTL, non per rerun).
+# secrets: [[calendari_ical]] con nome e url; senza, solo Lodgify.
+LODGIFY_ICAL_URL = "https://www.lodgify.com/5bab045e-30ec-4edf-aabf-970d352e7549.ics"
+
+@st.cache_resource
+def get_calendari():
+    fonti = [(c["nome"], c["url"]) for c in st.secrets.get("calendari_ical", [])] or [("Lodgify", LODGIFY_ICAL_URL)]
+    return CalendarioMultiCanale(fonti, snapshot=percorso_dati)
+
+# Riscaldamento del processo, partito dalla prima pagina servita (di solito il login):
+# import pesanti, autorizzazione Google, calendari e tabelle tariffe in background
+@st.cache_resource
+def avvia_riscaldamento():
+    registra_import_app(durata_import)
+    anno = datetime.date.today().year
+    passi = [("tariffe", lambda: [tabella_tariffe(a, b) for a, b in ((anno, anno), (anno, anno + 1), (anno + 1, anno + 1))])]
+    passi += passi_import()
+    try:
+        connessione, calendari = get_connessione_sheets(), get_calendari()
+        passi += [("sheets_autorizzazione", connessione.client), ("calendari", calendari.indice)]
+    except Exception:
+        pass # secrets incompleti: si scaldano solo import e tariffe
+    return Riscaldamento(passi, durata_import).avvia()
+
+def avvisi_calendari():
+    # Canali in errore: si usa l'ultimo calendario buono (o nessuno, se mai scaricato)
+    for c in get_calendari().stato():
+        if not c["errore"]: continue
+        if c["aggiornato_il"]:
+            badge_non_aggiornati(f"calendario {c['nome']}", c["aggiornato_il"].timestamp(), c["errore"])
+        else:
+            st.warning(f"⚠️ {c['nome']}: calendario non disponibile, date non verificate su questo canale ({c['errore']})")
+
+def pannello_prestazioni():
+    # Chi rallenta la pagina: Google, Lodgify o il nostro codice?
+    with st.expander("Admin: Prestazioni"):
+        statistiche = TRACCIATORE.statistiche()
+        if not statistiche:
+            st.caption("Nessuna misura ancora registrata.")
+            return
+        righe = [{"Span": nome, "N": s["n"], "p50 ms": s["p50"] * 1000, "p95 ms": s["p95"] * 1000,
+                  "p99 ms": s["p99"] * 1000, "Max ms": s["max"] * 1000, "Errori": s["errori"]}
+                 for nome, s in statistiche.items()]
+        st.dataframe(righe, use_container_width=True, hide_index=True,
+                     column_config={c: st.column_config.NumberColumn(format="%.1f") for c in ["p50 ms", "p95 ms", "p99 ms", "Max ms"]})
+        st.caption(f"{len(righe)} tipi di operazione tracciati; dettaglio in {percorso_dati('tracce_gestionale.log')} e {percorso_dati('metriche_gestionale.prom')}")
+        riscaldamento = avvia_riscaldamento()
+        esiti = ", ".join(f"{nome} {secondi * 1000:.0f} ms" + (" (errore)" if errore else "") for nome, (secondi, errore) in riscaldamento.esiti.items())
+        stato = f"completato in {riscaldamento.secondi:.1f} s" if riscaldamento.completato else "in corso"
+        st.caption(f"Avvio: import moduli app {riscaldamento.durata_import * 1000:.0f} ms; riscaldamento {stato}: {esiti}")
+        # Interruttori per endpoint: "aperto" = richieste rifiutate subito, pagine sull'ultima copia buona
+        circuiti = [{"Endpoint": c["endpoint"], "Stato": c["stato"], "Guasti di fila": c["guasti"], "Aperture": c["aperture"],
+                     "Rifiutate": c["rifiutate"], "Riapre tra s": c["riapre_tra"], "Ultimo errore": c["ultimo_errore"]}
+                    for c in CIRCUITI.stato()]
+        if circuiti:
+            st.dataframe(circuiti, use_container_width=True, hide_index=True,
+                         column_config={"Riapre tra s": st.column_config.NumberColumn(format="%.0f")})
+        # Regolatore di quota del service account: code per priorità e richieste rallentate
+        quota = get_connessione_sheets().regolatore.stato()
+        coda, gettoni = quota["in_coda"], quota["gettoni"]
+        st.caption(f"Quota Sheets: in coda {coda['scritture']} scritture, {coda['letture']} letture pagina, {coda['letture_sfondo']} letture in background · "
+                   f"gettoni {gettoni['lettura']:.0f} lettura / {gettoni['scrittura']:.0f} scrittura · {quota['attese']} richieste rallentate "
+                   f"({quota['secondi_attesa']:.1f} s in tutto), {quota['scadute']} scadute, {quota['risposte_429']} risposte 429, {quota['unite']} letture unite")
 
 # ==============================================================================
 # SEZIONE 2: APP PREVENTIVI AFFITTO (CASTLE RENTAL)
 # ==============================================================================
 
-def app_preventivi_affitto():
-    st.title(f"🏰 Preventivi Affitto (Utente: {st.session_state['user_name']})")
+def input_servizio(nome):
+    # Quali campi ha ogni servizio nel modulo: (pax, quantità); il prezzo c'è sempre
+    if "Wedding" in nome or "Truffle" in nome: return True, False
+    if "Prima Spesa" in nome: return False, False
+    if "Transfer" in nome or "Extra Cleaning" in nome: return False, True
+    return True, True
+
+def pannello_storico_preventivi(carica):
+    # Ricerca sui preventivi salvati: archivio SQLite locale indicizzato per cliente,
+    # check-in, autore e canale, allineato al foglio in background
+    if not st.toggle("🔎 Cerca nei preventivi salvati", key="cerca_storico"): return
+    rep = get_replicatore()
+    if not rep.archivio.pronto("preventivi"):
+        try:
+            with st.spinner("Prima copia locale del DB preventivi..."): rep.aggiorna("preventivi")
+        except Exception as e:
+            st.error(f"Errore lettura DB Affitti: {e}")
+            return
+    if "preventivi" in rep.errori:
+        badge_non_aggiornati("DB preventivi", rep.archivio.letto_il("preventivi"), rep.errori["preventivi"])
+    c1, c2, c3, c4 = st.columns([2, 2, 1, 1])
+    with c1: testo = st.text_input("Cliente", placeholder="Inizio del nome, anche senza accenti", key="storico_cliente")
+    with c2: periodo = st.date_input("Check-in tra", value=(), format="DD/MM/YYYY", key="storico_periodo")
+    with c3: autore = st.selectbox("Autore", ["Tutti", "Luca", "Stefano"], key="storico_autore")
+    with c4: canale = st.selectbox("Canale", ["Tutti", "Airbnb", "Diretto", "Netto Interno"], key="storico_canale")
     
-    LODGIFY_ICAL_URL = "https://www.lodgify.com/5bab045e-30ec-4edf-aabf-970d352e7549.ics"
-    
-    LISTA_SERVIZI = [
-        ("Wedding Fee", 30), ("Breakfast", 20), ("Lunch", 45), ("Dinner", 75),
-        ("BBQ", 60), ("Cooking Class", 120), ("Wine Tasting", 50),
-        ("Truffle Hunting", 150), ("Ebike Tour", 80), ("Transfer", 150),
-        ("Prima Spesa", 0), ("Extra Cleaning", 200)
-    ]
-
-    # --- LISTINO PREZZI AIRBNB (LORDO) ---
-    RATES_AIRBNB = {
-        "Alta": {"Base": 2000, "We": 3100, "CapienzaBase": 16, "Max": 24},
-        "Media": {"Base": 1500, "We": 2200, "CapienzaBase": 16, "Max": 24},
-        "Bassa": {"Base": 1200, "We": 1200, "CapienzaBase": 10, "Max": 22}
-    }
-    
-    # COSTI ACCESSORI (Prezzi Airbnb)
-    COSTO_EXTRA_PAX_AIRBNB = 100
-    PULIZIE_AIRBNB = 600 
-    
-    # PARAMETRI CALCOLO
-    AIRBNB_COMMISSION = 0.155  # 15.5% (Trattenuta da Airbnb su TUTTO)
-    SCONTO_LUNGA_DURATA = 0.15 # Sconto settimanale
-    MIN_STAY = 3
-    
-    def calcola_pasqua(anno):
-        a, b, c = anno % 19, anno // 100, anno % 100
-        d, e = b // 4, b % 4
-        f = (b + 8) // 25
-        g = (b - f + 1) // 3
-        h = (19 * a + b - d - g + 15) % 30
-        i, k = c // 4, c % 4
-        l = (32 + 2 * e + 2 * i - h - k) % 7
-        m = (a + 11 * h + 22 * l) // 451
-        mese = (h + l - 7 * m + 114) // 31
-        giorno = ((h + l - 7 * m + 114) % 31) + 1
-        return datetime.date(anno, mese, giorno)
-
-    def get_stagione(data):
-        anno = data.year
-        dt_pasqua = calcola_pasqua(anno)
-        
-        # 1. Pasqua -> Media
-        if (dt_pasqua - datetime.timedelta(days=5)) <= data <= (dt_pasqua + datetime.timedelta(days=2)): return "Media"
-        
-        # 2. Natale/Capodanno -> Media
-        if datetime.date(anno, 12, 20) <= data <= datetime.date(anno, 12, 31) or datetime.date(anno, 1, 1) <= data <= datetime.date(anno, 1, 6): return "Media"
-        
-        # 3. Alta Stagione Standard (Giugno-Luglio)
-        maggio_31 = datetime.date(anno, 5, 31)
-        inizio_alta = maggio_31 - datetime.timedelta(days=(maggio_31.weekday() - 3) % 7)
-        luglio_31 = datetime.date(anno, 7, 31)
-        ultimo_lun_luglio = luglio_31 - datetime.timedelta(days=luglio_31.weekday())
-        fine_alta = ultimo_lun_luglio - datetime.timedelta(days=1)
-        
-        if inizio_alta <= data <= fine_alta: return "Alta"
+    filtri = {}
+    if autore != "Tutti": filtri["autore"] = autore
+    da = periodo[0] if len(periodo) > 0 else None
+    a = periodo[1] if len(periodo) > 1 else None
+    t0 = time.perf_counter()
+    # Senza un file catering dedicato, nel DB ci sono anche gli eventi catering: esclusi
+    # nella query, così il limite conta solo i preventivi affitto
+    trovati = rep.archivio.cerca("preventivi", nome=testo.strip() or None, da=da, a=a, limite=50,
+                                 inizia={"canale": canale} if canale != "Tutti" else None,
+                                 esclusi={"autore": STATUS_CATERING}, **filtri)
+    st.caption(f"{len(trovati)} preventivi (max 50, dai più recenti) in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    if not trovati: return
+    
+    def descrivi(i):
+        r = trovati[i]
+        periodo = f"{r['valori'][4]} → {r['valori'][5]}"
+        return f"{r['valori'][3]} · {periodo} · {r['ospiti'] or 0:.0f} ospiti · {r['canale']} · € {r['totale'] or 0:,.2f} ({r['autore']}, {r['valori'][2]})"
+    
+    c1, c2 = st.columns([4, 1])
+    with c1: scelto = st.selectbox("Preventivo", range(len(trovati)), format_func=descrivi, label_visibility="collapsed")
+    with c2: st.button("↩️ Carica nel modulo", on_click=carica, args=(trovati[scelto]["valori"],), use_container_width=True)
+    st.divider()
 
-        # 4. NUOVA REGOLA: Settembre Alta Stagione DAL 2027
-        if anno >= 2027 and data.month == 9:
-            return "Alta"
 
-        # 5. Media Stagione (range rimanenti)
-        inizio_media_1 = datetime.date(anno, 4, 1)
-        fine_media_2 = datetime.date(anno, 8, 31)
-        
-        # Definizione Autunno Media
-        # Se è < 2027: Settembre (1/9) è Media.
-        # Se è >= 2027: Settembre è Alta, quindi Media parte da Ottobre (1/10).
-        start_autunno_media = datetime.date(anno, 9, 1)
-        if anno >= 2027:
-            start_autunno_media = datetime.date(anno, 10, 1)
-
-        primo_ott = datetime.date(anno, 10, 1)
-        terza_dom_ott = primo_ott + datetime.timedelta(days=(6 - primo_ott.weekday()) % 7) + datetime.timedelta(days=14)
-        
-        if (inizio_media_1 <= data < inizio_alta) or (ultimo_lun_luglio <= data <= fine_media_2) or (start_autunno_media <= data <= terza_dom_ott):
-             return "Media"
-             
-        return "Bassa"
-
-    # Funzione che calcola il PREZZO LISTINO AIRBNB (LORDO)
-    def calcola_soggiorno_airbnb(data_arrivo, notti, ospiti):
-        tot_affitto = 0
-        tot_extra = 0
-        log = []
-        
-        for i in range(notti):
-            giorno = data_arrivo + datetime.timedelta(days=i)
-            stg = get_stagione(giorno)
-            tipo = "We" if giorno.weekday() in [3,4,5,6] else "Base"
-            tariffa_base = RATES_AIRBNB[stg]
-            
-            # --- MODIFICA ANTI-CRASH: Rimosso blocco rigido su Max Ospiti ---
-            if ospiti > tariffa_base["Max"]:
-                 log.append(f"⚠️ {giorno.strftime('%d/%m')}: {ospiti} pax > max ({tariffa_base['Max']})")
-            
-            # Calcolo Affitto Base (Listino)
-            prezzo_base = tariffa_base[tipo]
-            
-            # Calcolo Extra Pax (Listino)
-            pax_eccedenti = max(0, ospiti - tariffa_base["CapienzaBase"])
-            costo_extra = pax_eccedenti * COSTO_EXTRA_PAX_AIRBNB
-            
-            tot_affitto += prezzo_base
-            tot_extra += costo_extra
-            
-            log.append(f"{giorno.strftime('%d/%m')}: Base €{prezzo_base} + Extra €{costo_extra}")
-            
-        return tot_affitto, tot_extra, log
-
-    def check_availability(checkin, checkout, url):
-        headers = {"User-Agent": "Mozilla/5.0"}
+def app_preventivi_affitto():
+    st.title(f"🏰 Preventivi Affitto (Utente: {st.session_state['user_name']})")
+    
+    # Servizi, listino Airbnb, costi accessori e parametri di calcolo: vedi galbino/tariffe.py
+    
+    def check_availability(checkin, checkout):
         try:
-            r = requests.get(url, headers=headers)
-            r.raise_for_status()
-            cal = Calendar.from_ical(r.content)
-            checkin_dt = checkin
-            checkout_dt = checkout
-            is_occupied = False
-            msg_occupato = ""
-            for component in cal.walk():
-                if component.name == "VEVENT":
-                    dtstart = component.get('dtstart').dt
-                    dtend = component.get('dtend').dt
-                    if isinstance(dtstart, datetime.datetime): dtstart = dtstart.date()
-                    if isinstance(dtend, datetime.datetime): dtend = dtend.date()
-                    if (checkin_dt < dtend) and (checkout_dt > dtstart):
-                        is_occupied = True
-                        msg_occupato = f"Occupato: {dtstart.strftime('%d/%m')} - {dtend.strftime('%d/%m')}"
-            if is_occupied: return False, msg_occupato
-            else: return True, "Libero"
+            calendari = get_calendari()
+            occupato = calendari.indice().dettaglio_conflitto(checkin, checkout)
+            if occupato: return False, f"Occupato: {occupato[0].strftime('%d/%m')} - {occupato[1].strftime('%d/%m')} ({', '.join(occupato[2])})"
+            if len(calendari.mancanti()) == len(calendari.calendari): return None, "Errore: nessun calendario disponibile"
+            return True, "Libero"
         except Exception as e: return None, f"Errore: {e}"
 
     def salva_su_google_sheets(riga_dati):
         try:
-            client = get_gspread_client()
-            sheet = client.open_by_url(st.secrets["spreadsheet_url"]).sheet1
-            sheet.append_row(riga_dati)
+            get_coda_salvataggi().accoda(st.secrets["spreadsheet_url"], None, [riga_dati])
             return True
         except Exception as e:
             st.error(f"Errore DB Affitti: {e}")
             return False
             
-    def generate_excel(autore, canale, cliente, checkin, checkout, notti, ospiti, affitto_finale, pulizie_finali, dettagli_servizi, sconto, totale_gen, costo_medio, note):
-        output = io.BytesIO()
-        workbook = xlsxwriter.Workbook(output, {'in_memory': True})
-        worksheet = workbook.add_worksheet("Preventivo")
-        bold = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'bg_color': '#D3D3D3'})
-        merge_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'vcenter', 'bg_color': '#FFD700'}) 
-        currency = workbook.add_format({'num_format': '#,##0.00 €', 'border': 1, 'align': 'center'})
-        normal = workbook.add_format({'border': 1, 'align': 'center'})
-        
-        worksheet.set_column('A:B', 15); worksheet.set_column('C:C', 12); worksheet.set_column('D:D', 30)
-        worksheet.set_column('E:F', 13); worksheet.set_column('G:H', 8); worksheet.set_column('I:K', 16)
-        
-        general_headers = ["Autore", "Canale", "Data Prev", "Cliente", "CheckIn", "CheckOut", "Notti", "Ospiti", "Affitto", "Media/Notte", "Pulizie"]
-        worksheet.write_row('A1', general_headers, bold)
-        worksheet.write_row('A2', [autore, canale, datetime.date.today().strftime("%d/%m/%Y"), cliente, checkin.strftime("%d/%m/%Y"), checkout.strftime("%d/%m/%Y"), notti, ospiti], normal)
-        worksheet.write('I2', affitto_finale, currency); worksheet.write('J2', costo_medio, currency); worksheet.write('K2', pulizie_finali, currency)
-
-        col_idx = 11 
-        for nome, _ in LISTA_SERVIZI:
-            worksheet.merge_range(0, col_idx, 0, col_idx+3, nome.upper(), merge_format)
-            worksheet.write_row(1, col_idx, ["€ Unit", "Pax", "Qta", "Totale"], bold)
-            if nome in dettagli_servizi:
-                d = dettagli_servizi[nome]
-                worksheet.write(2, col_idx, d['p_unit'], currency); worksheet.write(2, col_idx+1, d['pax'], normal)
-                worksheet.write(2, col_idx+2, d['qta'], normal); worksheet.write(2, col_idx+3, d['subtotale'], currency)
-            else:
-                worksheet.write_row(2, col_idx, [0, 0, 0, 0], currency)
-            col_idx += 4 
-
-        col_idx += 1
-        worksheet.write(0, col_idx, "SCONTO", bold); worksheet.write(2, col_idx, sconto, currency)
-        worksheet.write(0, col_idx+1, "TOTALE", bold); worksheet.write(2, col_idx+1, totale_gen, currency)
-        worksheet.write(0, col_idx+2, "NOTE", bold); worksheet.write(2, col_idx+2, note, normal)
-        workbook.close()
-        return output.getvalue()
-    
-    def download_full_db_excel():
+    def download_full_db(formato):
+        # Lettura a blocchi e scrittura in streaming: memoria limitata anche con anni di preventivi
         try:
-            client = get_gspread_client()
-            sheet = client.open_by_url(st.secrets["spreadsheet_url"]).sheet1
-            data = sheet.get_all_values()
-            if len(data) < 2: return None
-            output = io.BytesIO()
-            workbook = xlsxwriter.Workbook(output, {'in_memory': True})
-            worksheet = workbook.add_worksheet("DB Completo")
-            for r, row in enumerate(data):
-                for c, val in enumerate(row):
-                    worksheet.write(r, c, val)
-            workbook.close()
-            return output.getvalue()
-        except: return None
+            sheet = get_connessione_sheets().foglio(st.secrets["spreadsheet_url"])
+            percorso = esporta_foglio(sheet, tipi_colonne_preventivi(LISTA_SERVIZI), formato)
+            if percorso is None: return None
+            try:
+                with open(percorso, "rb") as f: return f.read()
+            finally:
+                os.remove(percorso)
+        except Exception as e:
+            get_connessione_sheets().invalida_se_serve(e)
+            st.error(f"Errore export DB: {e}")
+            return None
+
+    options_auth = ["Seleziona...", "Luca", "Stefano"]
+
+    def carica_preventivo(riga):
+        # Callback: i valori vanno nelle chiavi dei widget prima che vengano ridisegnati
+        campi = campi_preventivo(riga)
+        stato = st.session_state
+        if campi["autore"] in options_auth: stato["autore"] = campi["autore"]
+        stato["cliente"] = campi["cliente"]
+        if campi["checkin"] and campi["checkout"] and campi["checkout"] > campi["checkin"]:
+            stato["checkin"], stato["checkout"] = campi["checkin"], campi["checkout"]
+        stato["ospiti"] = max(1, campi["ospiti"])
+        for nome, prezzo_def in LISTA_SERVIZI:
+            # Servizi assenti dal preventivo: prezzo di listino e quantità a zero
+            p_unit, pax, qta = campi["servizi"].get(nome, (prezzo_def, 0, 0))
+            con_pax, con_qta = input_servizio(nome)
+            stato[f"p_{nome}"] = float(p_unit) if isinstance(prezzo_def, float) or "Prima Spesa" in nome else int(round(p_unit))
+            if con_pax: stato[f"x_{nome}"] = pax
+            if con_qta: stato[f"q_{nome}"] = qta
+        if campi["perc_sconto_diretto"] is not None: stato["perc_sconto_diretto"] = campi["perc_sconto_diretto"]
+        stato["sconto_manuale"] = float(campi["sconto"])
+        stato["note_interne"] = campi["note"]
+        stato["proposta"] = campi["proposta"]
+        stato["preventivo_caricato"] = campi
+
+    pannello_storico_preventivi(carica_preventivo)
+    if "preventivo_caricato" in st.session_state:
+        caricato = st.session_state.pop("preventivo_caricato")
+        data_prev = caricato["data"].strftime("%d/%m/%Y") if caricato["data"] else "?"
+        st.info(f"↩️ Caricato il preventivo {caricato['canale']} del {data_prev} per {caricato['cliente']}: totale salvato € {caricato['totale']:,.2f}. "
+                "I prezzi qui sotto sono ricalcolati col listino attuale.")
 
     # --- UI AFFITTO ---
     with st.container():
         c_aut, c_cli = st.columns([1, 2])
         with c_aut: 
             current_user = st.session_state.get('user_name', 'Seleziona...')
-            options_auth = ["Seleziona...", "Luca", "Stefano"]
             idx = options_auth.index(current_user) if current_user in options_auth else 0
-            autore = st.selectbox("Autore", options_auth, index=idx)
+            autore = st.selectbox("Autore", options_auth, index=idx, key="autore")
             
-        with c_cli: cliente = st.text_input("Nome Cliente")
+        with c_cli: cliente = st.text_input("Nome Cliente", key="cliente")
         
         c1, c2, c3 = st.columns(3)
         with c1: 
-            checkin = st.date_input("Check-In", datetime.date.today(), format="DD/MM/YYYY")
+            checkin = st.date_input("Check-In", datetime.date.today(), format="DD/MM/YYYY", key="checkin")
             
         # CALCOLO DATA CHECKOUT DEFAULT
         default_checkout = checkin + datetime.timedelta(days=MIN_STAY)
         
         with c2: 
-            checkout = st.date_input("Check-Out", value=default_checkout, min_value=checkin + datetime.timedelta(days=1), format="DD/MM/YYYY")
+            checkout = st.date_input("Check-Out", value=default_checkout, min_value=checkin + datetime.timedelta(days=1), format="DD/MM/YYYY", key="checkout")
             
-        with c3: ospiti = st.number_input("Ospiti", min_value=1, value=10)
+        with c3: ospiti = st.number_input("Ospiti", min_value=1, value=10, key="ospiti")
 
-    is_free, msg = check_availability(checkin, checkout, LODGIFY_ICAL_URL)
+    is_free, msg = check_availability(checkin, checkout)
     if is_free: st.success("✅ DATE DISPONIBILI")
     else: st.error(f"⛔ {msg}")
+    avvisi_calendari()
     
     # AVVISO VISIVO SE OSPITI ECCESSIVI (Senza bloccare)
     if ospiti > 24:
         st.warning(f"⚠️ Attenzione: Stai calcolando per {ospiti} persone (Max standard: 24). Il calcolo include i costi extra per tutti.")
 
-    # --- CALCOLO AUTOMATICO (DEFAULT) ---
     notti = (checkout - checkin).days
     
-    # Calcolo Prezzi Lordi Airbnb (Listino)
-    # Ora la funzione restituisce SEMPRE numeri, mai None
-    costo_affitto_listino, costo_extra_listino, log_affitto = calcola_soggiorno_airbnb(checkin, notti, ospiti)
-    
-    # Inizializzazione variabili per evitare errori
-    prezzo_airbnb_totale = 0
-    prezzo_diretto = 0
-    netto_galbino_totale = 0
-    affitto_airbnb_finale = 0
-    
-    # Procediamo solo se abbiamo valori validi (anche se ospiti > 24 ora funziona)
-    if notti >= MIN_STAY:
-        # A. Sconto Lunga Durata (Su Listino Airbnb)
-        if notti >= 7:
-            costo_affitto_listino -= (costo_affitto_listino * SCONTO_LUNGA_DURATA)
-        
-        affitto_airbnb_finale = costo_affitto_listino
-        
     # --- POSSIBILITÀ DI OVERRIDE MANUALE ---
     st.markdown("---")
     col_manual, col_void = st.columns([1, 2])
     with col_manual:
         usa_manuale = st.checkbox("✍️ Inserisci Prezzo Airbnb Manuale?")
+    with col_void:
+        # In modalità modulo servizi, sconti e note si applicano tutti insieme con un solo rerun
+        modo_modulo = st.toggle("📝 Servizi e sconti in un modulo (un solo aggiornamento)", value=True, key="modo_modulo")
     
-    if usa_manuale:
-        c_man_aff, c_void = st.columns(2)
-        with c_man_aff:
-            # Nota: L'utente inserisce qui SOLO la voce "Costo notti", non incluso pulizie
-            affitto_airbnb_finale = st.number_input("Totale 'Costo Notti' Airbnb (€)", value=11100.0, step=50.0, help="Inserisci il totale 'Costo Notti' che vedi su Airbnb (Escluse pulizie)")
-        costo_extra_listino = 0 # Se è manuale, assumiamo sia tutto incluso nel prezzo sopra
+    affitto_manuale = None
+    with (st.form("servizi_sconti", border=False) if modo_modulo else st.container()):
+        if usa_manuale:
+            c_man_aff, c_void = st.columns(2)
+            with c_man_aff:
+                # Nota: L'utente inserisce qui SOLO la voce "Costo notti", non incluso pulizie
+                # Se è manuale, assumiamo sia tutto incluso (extra a zero)
+                affitto_manuale = st.number_input("Totale 'Costo Notti' Airbnb (€)", value=11100.0, step=50.0, help="Inserisci il totale 'Costo Notti' che vedi su Airbnb (Escluse pulizie)", key="affitto_manuale")
         
-    # --- CALCOLI FINALI ---
-    # Usiamo un controllo robusto per evitare crash
-    if affitto_airbnb_finale is not None:
-        # B. Totale Lordo Airbnb (Affitto + Extra + Pulizie)
-        prezzo_airbnb_totale = affitto_airbnb_finale + (costo_extra_listino if costo_extra_listino else 0) + PULIZIE_AIRBNB
-        
-        # C. Netto Galbino Reale
-        # Airbnb trattiene 15.5% su TUTTO (Affitto + Pulizie + Extra)
-        netto_galbino_totale = prezzo_airbnb_totale * (1 - AIRBNB_COMMISSION)
-        
-    st.markdown("### 🍷 Servizi")
-    dettagli_servizi_excel = {}
-    totale_servizi = 0
-    
-    for nome, prezzo_def in LISTA_SERVIZI:
-        with st.expander(f"{nome}"):
-            if "Wedding" in nome:
-                c1, c2 = st.columns(2)
-                p_unit = c1.number_input(f"€ {nome}", value=prezzo_def, key=f"p_{nome}")
-                pax = c2.number_input("Invitati", min_value=0, key=f"x_{nome}")
-                qta = 1 
-            elif "Truffle" in nome:
-                c1, c2 = st.columns(2)
-                p_unit = c1.number_input(f"€ {nome}", value=prezzo_def, key=f"p_{nome}")
-                pax = c2.number_input("Partecipanti", min_value=0, key=f"x_{nome}")
-                qta = 1
-            elif "Prima Spesa" in nome:
-                p_unit = st.number_input(f"Costo Scontrino", value=0.0, key=f"p_{nome}"); pax=1; qta=1
-            elif "Transfer" in nome or "Extra Cleaning" in nome:
-                c1, c2 = st.columns(2)
-                p_unit = c1.number_input(f"€ {nome}", value=prezzo_def, key=f"p_{nome}")
-                pax = 1 
-                qta = c2.number_input(f"Quantità/Volte", min_value=0, key=f"q_{nome}")
-            else:
-                c1, c2, c3 = st.columns(3)
-                p_unit = c1.number_input(f"€ {nome}", value=prezzo_def, key=f"p_{nome}")
-                pax = c2.number_input("Pax", min_value=0, key=f"x_{nome}")
-                qta = c3.number_input("Qta", min_value=0, key=f"q_{nome}")
+        st.markdown("### 🍷 Servizi")
+        dettagli_servizi_excel = {}
+        totale_servizi = 0
+    
+        for nome, prezzo_def in LISTA_SERVIZI:
+            with st.expander(f"{nome}"):
+                if "Wedding" in nome:
+                    c1, c2 = st.columns(2)
+                    p_unit = c1.number_input(f"€ {nome}", value=prezzo_def, key=f"p_{nome}")
+                    pax = c2.number_input("Invitati", min_value=0, key=f"x_{nome}")
+                    qta = 1 
+                elif "Truffle" in nome:
+                    c1, c2 = st.columns(2)
+                    p_unit = c1.number_input(f"€ {nome}", value=prezzo_def, key=f"p_{nome}")
+                    pax = c2.number_input("Partecipanti", min_value=0, key=f"x_{nome}")
+                    qta = 1
+                elif "Prima Spesa" in nome:
+                    p_unit = st.number_input(f"Costo Scontrino", value=0.0, key=f"p_{nome}"); pax=1; qta=1
+                elif "Transfer" in nome or "Extra Cleaning" in nome:
+                    c1, c2 = st.columns(2)
+                    p_unit = c1.number_input(f"€ {nome}", value=prezzo_def, key=f"p_{nome}")
+                    pax = 1 
+                    qta = c2.number_input(f"Quantità/Volte", min_value=0, key=f"q_{nome}")
+                else:
+                    c1, c2, c3 = st.columns(3)
+                    p_unit = c1.number_input(f"€ {nome}", value=prezzo_def, key=f"p_{nome}")
+                    pax = c2.number_input("Pax", min_value=0, key=f"x_{nome}")
+                    qta = c3.number_input("Qta", min_value=0, key=f"q_{nome}")
             
-            if (("Prima Spesa" in nome and p_unit > 0) or (p_unit > 0 and pax > 0 and qta > 0)):
-                sub = p_unit * pax * qta
-                totale_servizi += sub
-                dettagli_servizi_excel[nome] = {'p_unit': p_unit, 'pax': pax, 'qta': qta, 'subtotale': sub}
+                voce = voce_servizio(nome, p_unit, pax, qta)
+                if voce:
+                    totale_servizi += voce['subtotale']
+                    dettagli_servizi_excel[nome] = voce
 
-    st.divider()
+        st.divider()
     
-    # --- INPUT SCONTO DIRETTO ---
-    c_sconto_dir, c_sconto_man, c_note = st.columns([1, 1, 2])
-    with c_sconto_dir:
-        perc_sconto_diretto = st.number_input("% Sconto Diretto (vs Airbnb)", value=5.0, step=0.5)
-    with c_sconto_man:
-        sconto = st.number_input("Sconto Manuale Extra (€)", min_value=0.0, step=50.0)
-    with c_note:
-        note = st.text_area("Note interne")
+        # --- INPUT SCONTO DIRETTO ---
+        c_sconto_dir, c_sconto_man, c_note = st.columns([1, 1, 2])
+        with c_sconto_dir:
+            perc_sconto_diretto = st.number_input("% Sconto Diretto (vs Airbnb)", value=5.0, step=0.5, key="perc_sconto_diretto")
+        with c_sconto_man:
+            sconto = st.number_input("Sconto Manuale Extra (€)", min_value=0.0, step=50.0, key="sconto_manuale")
+        with c_note:
+            note = st.text_area("Note interne", key="note_interne")
+        if modo_modulo:
+            st.form_submit_button("✅ APPLICA SERVIZI, SCONTI E NOTE", type="primary", use_container_width=True)
+            st.caption("Le modifiche nel modulo entrano nel preventivo (e nel salvataggio) solo dopo 'Applica'.")
         
-    # --- CALCOLO PREZZO DIRETTO ---
-    # Sconto sul prezzo Airbnb Totale
-    # CORREZIONE: Ora sottrae anche lo sconto manuale (sconto)
-    prezzo_diretto = (prezzo_airbnb_totale * (1 - (perc_sconto_diretto / 100))) - sconto
+    # --- CALCOLO PREZZI (Airbnb lordo, netto Galbino, diretto): vedi galbino/preventivi.py ---
+    prezzi = calcola_prezzi(checkin, notti, ospiti, perc_sconto_diretto, sconto, affitto_manuale)
+    prezzo_airbnb_totale, netto_galbino_totale, prezzo_diretto = prezzi["prezzo_airbnb"], prezzi["netto"], prezzi["diretto"]
 
     # --- VISUALIZZAZIONE COMPARATA ---
     st.markdown("### 💰 Preventivo Comparato")
@@ -396,33 +436,10 @@ def app_preventivi_affitto():
 
     # --- SELEZIONE COSA SALVARE ---
     st.markdown("#### 💾 Salvataggio")
-    scelta_salvataggio = st.radio("Quale proposta vuoi salvare/esportare?", ["Prezzo Airbnb", "Prezzo Diretto", "Solo Netto"], horizontal=True)
-
-    affitto_da_salvare = 0
-    pulizie_da_salvare = 0
-    canale_str = ""
-    
-    # Safe check per i valori da salvare
-    safe_affitto_base = affitto_airbnb_finale if affitto_airbnb_finale else 0
-    safe_extra = costo_extra_listino if costo_extra_listino else 0
-    
-    if scelta_salvataggio == "Prezzo Airbnb":
-        affitto_da_salvare = safe_affitto_base + safe_extra
-        pulizie_da_salvare = PULIZIE_AIRBNB
-        canale_str = "Airbnb"
-    elif scelta_salvataggio == "Prezzo Diretto":
-        fattore_sconto = (1 - (perc_sconto_diretto / 100))
-        affitto_da_salvare = (safe_affitto_base + safe_extra) * fattore_sconto
-        pulizie_da_salvare = PULIZIE_AIRBNB * fattore_sconto
-        canale_str = f"Diretto (-{perc_sconto_diretto}%)"
-    else:
-        # Netto Reale (Airbnb * 0.845)
-        affitto_da_salvare = (safe_affitto_base + safe_extra) * (1 - AIRBNB_COMMISSION)
-        pulizie_da_salvare = PULIZIE_AIRBNB * (1 - AIRBNB_COMMISSION)
-        canale_str = "Netto Interno"
-        
-    totale_finale_doc = affitto_da_salvare + pulizie_da_salvare + totale_servizi - sconto
-    costo_medio_doc = affitto_da_salvare / notti if notti > 0 else 0
+    scelta_salvataggio = st.radio("Quale proposta vuoi salvare/esportare?", list(PROPOSTE), horizontal=True, key="proposta")
+
+    affitto_da_salvare, pulizie_da_salvare, canale_str = importi_proposta(prezzi, scelta_salvataggio, perc_sconto_diretto)
+    totale_finale_doc, costo_medio_doc = totali_documento(affitto_da_salvare, pulizie_da_salvare, dettagli_servizi_excel, sconto, notti)
 
     is_valid = True
     if autore == "Seleziona...": is_valid=False
@@ -432,23 +449,15 @@ def app_preventivi_affitto():
     with b1:
         if st.button("☁️ SALVA SOLO CLOUD", use_container_width=True):
             if is_valid:
-                riga = [autore, canale_str, datetime.date.today().strftime("%d/%m/%Y"), cliente, checkin.strftime("%d/%m/%Y"), checkout.strftime("%d/%m/%Y"), notti, ospiti, affitto_da_salvare, costo_medio_doc, pulizie_da_salvare]
-                for n, _ in LISTA_SERVIZI:
-                    if n in dettagli_servizi_excel: riga.extend([dettagli_servizi_excel[n]['p_unit'], dettagli_servizi_excel[n]['pax'], dettagli_servizi_excel[n]['qta'], dettagli_servizi_excel[n]['subtotale']])
-                    else: riga.extend([0,0,0,0])
-                riga.extend([sconto, totale_finale_doc, note])
+                riga = riga_preventivo(autore, canale_str, cliente, checkin, checkout, notti, ospiti, affitto_da_salvare, costo_medio_doc, pulizie_da_salvare, dettagli_servizi_excel, sconto, totale_finale_doc, note)
                 if salva_su_google_sheets(riga): st.toast(f"✅ Salvato preventivo {canale_str}!");
             else: st.error("Dati incompleti")
             
     with b2:
         if is_valid:
-            excel_data = generate_excel(autore, canale_str, cliente, checkin, checkout, notti, ospiti, affitto_da_salvare, pulizie_da_salvare, dettagli_servizi_excel, sconto, totale_finale_doc, costo_medio_doc, note)
+            excel_data = documento_lazy("preventivo", generate_excel, autore, canale_str, cliente, checkin, checkout, notti, ospiti, affitto_da_salvare, pulizie_da_salvare, dettagli_servizi_excel, sconto, totale_finale_doc, costo_medio_doc, note)
             def callback_save():
-                riga = [autore, canale_str, datetime.date.today().strftime("%d/%m/%Y"), cliente, checkin.strftime("%d/%m/%Y"), checkout.strftime("%d/%m/%Y"), notti, ospiti, affitto_da_salvare, costo_medio_doc, pulizie_da_salvare]
-                for n, _ in LISTA_SERVIZI:
-                    if n in dettagli_servizi_excel: riga.extend([dettagli_servizi_excel[n]['p_unit'], dettagli_servizi_excel[n]['pax'], dettagli_servizi_excel[n]['qta'], dettagli_servizi_excel[n]['subtotale']])
-                    else: riga.extend([0,0,0,0])
-                riga.extend([sconto, totale_finale_doc, note])
+                riga = riga_preventivo(autore, canale_str, cliente, checkin, checkout, notti, ospiti, affitto_da_salvare, costo_medio_doc, pulizie_da_salvare, dettagli_servizi_excel, sconto, totale_finale_doc, note)
                 salva_su_google_sheets(riga)
                 st.toast(f"✅ Salvato e Scaricato ({canale_str})!")
                 
@@ -458,9 +467,109 @@ def app_preventivi_affitto():
 
     if st.session_state['user_role'] == 'admin':
         with st.expander("Admin: Gestione DB"):
+            formato_db = st.radio("Formato", list(FORMATI_EXPORT), horizontal=True)
             if st.button("SCARICA DATABASE AFFITTI COMPLETO"):
-                db = download_full_db_excel()
-                if db: st.download_button("Download DB", db, f"DB_Affitti_{datetime.date.today()}.xlsx")
+                estensione = FORMATI_EXPORT[formato_db]
+                db = download_full_db(estensione)
+                if db: st.download_button("Download DB", db, f"DB_Affitti_{datetime.date.today()}.{estensione}", MIME_EXPORT[estensione])
+            n_doc, byte_doc = get_cache_documenti().occupazione()
+            stat_doc = get_cache_documenti().statistiche
+            st.caption(f"Cache documenti: {n_doc} file ({byte_doc / 1024:.0f} KB), {stat_doc['generati']} generati, {stat_doc['riusati']} riusati")
+            stat = get_connessione_sheets().statistiche()
+            st.caption(f"Connessione Google: {stat['chiamate']} chiamate, {stat['riusi']} riusi, "
+                       f"{stat['secondi_risparmiati']:.1f}s risparmiati (media {stat['risparmio_medio'] * 1000:.0f} ms per chiamata)")
+        pannello_prestazioni()
+
+# ==============================================================================
+# SEZIONE 2B: LISTINO COMPLETO (TUTTI I CHECK-IN x TUTTE LE DURATE)
+# ==============================================================================
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def get_listino(data_da, mesi, ospiti, perc_sconto_diretto, notti_min=MIN_STAY, notti_max=NOTTI_MAX_LISTINO):
+    return calcola_listino(data_da, mesi, ospiti, perc_sconto_diretto, notti_min, notti_max)
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def get_listino_export(data_da, mesi, ospiti, perc_sconto_diretto, formato):
+    df = get_listino(data_da, mesi, ospiti, perc_sconto_diretto)
+    return listino_csv(df) if formato == "csv" else listino_excel(df)
+
+def app_listino_completo():
+    st.title("📋 Listino Completo")
+    st.caption(f"Prezzo Airbnb, Netto Galbino e Prezzo Diretto per ogni data di arrivo e ogni durata da {MIN_STAY} a {NOTTI_MAX_LISTINO} notti (sconto settimanale incluso).")
+    
+    c1, c2, c3, c4 = st.columns(4)
+    with c1: data_da = st.date_input("Check-In dal", datetime.date.today(), format="DD/MM/YYYY")
+    with c2: mesi = st.slider("Mesi", 12, 18, 18)
+    with c3: ospiti = st.number_input("Ospiti", min_value=1, value=10)
+    with c4: perc_sconto_diretto = st.number_input("% Sconto Diretto (vs Airbnb)", value=5.0, step=0.5)
+    
+    t0 = time.perf_counter()
+    df = get_listino(data_da, mesi, int(ospiti), perc_sconto_diretto)
+    st.caption(f"{len(df):,} combinazioni calcolate in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    
+    if df["Oltre Max"].any():
+        st.warning(f"⚠️ Attenzione: {ospiti} persone superano la capienza massima in alcune stagioni (colonna 'Oltre Max').")
+    
+    valore = st.radio("Valore", ["Prezzo Airbnb", "Netto Galbino", "Prezzo Diretto"], horizontal=True)
+    griglia = df.pivot(index="CheckIn", columns="Notti", values=valore)
+    griglia.index = griglia.index.strftime("%d/%m/%Y")
+    st.dataframe(griglia.style.format("€ {:,.0f}"), use_container_width=True, height=500)
+    
+    nome_file = f"Listino_{data_da.strftime('%Y%m%d')}_{mesi}m_{ospiti}pax"
+    b1, b2 = st.columns(2)
+    with b1:
+        st.download_button("📄 SCARICA CSV", lambda: get_listino_export(data_da, mesi, int(ospiti), perc_sconto_diretto, "csv"), f"{nome_file}.csv", "text/csv", use_container_width=True)
+    with b2:
+        st.download_button("💾 SCARICA EXCEL", lambda: get_listino_export(data_da, mesi, int(ospiti), perc_sconto_diretto, "xlsx"), f"{nome_file}.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
+
+# ==============================================================================
+# SEZIONE 2C: FINESTRE LIBERE (QUANDO POSSONO VENIRE?)
+# ==============================================================================
+
+def app_finestre_libere():
+    st.title("🔎 Finestre Libere")
+    st.caption("Tutti i soggiorni disponibili su tutti i canali nel periodo scelto, con il prezzo già calcolato.")
+    
+    c1, c2, c3 = st.columns(3)
+    with c1: data_da = st.date_input("Arrivo dal", datetime.date.today(), format="DD/MM/YYYY")
+    with c2: mesi = st.slider("Mesi", 1, 18, 6)
+    with c3: ospiti = st.number_input("Ospiti", min_value=1, value=10)
+    c4, c5, c6 = st.columns(3)
+    with c4: notti_min, notti_max = st.slider("Notti", MIN_STAY, NOTTI_MAX_LISTINO, (MIN_STAY, 7))
+    with c5: perc_sconto_diretto = st.number_input("% Sconto Diretto (vs Airbnb)", value=5.0, step=0.5)
+    with c6: ordine = st.selectbox("Ordina per", list(ORDINAMENTI))
+    
+    try:
+        calendari = get_calendari()
+        intervalli = calendari.indice().intervalli
+    except Exception as e:
+        st.error(f"⛔ Errore calendario: {e}")
+        return
+    # Senza nessun calendario ogni soggiorno risulterebbe libero: come in check_availability è un errore
+    if len(calendari.mancanti()) == len(calendari.calendari):
+        st.error("⛔ Errore: nessun calendario disponibile")
+        return
+    avvisi_calendari()
+    
+    t0 = time.perf_counter()
+    listino = get_listino(data_da, mesi, int(ospiti), perc_sconto_diretto, notti_min, notti_max)
+    libere = finestre_libere(listino, intervalli, ordine)
+    st.caption(f"{len(libere):,} soggiorni liberi su {len(listino):,} in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    
+    if libere.empty:
+        st.info("Nessuna finestra libera nel periodo.")
+        return
+    if libere["Oltre Max"].any():
+        st.warning(f"⚠️ Attenzione: {ospiti} persone superano la capienza massima in alcune stagioni (colonna 'Oltre Max').")
+    
+    vista = libere.head(500)[["CheckIn", "CheckOut", "Notti", "Prezzo Airbnb", "Media a Notte", "Netto Galbino", "Prezzo Diretto", "Oltre Max"]]
+    euro = st.column_config.NumberColumn(format="€ %.0f")
+    st.dataframe(vista, use_container_width=True, hide_index=True, height=500, column_config={
+        "CheckIn": st.column_config.DateColumn(format="DD/MM/YYYY"),
+        "CheckOut": st.column_config.DateColumn(format="DD/MM/YYYY"),
+        "Prezzo Airbnb": euro, "Media a Notte": euro, "Netto Galbino": euro, "Prezzo Diretto": euro,
+    })
+    if len(libere) > len(vista): st.caption(f"Mostrati i primi {len(vista)}: restringi mesi o notti per vedere gli altri.")
 
 # ==============================================================================
 # SEZIONE 3: APP CATERING MANAGER
@@ -471,44 +580,12 @@ def app_catering_manager():
     
     def salva_db_catering(riga):
         try:
-            client = get_gspread_client()
-            url = st.secrets.get("spreadsheet_url_catering", st.secrets["spreadsheet_url"])
-            sheet = client.open_by_url(url).sheet1
-            sheet.append_row(riga)
+            get_coda_salvataggi().accoda(get_url_catering(), None, [riga])
             return True
         except Exception as e:
             st.error(f"Errore DB Catering: {e}")
             return False
 
-    def genera_excel_catering(cliente, data_evento, status, pax, prezzo, incasso_loc, tot_inc, fc, cost_utenze, kwh_val, p_kwh, staff_tot, tot_costi, marg_eur, marg_perc, staff_list, menu, note):
-        output = io.BytesIO()
-        workbook = xlsxwriter.Workbook(output, {'in_memory': True})
-        ws = workbook.add_worksheet("Catering")
-        fmt_head = workbook.add_format({'bold': True, 'bg_color': '#FFD700', 'border': 1})
-        fmt_curr = workbook.add_format({'num_format': '#,##0.00 €', 'border': 1})
-        
-        ws.write('A1', f"CATERING: {cliente}", fmt_head)
-        ws.write('B1', status, fmt_head)
-        
-        ws.write('A3', "Incasso Totale"); ws.write('B3', tot_inc, fmt_curr)
-        ws.write('A4', "Food Cost"); ws.write('B4', fc, fmt_curr)
-        ws.write('A5', f"Utenze ({kwh_val} kWh * €{p_kwh})"); ws.write('B5', cost_utenze, fmt_curr)
-        ws.write('A6', "Staff Totale"); ws.write('B6', staff_tot, fmt_curr)
-        ws.write('A7', "COSTI TOTALI"); ws.write('B7', tot_costi, fmt_curr)
-        
-        ws.write('A9', "Margine €"); ws.write('B9', marg_eur, fmt_curr)
-        ws.write('A10', "Margine %"); ws.write('B10', marg_perc, workbook.add_format({'num_format': '0.00%'}))
-        
-        ws.write('A12', "DETTAGLIO STAFF", fmt_head)
-        for i, s in enumerate(staff_list): ws.write(12+i+1, 0, s)
-        
-        r_menu = 12+len(staff_list)+3
-        ws.write(r_menu, 0, "MENU", fmt_head)
-        ws.write(r_menu+1, 0, menu)
-        
-        workbook.close()
-        return output.getvalue()
-
     c_status, c_cli = st.columns([1, 3])
     with c_status: status_prev = st.radio("Status", ["PREVENTIVO", "CONSUNTIVO"], horizontal=True)
     with c_cli: cliente = st.text_input("Evento / Cliente")
@@ -540,32 +617,42 @@ def app_catering_manager():
         if costo_utenze > 0:
             st.caption(f"Totale Utenze: € {costo_utenze:.2f}")
     
+    # Personale, margini e salvataggio in un fragment: modificare lo staff
+    # ricalcola solo questa parte, non tutta la pagina
+    sezione_personale(salva_db_catering, status_prev, cliente, data_evento, tipo, pax, prezzo_pax, incasso_loc, totale_incasso, food_cost, costo_utenze, kwh, price_kwh)
+
+@st.fragment
+def sezione_personale(salva_db_catering, status_prev, cliente, data_evento, tipo, pax, prezzo_pax, incasso_loc, totale_incasso, food_cost, costo_utenze, kwh, price_kwh):
     st.markdown("#### Personale")
-    num_staff = st.number_input("N. Staff", 0, value=3)
-    costo_staff_tot = 0.0
-    staff_list = []
-    
-    if num_staff > 0:
-        cols = st.columns([2,2,1,1,1])
-        cols[0].write("Nome"); cols[1].write("Ruolo"); cols[2].write("Ore"); cols[3].write("€/h"); cols[4].write("Tot")
-        ruoli_disponibili = ["Cameriere", "Cuoco", "Aiuto Cuoco", "Lavapiatti", "Extra"]
-        for i in range(int(num_staff)):
-            cc = st.columns([2,2,1,1,1])
-            idx_default = 1 if i == 0 else 0
-            nome = cc[0].text_input(f"n{i}", label_visibility="collapsed")
-            ruolo = cc[1].selectbox(f"r{i}", ruoli_disponibili, index=idx_default, label_visibility="collapsed")
-            ore = cc[2].number_input(f"o{i}", 0.0, value=6.0, step=0.5, label_visibility="collapsed")
-            paga = cc[3].number_input(f"p{i}", 0.0, value=10.0, label_visibility="collapsed")
-            tot = ore * paga
-            costo_staff_tot += tot
-            cc[4].write(f"€{tot:.0f}")
-            if nome: staff_list.append(f"{nome} ({ruolo}): {ore}h x {paga}€ = {tot}€")
+    # Tabella dello staff in session_state: le modifiche dell'editor vengono
+    # applicate nel callback e l'editor riparte (nuova chiave) con i totali aggiornati
+    if "staff_catering" not in st.session_state:
+        st.session_state["staff_catering"] = calcola_staff(staff_iniziale())[0]
+        st.session_state["versione_staff"] = 0
+    chiave_editor = f"editor_staff_{st.session_state['versione_staff']}"
+    
+    def applica_modifiche_staff():
+        staff = applica_modifiche(st.session_state["staff_catering"], st.session_state[chiave_editor])
+        st.session_state["staff_catering"] = calcola_staff(staff)[0]
+        st.session_state["versione_staff"] += 1
+    
+    st.data_editor(
+        st.session_state["staff_catering"], key=chiave_editor, on_change=applica_modifiche_staff,
+        num_rows="dynamic", hide_index=True, use_container_width=True,
+        column_config={
+            "Ruolo": st.column_config.SelectboxColumn(options=RUOLI_STAFF, default="Cameriere", required=True),
+            "Ore": st.column_config.NumberColumn(min_value=0.0, step=0.5, default=ORE_DEFAULT),
+            "€/h": st.column_config.NumberColumn(min_value=0.0, default=PAGA_DEFAULT),
+            "Tot": st.column_config.NumberColumn(format="€%.0f", disabled=True),
+        },
+    )
+    staff, costo_staff_tot = calcola_staff(st.session_state["staff_catering"])
+    staff_list = righe_staff(staff)
             
-    st.write(f"**Totale Staff: € {costo_staff_tot:,.2f}**")
+    st.write(f"**Totale Staff: € {costo_staff_tot:,.2f}** ({len(staff)} persone)")
     
     totale_costi = food_cost + costo_staff_tot + costo_utenze
-    margine = totale_incasso - totale_costi
-    margine_perc = (margine / totale_incasso * 100) if totale_incasso > 0 else 0
+    margine, margine_perc = calcola_margine(totale_incasso, totale_costi)
     
     st.divider()
     m1, m2, m3 = st.columns(3)
@@ -583,13 +670,90 @@ def app_catering_manager():
             if salva_db_catering(riga): st.toast("Salvato!")
             
     with b2:
-        exc = genera_excel_catering(cliente, data_evento, status_prev, pax, prezzo_pax, incasso_loc, totale_incasso, food_cost, costo_utenze, kwh, price_kwh, costo_staff_tot, totale_costi, margine, margine_perc/100, staff_list, menu, note)
+        exc = documento_lazy("catering", genera_excel_catering, cliente, data_evento, status_prev, pax, prezzo_pax, incasso_loc, totale_incasso, food_cost, costo_utenze, kwh, price_kwh, costo_staff_tot, totale_costi, margine, margine_perc/100, staff_list, menu, note)
         st.download_button("💾 SCARICA REPORT", exc, f"Cat_{cliente}.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
 
+# ==============================================================================
+# SEZIONE 3B: CRUSCOTTO CATERING (MARGINI DEGLI EVENTI SALVATI)
+# ==============================================================================
+# Eventi e aggregati in memoria per processo, aggiornati solo con le righe nuove
+@st.cache_resource
+def get_cruscotto_catering():
+    return CruscottoCatering()
+
+def sorgente_catering():
+    # -> (generazione, leggi(n) = righe dopo la riga n, eventi in coda non ancora letti)
+    url = get_url_catering()
+    if usa_archivio() and url != st.secrets["spreadsheet_url"]:
+        rep = get_replicatore()
+        if not rep.archivio.pronto("catering"):
+            rep.aggiorna("catering")
+        generazione, letto_il = rep.archivio.generazione("catering"), rep.archivio.letto_il("catering")
+        if "catering" in rep.errori: badge_non_aggiornati("DB catering", letto_il, rep.errori["catering"])
+        leggi = lambda n: rep.archivio.righe("catering", con_intestazione=False, dopo_riga=n)
+    else:
+        # DB catering dal foglio, scaricando solo le righe nuove
+        sinc = get_sync_catering()
+        try:
+            righe = sinc.sincronizza(get_connessione_sheets().foglio(url))
+        except Exception as e:
+            # Google lento o irraggiungibile: si resta sull'ultima copia buona (snapshot su disco)
+            if not sinc.righe or not errore_transitorio(e): raise
+            badge_non_aggiornati("DB catering", sinc.ultima_lettura["inizio"], e)
+            righe = list(sinc.righe)
+        generazione, letto_il = sinc.generazione, sinc.ultima_lettura["inizio"]
+        leggi = lambda n: righe[n:]
+    # Gli eventi appena salvati contano subito, anche prima dell'invio a Google
+    in_attesa = get_coda_salvataggi().in_attesa(url, None, inviate_dopo=letto_il)
+    return generazione, leggi, in_attesa
+
+def app_cruscotto_catering():
+    st.title("📈 Cruscotto Catering")
+    cruscotto = get_cruscotto_catering()
+    try:
+        generazione, leggi, in_attesa = sorgente_catering()
+    except Exception as e:
+        get_connessione_sheets().invalida_se_serve(e)
+        # Google lento o irraggiungibile: restano gli ultimi aggregati calcolati dal processo
+        if not errore_transitorio(e) or cruscotto.generazione is None:
+            st.error(f"Errore lettura DB Catering: {e}")
+            return
+        badge_non_aggiornati("DB catering", None, e)
+        in_attesa = get_coda_salvataggi().in_attesa(get_url_catering(), None)
+    else:
+        cruscotto.aggiorna(generazione, leggi)
+    
+    per_status = cruscotto.per_gruppo(["Status"], in_attesa)
+    if per_status.empty:
+        st.info("Nessun evento salvato.")
+        return
+    colonne = st.columns(len(per_status))
+    for col, (status, r) in zip(colonne, per_status.iterrows()):
+        col.metric(f"{status} ({int(r['Eventi'])} eventi)", f"{r['Margine %']:.1f}%",
+                   f"Food € {r['Food cost/pax €']:.2f}/pax · Staff € {r['Staff/pax €']:.2f}/pax", delta_color="off")
+    
+    formati = {c: st.column_config.NumberColumn(format="%.1f%%" if c.endswith("%") else "€ %.2f")
+               for c in ["Incasso €", "Costi €", "Margine €", "Margine %", "Food cost/pax €", "Staff/pax €"]}
+    livelli = st.multiselect("Raggruppa per", LIVELLI, default=["Mese", "Status"])
+    if livelli:
+        st.dataframe(cruscotto.per_gruppo(livelli, in_attesa), use_container_width=True, column_config=formati)
+    
+    st.subheader("Preventivo vs Consuntivo")
+    confronto = cruscotto.confronto(in_attesa)
+    if confronto.empty:
+        st.caption("Nessun evento con sia preventivo che consuntivo (stesso cliente e data).")
+        return
+    st.caption(f"{len(confronto)} eventi · scostamento medio margine € {confronto['Δ Margine €'].mean():,.2f}")
+    formati = {c: st.column_config.NumberColumn(format="%.1f%%" if c.endswith("%") else "€ %.2f") for c in confronto.columns[3:]}
+    formati["Data"] = st.column_config.DateColumn(format="DD/MM/YYYY")
+    st.dataframe(confronto, use_container_width=True, hide_index=True, column_config=formati)
+
 # ==============================================================================
 # MAIN LOOP
 # ==============================================================================
 
+avvia_riscaldamento()
+
 if check_login():
     st.sidebar.title("Navigazione")
     st.sidebar.write(f"Utente: **{st.session_state['user_name']}**")
@@ -598,16 +762,24 @@ if check_login():
     app_mode = None
     
     if role == 'admin':
-        app_mode = st.sidebar.radio("Vai a:", ["🏰 Preventivi Affitto", "👨‍🍳 Catering Manager"])
+        app_mode = st.sidebar.radio("Vai a:", ["🏰 Preventivi Affitto", "🔎 Finestre Libere", "📋 Listino Completo", "👨‍🍳 Catering Manager", "📈 Cruscotto Catering"])
     elif role == 'affitti':
-        app_mode = "🏰 Preventivi Affitto"
+        app_mode = st.sidebar.radio("Vai a:", ["🏰 Preventivi Affitto", "🔎 Finestre Libere", "📋 Listino Completo"])
     elif role == 'catering':
-        app_mode = "👨‍🍳 Catering Manager"
+        app_mode = st.sidebar.radio("Vai a:", ["👨‍🍳 Catering Manager", "📈 Cruscotto Catering"])
         
     if st.sidebar.button("Esci"):
         logout()
+    stato_salvataggi()
+    if usa_archivio(): get_replicatore()
 
     if app_mode == "🏰 Preventivi Affitto":
-        app_preventivi_affitto()
+        with span("rerun.preventivi_affitto"): app_preventivi_affitto()
+    elif app_mode == "🔎 Finestre Libere":
+        with span("rerun.finestre_libere"): app_finestre_libere()
+    elif app_mode == "📋 Listino Completo":
+        with span("rerun.listino_completo"): app_listino_completo()
     elif app_mode == "👨‍🍳 Catering Manager":
-        app_catering_manager()
+        with span("rerun.catering_manager"): app_catering_manager()
+    elif app_mode == "📈 Cruscotto Catering":
+        with span("rerun.cruscotto_catering"): app_cruscotto_catering()